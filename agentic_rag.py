@@ -1,18 +1,37 @@
 import os
 import sys
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
 from dotenv import load_dotenv
-from typing import Annotated, List, Literal
+from typing import Annotated, List, Literal, Optional, Sequence, Union
 from typing_extensions import TypedDict
 
 # LangChain / LangGraph imports
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_chroma import Chroma
 from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser, JsonOutputParser
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import END, StateGraph, START
 
+from ingestion import sync_index, indexed_chunk_count, indexed_partitions, manifest_version
+from embedding_cache import CachedEmbeddings
+from llm_gateway import LLMGateway, LLM_TIMEOUT
+from fast_router import FastRouter
+from numpy_store import NumpyVectorStore
+from lexical_index import load_or_build as load_lexical_index
+from context_packer import pack_context
+from ranking import reciprocal_rank_fusion, rrf_scores, shingles, maximal_marginal_relevance
+from decomposition import DecompositionCache, can_skip
+from grade_filter import ScoreFilter
+from partitions import DATA_DIRS, PARTITION_KEY, PartitionRouter, where
+from sessions import Session, compact
+from telemetry import (
+    LLMTelemetryHandler, traced_node, record_documents, record_decomposition, record_grade_decisions,
+    start_trace
+)
+
 load_dotenv()
 
 # --- Configuration & Setup ---
@@ -20,65 +39,110 @@ if "GOOGLE_API_KEY" not in os.environ:
     print("Error: GOOGLE_API_KEY environment variable not found.")
     sys.exit(1)
 
-# Initialize Gemini LLM
-llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash", temperature=0)
+# Initialize Gemini LLM behind the shared gateway (rate limits, retries,
+# timeouts; see llm_gateway.py). Retries are left to the gateway. Every call
+# is recorded by the telemetry handler.
+llm = LLMGateway(
+    inner=ChatGoogleGenerativeAI(
+        model="gemini-2.0-flash", temperature=0, timeout=LLM_TIMEOUT, max_retries=1
+    ),
+    callbacks=[LLMTelemetryHandler()],
+)
 
-# Initialize Embeddings
-embeddings = GoogleGenerativeAIEmbeddings(model="models/gemini-embedding-001")
+# Initialize Embeddings (cached on disk, shared by ingestion and retrieval)
+embeddings = CachedEmbeddings(GoogleGenerativeAIEmbeddings(model="models/gemini-embedding-001"))
 
 # --- Vector Store Setup ---
-VECTORSTORE_DIR = "./chroma_db"
+# "chroma" (default) or "numpy": a memory-mapped matrix shared by all worker
+# processes through the OS page cache (see numpy_store.py).
+VECTORSTORE_BACKEND = os.environ.get("VECTORSTORE_BACKEND", "chroma")
+VECTORSTORE_DIR = "./numpy_index" if VECTORSTORE_BACKEND == "numpy" else "./chroma_db"
+RETRIEVAL_K = int(os.environ.get("RETRIEVAL_K", "4"))
+# Chunks passed on to grading after fusing all sub-question results
+RETRIEVAL_BUDGET = int(os.environ.get("RETRIEVAL_BUDGET", "8"))
+VECTORSTORE_MAX_WORKERS = int(os.environ.get("VECTORSTORE_MAX_WORKERS", "4"))
+# Fuse BM25 results with the vector search (set to 0 for vector-only retrieval)
+HYBRID_SEARCH = os.environ.get("HYBRID_SEARCH", "1") == "1"
 vectorstore = None
 retriever = None
+lexical_index = None
+# Partitions (source folders) present in the active index
+available_partitions = []
 
-def setup_vectorstore(data_dir: str = "./database"):
-    global vectorstore, retriever
-    print(f"Scanning directory: {data_dir}...")
-    
-    if not os.path.exists(data_dir):
-        print(f"Directory '{data_dir}' not found. Creating it...")
-        os.makedirs(data_dir)
-        print("Please put your PDF files in the 'database' folder and restart.")
+# Bounded pool for blocking vector-store searches
+vectorstore_executor = ThreadPoolExecutor(
+    max_workers=VECTORSTORE_MAX_WORKERS, thread_name_prefix="vectorstore"
+)
+
+def run_blocking(func, *args):
+    """
+    Run a blocking call on vectorstore_executor in a copy of the caller's
+    context. run_in_executor alone drops contextvars, so the request's trace
+    (telemetry.py) would miss the embedding calls made there.
+    """
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(vectorstore_executor, contextvars.copy_context().run, func, *args)
+
+def open_vectorstore(persist_dir: str = VECTORSTORE_DIR):
+    """
+    Open the persisted vector store of the configured backend.
+    """
+    if VECTORSTORE_BACKEND == "numpy":
+        return NumpyVectorStore(embeddings, persist_dir)
+    # Chroma is the slowest import of the stack; the numpy backend never needs it.
+    from langchain_chroma import Chroma
+    return Chroma(
+        collection_name="rag-chroma",
+        embedding_function=embeddings,
+        persist_directory=persist_dir,
+    )
+
+def setup_vectorstore(
+    data_dirs: Union[str, Sequence[str]] = DATA_DIRS, persist_dir: str = VECTORSTORE_DIR, sync: bool = True
+):
+    """
+    Open the persisted index and make it the active vector store. With `sync`
+    (or when nothing is indexed yet) new or changed PDFs in data_dirs are
+    embedded first; without it a prebuilt index is used as is.
+    """
+    if not sync and indexed_chunk_count(persist_dir):
+        print(f"Opening prebuilt index: {persist_dir}")
+        _activate_vectorstore(open_vectorstore(persist_dir), persist_dir)
         return
 
-    # Find all PDFs
-    pdf_files = [f for f in os.listdir(data_dir) if f.lower().endswith(".pdf")]
-    
-    if not pdf_files:
-        print("No PDF files found in 'database' folder.")
+    if isinstance(data_dirs, str):
+        data_dirs = [data_dirs]
+    print(f"Scanning directories: {', '.join(data_dirs)}...")
+
+    missing = [data_dir for data_dir in data_dirs if not os.path.exists(data_dir)]
+    for data_dir in missing:
+        print(f"Directory '{data_dir}' not found. Creating it...")
+        os.makedirs(data_dir)
+    if len(missing) == len(data_dirs):
+        print(f"Please put your PDF files in {', '.join(data_dirs)} and restart.")
         return
 
-    all_docs = []
-    for pdf_file in pdf_files:
-        path = os.path.join(data_dir, pdf_file)
-        print(f"Loading: {pdf_file}...")
-        try:
-            loader = PyPDFLoader(path)
-            all_docs.extend(loader.load())
-        except Exception as e:
-            print(f"Failed to load {pdf_file}: {e}")
+    # Open the persisted collection; only new or changed PDFs get embedded.
+    print("Opening Vector Store...")
+    store = open_vectorstore(persist_dir)
+    files_indexed, chunks_added, chunks_deleted = sync_index(store, data_dirs, persist_dir)
+    print(f"Files re-indexed: {files_indexed}, chunks added: {chunks_added}, chunks deleted: {chunks_deleted}")
 
-    if not all_docs:
+    total_chunks = indexed_chunk_count(persist_dir)
+    if not total_chunks:
         print("No valid documents loaded.")
         return
+    print(f"Total indexed chunks: {total_chunks}")
+    _activate_vectorstore(store, persist_dir)
 
-    # Split text
-    text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
-        chunk_size=1000, chunk_overlap=200
-    )
-    doc_splits = text_splitter.split_documents(all_docs)
-    print(f"Total split chunks: {len(doc_splits)}")
-
-    # Create Dictionary
-    # Note: For production, you might want to persist this. 
-    # Here we recreate it for the script run.
-    print("Creating Vector Store...")
-    vectorstore = Chroma.from_documents(
-        documents=doc_splits,
-        collection_name="rag-chroma",
-        embedding=embeddings,
-    )
-    retriever = vectorstore.as_retriever()
+def _activate_vectorstore(store, persist_dir):
+    global vectorstore, retriever, lexical_index, available_partitions
+    if HYBRID_SEARCH:
+        lexical_index = load_lexical_index(persist_dir, store, manifest_version(persist_dir), PARTITION_KEY)
+    available_partitions = indexed_partitions(persist_dir)
+    print(f"Partitions: {', '.join(available_partitions)}")
+    vectorstore = store
+    retriever = vectorstore.as_retriever(search_kwargs={"k": RETRIEVAL_K})
     print("Vector Store Ready.")
 
 # --- Graph Dictionary ---
@@ -96,124 +160,585 @@ class GraphState(TypedDict):
     question: str
     generation: str
     documents: List[str]
+    scores: List[Optional[float]]  # vector relevance per document, None if found by BM25 only
     sub_questions: List[str]
+    partitions: Optional[List[str]]  # set by route_partitions; None searches every partition
     chat_history: List[str] # added chat_history
+    route: str  # set by plan_query in the "planner" topology
+
+# --- Prompts ---
+
+DECOMPOSE_PROMPT = PromptTemplate(
+    template="""Sen karmaşık bir soruyu daha basit alt sorulara bölen akıllı bir asistansın.
+
+    GEÇMİŞ KONUŞMA:
+    {chat_history}
+
+    GÖREVİN:
+    Kullanıcının sorduğu soruyu analiz et. Eğer soru geçmiş konuşmaya atıfta bulunuyorsa (örneğin "bu ne demek", "olmadı" gibi), geçmişi kullanarak soruyu netleştir.
+    Soruyu cevaplamak için gereken alt soruları listele.
+
+    KURALLAR:
+    1. Sadece gerekli olan soruları üret.
+    2. Geçmiş konuşmayı dikkate alarak eksik bilgileri tamamla (Coreference Resolution).
+    3. SORGU GENİŞLETME (ÖNEMLİ): Eğer soru bir işlemin nasıl yapılacağını soruyorsa, mutlaka 3 farklı varyasyon üret:
+       a) Orijinal soru (örn: "nasıl üye olurum")
+       b) Resmi/Edilgen hali (örn: "üyelik işlemleri nasıl yapılır", "üyelik başvuru süreci")
+       c) Gereklilik hali (örn: "üyelik için gerekli belgeler nelerdir")
+    4. CEVABI SADECE JSON FORMATINDA VER. Başka hiçbir metin ekleme.
+
+    Orijinal Soru: {question}
+
+    İstenen JSON Formatı:
+    {{
+        "sub_questions": ["Orijinal Soru?", "Resmi Soru Varyasyonu?", "Gereklilik Soru Varyasyonu?"]
+    }}
+    """,
+    input_variables=["question", "chat_history"],
+)
+
+GENERATE_PROMPT = PromptTemplate(
+    template="""Sen yardımsever, özgüvenli ve çözüm odaklı bir müşteri hizmetleri temsilcisisin.
+
+    GÖREVİN:
+    Aşağıdaki bilgi parçalarını kullanarak müşterinin sorusuna DOĞRUDAN ve NET bir cevap ver.
+
+    KURALLAR:
+    1. ASLA "Belgede yazıyor", "Bağlamda belirtilmiş", "Dokümana göre" gibi ifadeler kullanma. Sanki bu bilgileri ezbere biliyormuşsun gibi konuş.
+    2. Müşteriye "SİZ" diliyle hitap et (Örn: "Yapabilirsiniz", "Edersiniz").
+    3. Eğer net bir adım-adım kılavuz yoksa bile, elindeki ipuçlarını birleştirerek en mantıklı yolu tarif et. (Örn: "Sisteme giriş ekranından kayıt olabilirsiniz").
+    4. Olumsuz konuşma ("Bilgi yok" deme). Onun yerine alternatif çözüm sun ("Bu konuda en doğru bilgiyi öğrenci işlerinden alabilirsiniz" de).
+    5. Cevabı kısa tut (Maksimum 3-4 cümle).
+    6. Her zaman TÜRKÇE cevap ver.
+
+    Soru: {question}
+    Bilgi Parçaları: {context}
+
+    Senin Cevabın:""",
+    input_variables=["question", "context"],
+)
+
+ROUTE_PROMPT = PromptTemplate(
+    template="""Sen gelen mesajları sınıflandıran bir uzmansın.
+    Gelen mesajın "TEKNİK" (SADOS, eğitim, sınav, sertifika, ödeme, giriş sorunları) mi yoksa "SOHBET" (selamlaşma, teşekkür, şikayet, sitem, rastgele konuşma) mi olduğuna karar ver.
+
+    Mesaj: {question}
+
+    Sadece 'RAG' (teknikse) veya 'CHITCHAT' (sohbetse) kelimesini döndür.
+    """,
+    input_variables=["question"],
+)
+
+CHITCHAT_PROMPT = PromptTemplate(
+    template="""Sen yardımsever bir müşteri hizmetleri asistanısın.
+    Kullanıcının mesajına, geçmiş konuşmayı da dikkate alarak nazik, profesyonel ve insancıl bir cevap ver.
+
+    GEÇMİŞ KONUŞMA:
+    {chat_history}
+
+    Kullanıcı Mesajı: {question}
+
+    Cevap:""",
+    input_variables=["question", "chat_history"],
+)
+
+PLAN_PROMPT = PromptTemplate(
+    template="""Sen gelen mesajları sınıflandıran ve teknik soruları arama sorgularına bölen akıllı bir asistansın.
+
+    GEÇMİŞ KONUŞMA:
+    {chat_history}
+
+    GÖREVİN:
+    1. Mesajın "RAG" (SADOS, eğitim, sınav, sertifika, ödeme, giriş sorunları gibi teknik bir soru) mu yoksa "CHITCHAT" (selamlaşma, teşekkür, şikayet, sitem, rastgele konuşma) mı olduğuna karar ver.
+    2. Mesaj geçmiş konuşmaya atıfta bulunuyorsa (örneğin "bu ne demek", "olmadı"), geçmişi kullanarak soruyu netleştir (Coreference Resolution).
+    3. RAG ise soruyu cevaplamak için gereken alt soruları listele. Soru bir işlemin nasıl yapılacağını soruyorsa 3 varyasyon üret: orijinal soru, resmi/edilgen hali, gereklilik hali.
+    4. CEVABI SADECE JSON FORMATINDA VER. Başka hiçbir metin ekleme.
+
+    Mesaj: {question}
+
+    İstenen JSON Formatı:
+    {{
+        "route": "RAG veya CHITCHAT",
+        "question": "Netleştirilmiş soru",
+        "sub_questions": ["Orijinal Soru?", "Resmi Soru Varyasyonu?", "Gereklilik Soru Varyasyonu?"]
+    }}
+    """,
+    input_variables=["question", "chat_history"],
+)
+
+SUMMARY_PROMPT = PromptTemplate(
+    template="""Sen bir müşteri hizmetleri konuşmasını özetleyen bir asistansın.
+
+    MEVCUT ÖZET:
+    {summary}
+
+    YENİ MESAJLAR:
+    {turns}
+
+    GÖREVİN:
+    Mevcut özeti yeni mesajlarla birleştirerek kısa bir özet yaz (en fazla 5 cümle).
+    Kullanıcının sorduğu konuları, verilen önemli cevapları ve açık kalan sorunları koru.
+    Sadece özeti yaz, başka hiçbir metin ekleme.""",
+    input_variables=["summary", "turns"],
+)
+
+# Upper bound on planner sub-questions; longer lists fail validation
+PLAN_MAX_SUB_QUESTIONS = 5
+
+def format_history(chat_history) -> str:
+    return "\\n".join(chat_history) if chat_history else "Yok"
 
 # --- Nodes ---
+# Every node has a synchronous version used by `app.invoke` and an async twin
+# (prefixed with "a") used by `app.ainvoke`. The async versions call the LLM
+# with `ainvoke`/`abatch` and push blocking vector-store work to
+# `vectorstore_executor`, so the event loop is never blocked.
+
+# Memoized LLM decompositions, keyed by question and chat history
+decomposition_cache = DecompositionCache()
+
+def _decomposition_inputs(state):
+    return {
+        "question": state["question"],
+        "chat_history": format_history(state.get("chat_history", [])),
+    }
+
+def _decomposition_shortcut(state):
+    """
+    Sub-questions available without an LLM call, or None.
+    """
+    question = state["question"]
+    chat_history = state.get("chat_history", [])
+    if can_skip(question, chat_history):
+        print("---DECOMPOSITION SKIPPED: SELF-CONTAINED QUESTION---")
+        record_decomposition("skipped")
+        return {"sub_questions": [question]}
+    cached = decomposition_cache.get(question, chat_history)
+    if cached is not None:
+        print(f"---DECOMPOSITION CACHED---\nGenerated sub-questions: {cached}")
+        record_decomposition("cached")
+        return {"sub_questions": cached}
+    return None
+
+def _sub_questions_from(response, state):
+    question = state["question"]
+    sub_questions = response.get("sub_questions") if isinstance(response, dict) else None
+    # Validation
+    if isinstance(sub_questions, list):
+        sub_questions = [q for q in sub_questions if isinstance(q, str) and q.strip()]
+    if not sub_questions or not isinstance(sub_questions, list):
+        sub_questions = [question]
+        record_decomposition("failed")
+    else:
+        decomposition_cache.put(question, state.get("chat_history", []), sub_questions)
+        record_decomposition("llm")
+    print(f"Generated sub-questions: {sub_questions}")
+    return {"sub_questions": sub_questions}
 
 def decompose_query(state):
     """
     Decompose the query into sub-questions.
     """
     print("---DECOMPOSE QUERY---")
-    question = state["question"]
-    
-    # Prompt to decompose
-    prompt = PromptTemplate(
-        template="""Sen karmaşık bir soruyu daha basit alt sorulara bölen akıllı bir asistansın.
-        
-        GEÇMİŞ KONUŞMA:
-        {chat_history}
-        
-        GÖREVİN:
-        Kullanıcının sorduğu soruyu analiz et. Eğer soru geçmiş konuşmaya atıfta bulunuyorsa (örneğin "bu ne demek", "olmadı" gibi), geçmişi kullanarak soruyu netleştir.
-        Soruyu cevaplamak için gereken alt soruları listele.
-        
-        KURALLAR:
-        1. Sadece gerekli olan soruları üret.
-        2. Geçmiş konuşmayı dikkate alarak eksik bilgileri tamamla (Coreference Resolution).
-        3. SORGU GENİŞLETME (ÖNEMLİ): Eğer soru bir işlemin nasıl yapılacağını soruyorsa, mutlaka 3 farklı varyasyon üret:
-           a) Orijinal soru (örn: "nasıl üye olurum")
-           b) Resmi/Edilgen hali (örn: "üyelik işlemleri nasıl yapılır", "üyelik başvuru süreci")
-           c) Gereklilik hali (örn: "üyelik için gerekli belgeler nelerdir")
-        4. CEVABI SADECE JSON FORMATINDA VER. Başka hiçbir metin ekleme.
-        
-        Orijinal Soru: {question}
-        
-        İstenen JSON Formatı:
-        {{
-            "sub_questions": ["Orijinal Soru?", "Resmi Soru Varyasyonu?", "Gereklilik Soru Varyasyonu?"]
-        }}
-        """,
-        input_variables=["question", "chat_history"],
-    )
-    
-    chain = prompt | llm | JsonOutputParser()
+    shortcut = _decomposition_shortcut(state)
+    if shortcut is not None:
+        return shortcut
+    chain = DECOMPOSE_PROMPT | llm | JsonOutputParser()
     try:
-        # Pass chat_history from state, default to empty list if none
-        history = state.get("chat_history", [])
-        # Format history as a string for the prompt
-        formatted_history = "\\n".join(history) if history else "Yok"
-        
-        response = chain.invoke({"question": question, "chat_history": formatted_history})
-        sub_questions = response.get("sub_questions", [question])
+        response = chain.invoke(_decomposition_inputs(state))
     except Exception as e:
         print(f"Decomposition failed: {e}")
-        sub_questions = [question]
-        
-    # Validation
-    if not sub_questions:
-        sub_questions = [question]
-        
-    print(f"Generated sub-questions: {sub_questions}")
-    return {"sub_questions": sub_questions}
+        response = None
+    return _sub_questions_from(response, state)
+
+async def adecompose_query(state):
+    """
+    Async version of decompose_query.
+    """
+    print("---DECOMPOSE QUERY---")
+    shortcut = _decomposition_shortcut(state)
+    if shortcut is not None:
+        return shortcut
+    chain = DECOMPOSE_PROMPT | llm | JsonOutputParser()
+    try:
+        response = await chain.ainvoke(_decomposition_inputs(state))
+    except Exception as e:
+        print(f"Decomposition failed: {e}")
+        response = None
+    return _sub_questions_from(response, state)
+
+def _search_vector(vector, filter=None):
+    """
+    (chunk, relevance) pairs for one query vector; higher relevance is more similar.
+    """
+    pairs = vectorstore.similarity_search_by_vector_with_relevance_scores(vector, k=RETRIEVAL_K, filter=filter)
+    relevance = vectorstore._select_relevance_score_fn()
+    return [(doc, relevance(distance)) for doc, distance in pairs]
+
+def _multi_query_search() -> bool:
+    # Backends that can search several query vectors in one matrix multiply
+    return hasattr(vectorstore, "similarity_search_with_score_by_vectors")
+
+def _with_lexical(query, dense, partitions=None):
+    """
+    Fuse one query's scored vector results with its BM25 results (from the
+    same partitions) when the lexical index is loaded. Returns at most
+    RETRIEVAL_K (chunk, relevance) pairs; chunks only BM25 found have no
+    relevance score (None).
+    """
+    if lexical_index is None:
+        return dense
+
+    scores = {doc_key(doc): score for doc, score in dense}
+    hits = [chunk_id for chunk_id, _ in lexical_index.search(query, k=RETRIEVAL_K, partitions=partitions)]
+    found = {doc_key(doc): doc for doc, _ in dense}
+    missing = [chunk_id for chunk_id in hits if chunk_id not in found]
+    if missing:
+        found.update((doc_key(doc), doc) for doc in vectorstore.get_by_ids(missing))
+    lexical = [found[chunk_id] for chunk_id in hits if chunk_id in found]
+    fused = reciprocal_rank_fusion([[doc for doc, _ in dense], lexical], key=doc_key)[:RETRIEVAL_K]
+    return [(doc, scores.get(doc_key(doc))) for doc in fused]
+
+def search_queries(queries: List[str], partitions: Optional[List[str]] = None) -> List[List]:
+    """
+    Embed all queries in one batch call and run the searches in parallel,
+    restricted to `partitions` (None searches all). Returns one list of
+    (chunk, relevance) pairs per query.
+    """
+    vectors = embeddings.embed_queries(queries)
+    filter = where(partitions)
+    if _multi_query_search():
+        # Cosine similarities, i.e. already relevance scores
+        dense = vectorstore.similarity_search_with_score_by_vectors(vectors, k=RETRIEVAL_K, filter=filter)
+    else:
+        dense = list(vectorstore_executor.map(_search_vector, vectors, repeat(filter)))
+    return list(vectorstore_executor.map(_with_lexical, queries, dense, repeat(partitions)))
+
+async def asearch_queries(queries: List[str], partitions: Optional[List[str]] = None) -> List[List]:
+    """
+    Async version of search_queries; all blocking work runs on vectorstore_executor.
+    """
+    vectors = await run_blocking(embeddings.embed_queries, queries)
+    filter = where(partitions)
+    if _multi_query_search():
+        dense = await run_blocking(vectorstore.similarity_search_with_score_by_vectors, vectors, RETRIEVAL_K, filter)
+    else:
+        dense = await asyncio.gather(*(run_blocking(_search_vector, vector, filter) for vector in vectors))
+    return list(await asyncio.gather(*(
+        run_blocking(_with_lexical, query, results, partitions)
+        for query, results in zip(queries, dense)
+    )))
+
+async def aembed_question(question: str):
+    """
+    Embed a single question off the event loop (used by the answer cache).
+    """
+    return await run_blocking(embeddings.embed_query, question)
+
+def doc_key(doc) -> str:
+    """
+    Identity of a retrieved chunk, used to fuse results across searches.
+    """
+    return doc.id or doc.metadata.get("chunk_id") or doc.page_content
+
+def content_key(doc) -> str:
+    """
+    Identity of a chunk's text. Byte-identical PDFs under different paths
+    (the same specification in both data directories) give chunks with
+    different IDs but the same text.
+    """
+    return doc.page_content
+
+def select_documents(results: List[List]):
+    """
+    Fuse the per-query (chunk, relevance) lists with reciprocal rank fusion
+    and pick at most RETRIEVAL_BUDGET chunks with MMR, so overlapping chunks
+    of the same passage do not crowd out others. Chunks with identical text
+    are fused into one. The cost of grading and generation is bounded by the
+    budget, not by the number of sub-questions.
+    Returns (documents, scores); a chunk's score is its best relevance to any
+    of the queries.
+    """
+    best = {}
+    for pairs in results:
+        for doc, score in pairs:
+            if score is not None:
+                key = content_key(doc)
+                best[key] = max(score, best.get(key, score))
+    scored = rrf_scores([[doc for doc, _ in pairs] for pairs in results], key=content_key)
+    if len(scored) <= 1:
+        documents = [doc for doc, _ in scored]
+    else:
+        features = [shingles(doc.page_content) for doc, _ in scored]
+        documents = maximal_marginal_relevance(scored, features, RETRIEVAL_BUDGET)
+    return documents, [best.get(content_key(doc)) for doc in documents]
+
+def _retrieval_queries(state):
+    return list(dict.fromkeys(state.get("sub_questions") or [state["question"]]))
+
+# Picks the partitions (source folders) to search; see partitions.py
+partition_router = PartitionRouter()
+
+def route_partitions(state):
+    """
+    Choose the partitions retrieve searches.
+    """
+    print("---ROUTE PARTITIONS---")
+    partitions = partition_router.route(_retrieval_queries(state), available_partitions, embeddings)
+    return {"partitions": partitions}
+
+async def aroute_partitions(state):
+    """
+    Async version of route_partitions; the embedding stage runs off the loop.
+    """
+    print("---ROUTE PARTITIONS---")
+    queries = _retrieval_queries(state)
+    decided, partitions = partition_router.route_local(queries, available_partitions)
+    if not decided:
+        partitions = await run_blocking(partition_router.route_embedding, queries, available_partitions, embeddings)
+    return {"partitions": partitions}
+
+def _search_request(state):
+    queries = _retrieval_queries(state)
+    partitions = state.get("partitions")
+    print(f"Searching for: {queries}" + (f" in {', '.join(partitions)}" if partitions else ""))
+    return queries, partitions
+
+def _retrieval_result(state, selected):
+    documents, scores = selected
+    print(f"Total unique documents retrieved: {len(documents)}")
+    record_documents("retrieved", len(documents))
+    return {"documents": documents, "scores": scores, "question": state["question"]}
 
 def retrieve(state):
     """
     Retrieve documents
     """
     print("---RETRIEVE---")
-    question = state["question"]
-    sub_questions = state.get("sub_questions", [question])
-    
-    all_documents = []
-    seen_content = set()
-    
-    for q in sub_questions:
-        print(f"Searching for: {q}")
-        documents = retriever.invoke(q)
-        for doc in documents:
-            # Simple deductive based on page content to avoid duplicates from overlapping searches
-            if doc.page_content not in seen_content:
-                seen_content.add(doc.page_content)
-                all_documents.append(doc)
-    
-    print(f"Total unique documents retrieved: {len(all_documents)}")
-    return {"documents": all_documents, "question": question}
+    results = search_queries(*_search_request(state))
+    return _retrieval_result(state, select_documents(results))
 
-def grade_documents(state):
+# Set by batch.answer_batch: searches of concurrent graph runs are then
+# coalesced, so overlapping sub-questions are embedded and searched once.
+retrieval_batcher = contextvars.ContextVar("retrieval_batcher", default=None)
+
+async def aretrieve(state):
     """
-    Determines whether the retrieved documents are relevant to the question.
+    Async version of retrieve.
     """
-    print("---CHECK RELEVANCE---")
-    question = state["question"]
+    print("---RETRIEVE---")
+    batcher = retrieval_batcher.get()
+    search = batcher.search if batcher is not None else asearch_queries
+    results = await search(*_search_request(state))
+    selected = await run_blocking(select_documents, results)
+    return _retrieval_result(state, selected)
+
+# --- Grading Configuration ---
+# "concurrent": one LLM call per chunk, run in parallel.
+# "batch": GRADING_BATCH_SIZE chunks per LLM call, one verdict per chunk ID.
+GRADING_MODE = os.environ.get("GRADING_MODE", "concurrent")
+GRADING_MAX_CONCURRENCY = int(os.environ.get("GRADING_MAX_CONCURRENCY", "4"))
+GRADING_BATCH_SIZE = int(os.environ.get("GRADING_BATCH_SIZE", "8"))
+
+GRADE_PROMPT = PromptTemplate(
+    template="""Sen bir belge değerlendiricisisin. Bir belgenin kullanıcının sorusuyla alakalı olup olmadığını kontrol ediyorsun. \n
+    İşte alınan belge: \n\n {document} \n\n
+    İşte kullanıcının sorusu: {question} \n
+    Eğer belge kullanıcının sorusunun HERHANGİ BİR KISMI ile ilgili anahtar kelimeler veya anlamsal içerik barındırıyorsa, onu alakalı olarak işaretle. \n
+    Belgenin soruyla ilgili olup olmadığını belirtmek için 'yes' (evet) veya 'no' (hayır) şeklinde ikili bir puan ver. \n
+    Puanı tek bir 'score' anahtarı içeren JSON formatında ver, başka hiçbir açıklama yapma.""",
+    input_variables=["question", "document"],
+)
+
+GRADE_BATCH_PROMPT = PromptTemplate(
+    template="""Sen bir belge değerlendiricisisin. Aşağıdaki her belgenin kullanıcının sorusuyla alakalı olup olmadığını ayrı ayrı kontrol ediyorsun.
+    Her belge [ID] etiketiyle başlar.
+
+    {documents}
+
+    İşte kullanıcının sorusu: {question}
+
+    Eğer bir belge kullanıcının sorusunun HERHANGİ BİR KISMI ile ilgili anahtar kelimeler veya anlamsal içerik barındırıyorsa, onu alakalı olarak işaretle.
+    Her belge için 'yes' (evet) veya 'no' (hayır) şeklinde ikili bir puan ver.
+    CEVABI SADECE JSON FORMATINDA VER, başka hiçbir açıklama yapma:
+    {{
+        "grades": [{{"id": "0", "score": "yes"}}, {{"id": "1", "score": "no"}}]
+    }}
+    """,
+    input_variables=["question", "documents"],
+)
+
+
+def _parse_score(value):
+    """
+    Map a grader verdict to True/False, or None if it is missing or malformed.
+    """
+    if not isinstance(value, str):
+        return None
+    value = value.strip().lower()
+    if value in ("yes", "evet"):
+        return True
+    if value in ("no", "hayır", "hayir"):
+        return False
+    return None
+
+
+def _concurrent_grading(question, documents):
+    """
+    One grader call per chunk. Returns (chain, inputs, parse) where parse maps
+    the batch results to one verdict per document.
+    """
+    chain = GRADE_PROMPT | llm | JsonOutputParser()
+    inputs = [{"question": question, "document": d.page_content} for d in documents]
+
+    def parse(results):
+        verdicts = []
+        for result in results:
+            if isinstance(result, dict):
+                verdicts.append(_parse_score(result.get("score")))
+            else:
+                verdicts.append(None)
+        return verdicts
+
+    return chain, inputs, parse
+
+
+def _batched_grading(question, documents):
+    """
+    GRADING_BATCH_SIZE chunks per grader call, answered with one verdict per chunk ID.
+    """
+    chain = GRADE_BATCH_PROMPT | llm | JsonOutputParser()
+    groups = [
+        list(range(i, min(i + GRADING_BATCH_SIZE, len(documents))))
+        for i in range(0, len(documents), GRADING_BATCH_SIZE)
+    ]
+    inputs = [
+        {
+            "question": question,
+            "documents": "\n\n".join(f"[{i}] {documents[i].page_content}" for i in group),
+        }
+        for group in groups
+    ]
+
+    def parse(results):
+        verdicts = [None] * len(documents)
+        for group, result in zip(groups, results):
+            grades = result.get("grades") if isinstance(result, dict) else None
+            if not isinstance(grades, list):
+                continue
+            for item in grades:
+                if not isinstance(item, dict):
+                    continue
+                try:
+                    index = int(item.get("id"))
+                except (TypeError, ValueError):
+                    continue
+                if index in group:
+                    verdicts[index] = _parse_score(item.get("score"))
+        return verdicts
+
+    return chain, inputs, parse
+
+
+def _grading_plan(question, documents):
+    if GRADING_MODE == "batch":
+        return _batched_grading(question, documents)
+    return _concurrent_grading(question, documents)
+
+
+# Vector-score thresholds that settle clear cases without the LLM (grade_filter.py)
+score_filter = ScoreFilter.from_config(VECTORSTORE_BACKEND)
+
+
+def _prejudge(state):
+    """
+    Settle what the vector scores can. Returns the verdicts (None where the
+    grader has to decide) and the indices of the chunks left for the grader.
+    """
+    verdicts = score_filter.prejudge(state.get("scores"), len(state["documents"]))
+    pending = [i for i, verdict in enumerate(verdicts) if verdict is None]
+    decided = [verdict for verdict in verdicts if verdict is not None]
+    if decided:
+        record_grade_decisions("score", decided)
+        print(f"---GRADE: {decided.count(True)} ACCEPTED, {decided.count(False)} REJECTED BY SCORE, {len(pending)} TO THE GRADER---")
+    return verdicts, pending
+
+
+def _merge_llm_verdicts(state, verdicts, pending, llm_verdicts):
     documents = state["documents"]
-    
-    # Grader prompt
-    prompt = PromptTemplate(
-        template="""Sen bir belge değerlendiricisisin. Bir belgenin kullanıcının sorusuyla alakalı olup olmadığını kontrol ediyorsun. \n 
-        İşte alınan belge: \n\n {document} \n\n
-        İşte kullanıcının sorusu: {question} \n
-        Eğer belge kullanıcının sorusunun HERHANGİ BİR KISMI ile ilgili anahtar kelimeler veya anlamsal içerik barındırıyorsa, onu alakalı olarak işaretle. \n
-        Belgenin soruyla ilgili olup olmadığını belirtmek için 'yes' (evet) veya 'no' (hayır) şeklinde ikili bir puan ver. \n
-        Puanı tek bir 'score' anahtarı içeren JSON formatında ver, başka hiçbir açıklama yapma.""",
-        input_variables=["question", "document"],
+    scores = state.get("scores") or [None] * len(documents)
+    for i, verdict in zip(pending, llm_verdicts):
+        verdicts[i] = verdict
+    record_grade_decisions("llm", llm_verdicts)
+    score_filter.log(
+        state["question"],
+        [doc_key(documents[i]) for i in pending],
+        [scores[i] for i in pending],
+        llm_verdicts,
     )
-    
-    chain = prompt | llm | JsonOutputParser()
-    
+
+
+def _filter_by_verdicts(state, verdicts):
     filtered_docs = []
-    for d in documents:
-        score = chain.invoke({"question": question, "document": d.page_content})
-        grade = score["score"]
-        if grade == "yes":
+    filtered_scores = []
+    scores = state.get("scores") or [None] * len(state["documents"])
+    for d, score, verdict in zip(state["documents"], scores, verdicts):
+        if verdict is None:
+            # A malformed verdict must not fail the whole request; keep the
+            # chunk rather than silently dropping possibly relevant context.
+            print("---GRADE: MALFORMED VERDICT, KEEPING DOCUMENT---")
+        elif verdict:
             print("---GRADE: DOCUMENT RELEVANT---")
-            filtered_docs.append(d)
         else:
             print("---GRADE: DOCUMENT NOT RELEVANT---")
             continue
-            
-    return {"documents": filtered_docs, "question": question}
+        filtered_docs.append(d)
+        filtered_scores.append(score)
+
+    record_documents("graded", len(filtered_docs))
+    return {"documents": filtered_docs, "scores": filtered_scores, "question": state["question"]}
+
+
+def grade_documents(state):
+    """
+    Determines whether the retrieved documents are relevant to the question.
+    """
+    print("---CHECK RELEVANCE---")
+    if not state["documents"]:
+        return {"documents": [], "scores": [], "question": state["question"]}
+
+    verdicts, pending = _prejudge(state)
+    if pending:
+        documents = [state["documents"][i] for i in pending]
+        chain, inputs, parse = _grading_plan(state["question"], documents)
+        results = chain.batch(
+            inputs,
+            config={"max_concurrency": GRADING_MAX_CONCURRENCY},
+            return_exceptions=True,
+        )
+        _merge_llm_verdicts(state, verdicts, pending, parse(results))
+    return _filter_by_verdicts(state, verdicts)
+
+
+async def agrade_documents(state):
+    """
+    Async version of grade_documents.
+    """
+    print("---CHECK RELEVANCE---")
+    if not state["documents"]:
+        return {"documents": [], "scores": [], "question": state["question"]}
+
+    verdicts, pending = _prejudge(state)
+    if pending:
+        documents = [state["documents"][i] for i in pending]
+        chain, inputs, parse = _grading_plan(state["question"], documents)
+        results = await chain.abatch(
+            inputs,
+            config={"max_concurrency": GRADING_MAX_CONCURRENCY},
+            return_exceptions=True,
+        )
+        _merge_llm_verdicts(state, verdicts, pending, parse(results))
+    return _filter_by_verdicts(state, verdicts)
 
 def generate(state):
     """
@@ -222,57 +747,24 @@ def generate(state):
     print("---GENERATE---")
     question = state["question"]
     documents = state["documents"]
-    
-    # Generation prompt
-    prompt = PromptTemplate(
-        template="""Sen yardımsever, özgüvenli ve çözüm odaklı bir müşteri hizmetleri temsilcisisin.
-        
-        GÖREVİN:
-        Aşağıdaki bilgi parçalarını kullanarak müşterinin sorusuna DOĞRUDAN ve NET bir cevap ver.
-        
-        KURALLAR:
-        1. ASLA "Belgede yazıyor", "Bağlamda belirtilmiş", "Dokümana göre" gibi ifadeler kullanma. Sanki bu bilgileri ezbere biliyormuşsun gibi konuş.
-        2. Müşteriye "SİZ" diliyle hitap et (Örn: "Yapabilirsiniz", "Edersiniz").
-        3. Eğer net bir adım-adım kılavuz yoksa bile, elindeki ipuçlarını birleştirerek en mantıklı yolu tarif et. (Örn: "Sisteme giriş ekranından kayıt olabilirsiniz").
-        4. Olumsuz konuşma ("Bilgi yok" deme). Onun yerine alternatif çözüm sun ("Bu konuda en doğru bilgiyi öğrenci işlerinden alabilirsiniz" de).
-        5. Cevabı kısa tut (Maksimum 3-4 cümle).
-        6. Her zaman TÜRKÇE cevap ver.
-        
-        Soru: {question} 
-        Bilgi Parçaları: {context} 
-        
-        Senin Cevabın:""",
-        input_variables=["question", "context"],
-    )
-    
-    # Chain
-    chain = prompt | llm | StrOutputParser()
-    generation = chain.invoke({"context": documents, "question": question})
+    chain = GENERATE_PROMPT | llm | StrOutputParser()
+    generation = chain.invoke({"context": pack_context(documents), "question": question})
     return {"documents": documents, "question": question, "generation": generation}
 
-# --- Conditional Edges ---
-
-def route_query(state):
+async def agenerate(state):
     """
-    Route query to RAG or Chitchat.
+    Async version of generate.
     """
-    print("---ROUTE QUERY---")
+    print("---GENERATE---")
     question = state["question"]
-    
-    prompt = PromptTemplate(
-        template="""Sen gelen mesajları sınıflandıran bir uzmansın.
-        Gelen mesajın "TEKNİK" (SADOS, eğitim, sınav, sertifika, ödeme, giriş sorunları) mi yoksa "SOHBET" (selamlaşma, teşekkür, şikayet, sitem, rastgele konuşma) mi olduğuna karar ver.
+    documents = state["documents"]
+    chain = GENERATE_PROMPT | llm | StrOutputParser()
+    generation = await chain.ainvoke({"context": pack_context(documents), "question": question})
+    return {"documents": documents, "question": question, "generation": generation}
 
-        Mesaj: {question}
+# --- Conditional Edges ---
 
-        Sadece 'RAG' (teknikse) veya 'CHITCHAT' (sohbetse) kelimesini döndür.
-        """,
-        input_variables=["question"],
-    )
-    
-    chain = prompt | llm | StrOutputParser()
-    decision = chain.invoke({"question": question})
-    
+def _route_from_decision(decision):
     if "RAG" in decision:
         print("---DECISION: ROUTE TO RAG---")
         return "rag"
@@ -280,31 +772,171 @@ def route_query(state):
         print("---DECISION: ROUTE TO CHITCHAT---")
         return "chitchat"
 
+# Local classifier that answers obvious cases without the routing LLM call
+fast_router = FastRouter()
+
+# The route helpers do not log: each decision is logged once, by the branch
+# of route_query / plan_query that produced it.
+
+def _llm_route(question):
+    chain = ROUTE_PROMPT | llm | StrOutputParser()
+    return _route_from_decision(chain.invoke({"question": question}))
+
+async def _allm_route(question):
+    chain = ROUTE_PROMPT | llm | StrOutputParser()
+    return _route_from_decision(await chain.ainvoke({"question": question}))
+
+async def _alocal_route(question):
+    """
+    Fast-router stages for async nodes; the embedding stage runs off the loop.
+    """
+    route, margin = fast_router.route_local(question), None
+    if route is None:
+        route, margin = await run_blocking(fast_router.route_embedding, question, embeddings)
+    return route, margin
+
+def route_query(state):
+    """
+    Route query to RAG or Chitchat.
+    """
+    print("---ROUTE QUERY---")
+    question = state["question"]
+    route, margin = fast_router.route(question, embeddings)
+    if route is not None:
+        return _route_from_decision(route.upper())
+    route = _llm_route(question)
+    fast_router.log(question, "llm", route, score=margin)
+    return route
+
+async def aroute_query(state):
+    """
+    Async version of route_query.
+    """
+    print("---ROUTE QUERY---")
+    question = state["question"]
+    route, margin = await _alocal_route(question)
+    if route is not None:
+        return _route_from_decision(route.upper())
+    route = await _allm_route(question)
+    fast_router.log(question, "llm", route, score=margin)
+    return route
+
+# --- Planner ---
+# Alternative to route_query + decompose_query: one JSON call returns the
+# route, the resolved question and the sub-questions. It only runs when the
+# fast router cannot decide; a malformed plan falls back to the two-step path.
+
+def _validate_plan(response):
+    """
+    Return (route, question, sub_questions) from a planner response, or None
+    if it does not match the schema.
+    """
+    if not isinstance(response, dict):
+        return None
+    route = response.get("route")
+    if not isinstance(route, str) or route.strip().upper() not in ("RAG", "CHITCHAT"):
+        return None
+    route = route.strip().lower()
+    question = response.get("question")
+    if not isinstance(question, str) or not question.strip():
+        return None
+    sub_questions = response.get("sub_questions", [])
+    if not isinstance(sub_questions, list) or len(sub_questions) > PLAN_MAX_SUB_QUESTIONS:
+        return None
+    if not all(isinstance(q, str) and q.strip() for q in sub_questions):
+        return None
+    if route == "rag" and not sub_questions:
+        sub_questions = [question]
+    return route, question.strip(), sub_questions
+
+def _plan_result(state, plan):
+    route, question, sub_questions = plan
+    _route_from_decision(route.upper())
+    if route == "chitchat":
+        return {"route": route}
+    decomposition_cache.put(state["question"], state.get("chat_history", []), sub_questions)
+    record_decomposition("planner")
+    print(f"Resolved question: {question}\nGenerated sub-questions: {sub_questions}")
+    return {"route": route, "question": question, "sub_questions": sub_questions}
+
+def plan_query(state):
+    """
+    Decide the route and the sub-questions, with at most one LLM call when the
+    fast router cannot decide.
+    """
+    print("---PLAN QUERY---")
+    question = state["question"]
+    route, margin = fast_router.route(question, embeddings)
+    if route is None:
+        chain = PLAN_PROMPT | llm | JsonOutputParser()
+        try:
+            plan = _validate_plan(chain.invoke(_decomposition_inputs(state)))
+        except Exception as e:
+            print(f"Planning failed: {e}")
+            plan = None
+        if plan is not None:
+            fast_router.log(question, "planner", plan[0])
+            return _plan_result(state, plan)
+        print("---PLAN INVALID: FALLING BACK TO ROUTE + DECOMPOSE---")
+        route = _llm_route(question)
+        fast_router.log(question, "llm", route, score=margin)
+
+    route = _route_from_decision(route.upper())
+    if route == "chitchat":
+        return {"route": route}
+    return {"route": route, **decompose_query(state)}
+
+async def aplan_query(state):
+    """
+    Async version of plan_query.
+    """
+    print("---PLAN QUERY---")
+    question = state["question"]
+    route, margin = await _alocal_route(question)
+    if route is None:
+        chain = PLAN_PROMPT | llm | JsonOutputParser()
+        try:
+            plan = _validate_plan(await chain.ainvoke(_decomposition_inputs(state)))
+        except Exception as e:
+            print(f"Planning failed: {e}")
+            plan = None
+        if plan is not None:
+            fast_router.log(question, "planner", plan[0])
+            return _plan_result(state, plan)
+        print("---PLAN INVALID: FALLING BACK TO ROUTE + DECOMPOSE---")
+        route = await _allm_route(question)
+        fast_router.log(question, "llm", route, score=margin)
+
+    route = _route_from_decision(route.upper())
+    if route == "chitchat":
+        return {"route": route}
+    return {"route": route, **(await adecompose_query(state))}
+
+def route_from_plan(state):
+    return state["route"]
+
+def _chitchat_inputs(state):
+    return {
+        "question": state["question"],
+        "chat_history": format_history(state.get("chat_history", [])),
+    }
+
 def handle_chitchat(state):
     """
     Handle chitchat messages without retrieval.
     """
     print("---HANDLE CHITCHAT---")
-    question = state["question"]
-    chat_history = state.get("chat_history", [])
-    formatted_history = "\\n".join(chat_history) if chat_history else "Yok"
+    chain = CHITCHAT_PROMPT | llm | StrOutputParser()
+    generation = chain.invoke(_chitchat_inputs(state))
+    return {"generation": generation}
 
-    prompt = PromptTemplate(
-        template="""Sen yardımsever bir müşteri hizmetleri asistanısın.
-        Kullanıcının mesajına, geçmiş konuşmayı da dikkate alarak nazik, profesyonel ve insancıl bir cevap ver.
-        
-        GEÇMİŞ KONUŞMA:
-        {chat_history}
-        
-        Kullanıcı Mesajı: {question}
-        
-        Cevap:""",
-        input_variables=["question", "chat_history"],
-    )
-    
-    chain = prompt | llm | StrOutputParser()
-    generation = chain.invoke({"question": question, "chat_history": formatted_history})
-    
+async def ahandle_chitchat(state):
+    """
+    Async version of handle_chitchat.
+    """
+    print("---HANDLE CHITCHAT---")
+    chain = CHITCHAT_PROMPT | llm | StrOutputParser()
+    generation = await chain.ainvoke(_chitchat_inputs(state))
     return {"generation": generation}
 
 
@@ -314,7 +946,7 @@ def decide_to_generate(state):
     """
     print("---ASSESS GRADED DOCUMENTS---")
     filtered_documents = state["documents"]
-    
+
     if not filtered_documents:
         # We have no relevant documents, so (in a full agentic RAG) we might rewrite the query.
         # For this simple example, we will just end but returning a message.
@@ -325,52 +957,105 @@ def decide_to_generate(state):
         print("---DECISION: GENERATE---")
         return "generate"
 
+# --- Chat History Compaction ---
+
+def _summary_inputs(summary, turns):
+    return {"summary": summary or "Yok", "turns": "\n".join(turns)}
+
+def summarize_history(summary: str, turns: List[str]) -> str:
+    """
+    Fold old chat turns into the running conversation summary.
+    """
+    chain = SUMMARY_PROMPT | llm | StrOutputParser()
+    return chain.invoke(_summary_inputs(summary, turns))
+
+async def asummarize_history(summary: str, turns: List[str]) -> str:
+    """
+    Async version of summarize_history.
+    """
+    chain = SUMMARY_PROMPT | llm | StrOutputParser()
+    return await chain.ainvoke(_summary_inputs(summary, turns))
+
 # --- Build Graph ---
 
-workflow = StateGraph(GraphState)
-
-# Define the nodes
-workflow.add_node("decompose_query", decompose_query)
-workflow.add_node("retrieve", retrieve)
-workflow.add_node("grade_documents", grade_documents)
-workflow.add_node("generate", generate)
-workflow.add_node("handle_chitchat", handle_chitchat) # Added node
-
-# Build graph
-# Replace START -> decompose with Conditional Edge
-workflow.add_conditional_edges(
-    START,
-    route_query,
-    {
-        "rag": "decompose_query",
-        "chitchat": "handle_chitchat",
-    },
-)
+def _node(func, afunc):
+    """
+    Pair a sync node with its async twin so the graph supports invoke and ainvoke.
+    Both are timed by the telemetry hooks.
+    """
+    name = func.__name__
+    return RunnableLambda(traced_node(name)(func), afunc=traced_node(name)(afunc), name=name)
 
-workflow.add_edge("decompose_query", "retrieve")
-workflow.add_edge("retrieve", "grade_documents")
-
-# Conditional edge
-workflow.add_conditional_edges(
-    "grade_documents",
-    decide_to_generate,
-    {
-        "generate": "generate",
-        "end_no_docs": END,
-    },
-)
-workflow.add_edge("generate", END)
-workflow.add_edge("handle_chitchat", END) # Edge for chitchat
+# "two_step": route_query, then decompose_query (two LLM hops in the worst case)
+# "planner": plan_query does both in one structured LLM call
+GRAPH_TOPOLOGY = os.environ.get("GRAPH_TOPOLOGY", "two_step")
 
-# Compile
-app = workflow.compile()
+def build_graph(topology: str = GRAPH_TOPOLOGY):
+    """
+    Compile the RAG graph in the given topology.
+    """
+    if topology not in ("two_step", "planner"):
+        raise ValueError(f"Unknown GRAPH_TOPOLOGY: {topology}")
+
+    workflow = StateGraph(GraphState)
+
+    # Define the nodes
+    workflow.add_node("route_partitions", _node(route_partitions, aroute_partitions))
+    workflow.add_node("retrieve", _node(retrieve, aretrieve))
+    workflow.add_node("grade_documents", _node(grade_documents, agrade_documents))
+    workflow.add_node("generate", _node(generate, agenerate))
+    workflow.add_node("handle_chitchat", _node(handle_chitchat, ahandle_chitchat)) # Added node
+
+    if topology == "planner":
+        workflow.add_node("plan_query", _node(plan_query, aplan_query))
+        workflow.add_edge(START, "plan_query")
+        workflow.add_conditional_edges(
+            "plan_query",
+            route_from_plan,
+            {
+                "rag": "route_partitions",
+                "chitchat": "handle_chitchat",
+            },
+        )
+    else:
+        workflow.add_node("decompose_query", _node(decompose_query, adecompose_query))
+        # Replace START -> decompose with Conditional Edge
+        workflow.add_conditional_edges(
+            START,
+            _node(route_query, aroute_query),
+            {
+                "rag": "decompose_query",
+                "chitchat": "handle_chitchat",
+            },
+        )
+        workflow.add_edge("decompose_query", "route_partitions")
+
+    workflow.add_edge("route_partitions", "retrieve")
+    workflow.add_edge("retrieve", "grade_documents")
+
+    # Conditional edge
+    workflow.add_conditional_edges(
+        "grade_documents",
+        decide_to_generate,
+        {
+            "generate": "generate",
+            "end_no_docs": END,
+        },
+    )
+    workflow.add_edge("generate", END)
+    workflow.add_edge("handle_chitchat", END) # Edge for chitchat
+
+    # Compile
+    return workflow.compile()
+
+app = build_graph()
 
 def main():
     print("--- Agentic RAG Setup ---")
     
     try:
-        # Load all files from ./database
-        setup_vectorstore("./database")
+        # Load all files from the data directories (DATA_DIRS)
+        setup_vectorstore()
         
         if vectorstore is None:
             print("Vector Store not initialized. Exiting.")
@@ -381,7 +1066,7 @@ def main():
         return
 
     print("\n--- Interaction ---")
-    chat_history = []
+    session = Session("cli")
     while True:
         question = input("\nAsk a question (or 'q' to quit): ")
         if not question.strip():
@@ -390,29 +1075,20 @@ def main():
         if question.lower() in ["q", "quit"]:
             break
             
-        inputs = {"question": question, "chat_history": chat_history}
+        inputs = {"question": question, "chat_history": session.history()}
         try:
-            for output in app.stream(inputs):
-                for key, value in output.items():
-                    # print(f"Node '{key}':")
-                    pass
-            
-            # Final generation result is usually in the last state of 'generate' node
-            # But since we stream, we can just print the final result if we stored it properly
-            # or we can look at the flow. Ideally, the `generate` node updates the state `generation`.
-            # Let's verify what `app.invoke` returns for simplicity in printing.
-            
+            # Run the graph once and print where the time went
+            trace = start_trace()
             final_result = app.invoke(inputs)
+            print(f"\n{trace.format()}")
+
             if "generation" in final_result:
                 answer = final_result['generation']
                 print(f"\nAnswer: {answer}")
                 
-                # Update Chat History
-                chat_history.append(f"Kullanıcı: {question}")
-                chat_history.append(f"Asistan: {answer}")
-                # Keep only last 10 messages to avoid huge prompts
-                if len(chat_history) > 10:
-                    chat_history = chat_history[-10:]
+                # Update Chat History; older turns are summarized to keep prompts small
+                session.add_exchange(question, answer)
+                compact(session, summarize_history)
             else:
                 print("\nCould not generate an answer (No relevant documents found).")
                 
@@ -0,0 +1,218 @@
+import os
+import re
+import time
+import asyncio
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional
+
+import numpy as np
+
+from telemetry import record_answer_cache
+
+# --- Answer Cache ---
+# Sits in front of the graph. A question hits on an exact match of its
+# normalized text, or on a cached question whose embedding is at least
+# ANSWER_CACHE_SIMILARITY cosine-similar. Entries expire after ANSWER_CACHE_TTL
+# seconds, the least recently used ones are evicted past
+# ANSWER_CACHE_MAX_ENTRIES, and the whole cache is dropped when the index
+# version changes. Identical questions in flight at the same time share a
+# single graph run.
+
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+ANSWER_CACHE_SIMILARITY = float(os.environ.get("ANSWER_CACHE_SIMILARITY", "0.95"))
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+
+
+def normalize_question(question: str) -> str:
+    """
+    Case-fold (Turkish-aware), drop punctuation and collapse whitespace.
+    """
+    text = unicodedata.normalize("NFC", question)
+    text = text.replace("İ", "i").replace("I", "ı").lower()
+    text = _PUNCTUATION.sub(" ", text)
+    return " ".join(text.split())
+
+
+class _Entry:
+    __slots__ = ("vector", "value", "expires")
+
+    def __init__(self, vector, value, expires):
+        self.vector = vector
+        self.value = value
+        self.expires = expires
+
+
+class _LeaderCancelled(Exception):
+    """
+    Handed to coalesced waiters when the caller computing their answer was
+    cancelled (e.g. its client disconnected); they compute it themselves.
+    """
+
+
+class AnswerCache:
+    def __init__(
+        self,
+        ttl: float = ANSWER_CACHE_TTL,
+        max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+        similarity_threshold: float = ANSWER_CACHE_SIMILARITY,
+        version_fn: Optional[Callable[[], Any]] = None,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.version_fn = version_fn
+        self._version = version_fn() if version_fn else None
+        self._entries = OrderedDict()
+        self._matrix = None  # stacked unit vectors of entries, rebuilt lazily
+        self._matrix_keys = []
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def _check_version(self):
+        if self.version_fn is None:
+            return
+        version = self.version_fn()
+        if version != self._version:
+            self._version = version
+            self.invalidate()
+
+    @staticmethod
+    def _unit(vector):
+        if vector is None:
+            return None
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def _live(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires < now:
+            del self._entries[key]
+            self._matrix = None
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _nearest(self, vector, now):
+        if self._matrix is None:
+            keyed = [(k, e.vector) for k, e in self._entries.items() if e.vector is not None]
+            self._matrix_keys = [k for k, _ in keyed]
+            self._matrix = np.stack([v for _, v in keyed]) if keyed else np.empty((0, len(vector)))
+        if not len(self._matrix_keys) or self._matrix.shape[1] != len(vector):
+            return None
+        scores = self._matrix @ vector
+        best = int(np.argmax(scores))
+        if scores[best] < self.similarity_threshold:
+            return None
+        return self._live(self._matrix_keys[best], now)
+
+    def _get(self, question: str, vector=None):
+        self._check_version()
+        key = normalize_question(question)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._live(key, now)
+            if entry is not None:
+                return entry.value, "exact"
+            unit = self._unit(vector)
+            if unit is not None:
+                entry = self._nearest(unit, now)
+                if entry is not None:
+                    return entry.value, "semantic"
+        return None, None
+
+    def get(self, question: str, vector=None):
+        """
+        Return the cached value for the question, or None.
+        `vector` is the question embedding used for near-duplicate matches.
+        """
+        value, kind = self._get(question, vector)
+        record_answer_cache(kind or "miss")
+        return value
+
+    def put(self, question: str, vector, value):
+        self._check_version()
+        key = normalize_question(question)
+        with self._lock:
+            self._entries[key] = _Entry(self._unit(vector), value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    async def lookup(
+        self,
+        question: str,
+        embed: Optional[Callable[[str], Awaitable[Any]]] = None,
+    ):
+        """
+        Look the question up, embedding it only if there is no exact match.
+        Returns (value or None, question vector or None).
+        """
+        vector = None
+        value, kind = self._get(question)
+        if kind is None and embed is not None:
+            try:
+                vector = await embed(question)
+            except Exception as e:
+                print(f"Answer cache embedding failed: {e}")
+            value, kind = self._get(question, vector)
+        record_answer_cache(kind or "miss")
+        return value, vector
+
+    async def get_or_compute(
+        self,
+        question: str,
+        compute: Callable[[], Awaitable[Any]],
+        embed: Optional[Callable[[str], Awaitable[Any]]] = None,
+        cacheable: Callable[[Any], bool] = lambda value: True,
+    ):
+        """
+        Return the cached answer, or run `compute` once for all concurrent
+        callers asking the same (normalized) question and cache its result.
+        """
+        key = normalize_question(question)
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            record_answer_cache("coalesced")
+        while inflight is not None:
+            try:
+                return await asyncio.shield(inflight)
+            except _LeaderCancelled:
+                # The first waiter to wake up takes over; the rest coalesce on it.
+                inflight = self._inflight.get(key)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value, vector = await self.lookup(question, embed)
+            if value is None:
+                value = await compute()
+                if cacheable(value):
+                    self.put(question, vector, value)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            # Not future.cancel(): CancelledError would abort the waiters'
+            # requests, which were not cancelled themselves.
+            future.set_exception(_LeaderCancelled())
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting.
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
@@ -0,0 +1,185 @@
+import os
+import asyncio
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+from answer_cache import normalize_question
+
+# --- Batch Questions ---
+# Answers many questions in one go (nightly FAQ runs, /ask/batch). Duplicate
+# questions are answered once; all questions are embedded in one call up
+# front; the retrieval searches of concurrently running graphs are coalesced
+# by a QueryBatcher, so sub-questions are embedded in batches and a query
+# shared by several questions is searched only once. At most
+# BATCH_MAX_CONCURRENCY graphs run at a time and results are yielded as soon
+# as each question is done.
+
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", "8"))
+BATCH_MAX_QUESTIONS = int(os.environ.get("BATCH_MAX_QUESTIONS", "1000"))
+# How long the batcher waits for more queries before searching
+BATCH_WINDOW_SECONDS = float(os.environ.get("BATCH_WINDOW_SECONDS", "0.02"))
+BATCH_MAX_QUERIES = 64
+
+
+class QueryBatcher:
+    """
+    Coalesces asearch_queries calls made within BATCH_WINDOW_SECONDS into one
+    call per partition selection and remembers the results for the lifetime
+    of the batch.
+    """
+
+    def __init__(self, window: float = BATCH_WINDOW_SECONDS, max_queries: int = BATCH_MAX_QUERIES):
+        self.window = window
+        self.max_queries = max_queries
+        self.searches = 0
+        # Keyed by (partitions, query); partitions None means all
+        self._results: Dict[Tuple, asyncio.Future] = {}
+        self._pending: List[Tuple] = []
+        self._flush_handle = None
+        # The loop only keeps weak references to tasks; a collected flush
+        # would leave its waiters parked forever.
+        self._flush_tasks = set()
+
+    async def search(self, queries: List[str], partitions: Optional[Sequence[str]] = None) -> List[List]:
+        loop = asyncio.get_running_loop()
+        scope = tuple(partitions) if partitions else None
+        futures = []
+        for query in queries:
+            key = (scope, query)
+            future = self._results.get(key)
+            if future is None:
+                future = self._results[key] = loop.create_future()
+                self._pending.append(key)
+            futures.append(future)
+
+        if len(self._pending) >= self.max_queries:
+            self._schedule(0)
+        elif self._pending and self._flush_handle is None:
+            self._schedule(self.window)
+        return list(await asyncio.gather(*(asyncio.shield(f) for f in futures)))
+
+    def _schedule(self, delay):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        loop = asyncio.get_running_loop()
+        self._flush_handle = loop.call_later(delay, self._start_flush)
+
+    def _start_flush(self):
+        task = asyncio.ensure_future(self._flush())
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    def _fail(self, keys, error):
+        for key in keys:
+            future = self._results.get(key)
+            if future is not None and not future.done():
+                del self._results[key]
+                future.set_exception(error)
+                # Mark as retrieved; the waiting graph run reports it.
+                future.exception()
+
+    async def _flush(self):
+        self._flush_handle = None
+        pending, self._pending = self._pending, []
+        try:
+            scopes: Dict[Optional[Tuple], List[str]] = {}
+            for scope, query in pending:
+                scopes.setdefault(scope, []).append(query)
+            await asyncio.gather(*(self._search(scope, queries) for scope, queries in scopes.items()))
+        except Exception as e:
+            self._fail(pending, e)
+
+    async def _search(self, scope, queries):
+        self.searches += 1
+        import agentic_rag as rag
+        try:
+            results = await rag.asearch_queries(queries, list(scope) if scope else None)
+        except Exception as e:
+            self._fail([(scope, query) for query in queries], e)
+            return
+        for query, documents in zip(queries, results):
+            self._results[(scope, query)].set_result(documents)
+
+
+async def answer_batch(
+    questions: List[str],
+    max_concurrency: int = BATCH_MAX_CONCURRENCY,
+    answer_cache=None,
+    graph=None,
+) -> AsyncIterator[Tuple[int, str, Dict]]:
+    """
+    Answer the questions, yielding (index, question, result) as they complete.
+    `result` is {"generation": ...}, {} when no relevant documents were found,
+    or {"error": message}. Duplicate questions (after normalization) share one
+    graph run and are yielded once per index.
+    """
+    # Imported on use, so importing this module does not load the pipeline
+    # (server.py loads it in the background).
+    import agentic_rag as rag
+
+    graph = graph or rag.app
+    groups: Dict[str, List[int]] = {}
+    for index, question in enumerate(questions):
+        groups.setdefault(normalize_question(question), []).append(index)
+    if not groups:
+        return
+
+    # One embedding call for every distinct question; routing and the answer
+    # cache then find the vectors in the embedding cache.
+    firsts = [questions[indices[0]] for indices in groups.values()]
+    try:
+        await rag.run_blocking(rag.embeddings.embed_queries, firsts)
+    except Exception as e:
+        print(f"Batch embedding failed: {e}")
+
+    batcher = QueryBatcher()
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(key, question):
+        # Runs in its own task, so the batcher is only visible to this batch.
+        rag.retrieval_batcher.set(batcher)
+
+        async def compute():
+            result = await graph.ainvoke({"question": question, "chat_history": []})
+            return {"generation": result["generation"]} if "generation" in result else {}
+
+        async with semaphore:
+            try:
+                if answer_cache is None:
+                    return key, await compute()
+                return key, await answer_cache.get_or_compute(
+                    question,
+                    compute,
+                    embed=rag.aembed_question,
+                    cacheable=lambda result: "generation" in result,
+                )
+            except Exception as e:
+                print(f"Batch question failed: {e}")
+                return key, {"error": str(e)}
+
+    tasks = [asyncio.create_task(run(key, question)) for key, question in zip(groups, firsts)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            key, result = await next_done
+            for index in groups[key]:
+                yield index, questions[index], result
+    finally:
+        for task in tasks:
+            task.cancel()
+    print(f"---BATCH: {len(questions)} questions, {len(groups)} unique, {batcher.searches} searches---")
+
+
+async def aask_batch(questions: List[str], **kwargs) -> List[Dict]:
+    """
+    Answer the questions and return the results in input order.
+    """
+    results: List[Optional[Dict]] = [None] * len(questions)
+    async for index, _, result in answer_batch(questions, **kwargs):
+        results[index] = result
+    return results
+
+
+def ask_batch(questions: List[str], **kwargs) -> List[Dict]:
+    """
+    Synchronous version of aask_batch for scripts and bulk jobs.
+    """
+    return asyncio.run(aask_batch(questions, **kwargs))
@@ -0,0 +1,421 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import deque
+from typing import List
+
+import numpy as np
+
+# --- Offline Benchmark ---
+# Measures import time, ingestion throughput, per-node graph latency and /ask
+# latency under concurrent load without calling Gemini: the chat model and the embeddings
+# are replaced by deterministic local fakes with configurable latency.
+# Results are written as JSON so runs can be compared across commits.
+#
+#   python benchmark.py --llm-latency 0.3 --concurrency 16 --output bench.json
+
+os.environ.setdefault("GOOGLE_API_KEY", "offline-benchmark")
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+DATA_DIRS = ["./database", "./depo-pdf-belgeler"]
+# Modules whose import time is measured: what uvicorn loads before listening,
+# and the pipeline the server loads in the background.
+IMPORT_MODULES = ["server", "agentic_rag"]
+
+QUESTIONS = [
+    "Sertifikamı nereden indirebilirim?",
+    "SADOS sistemine nasıl giriş yapılır?",
+    "Sınav ücreti nasıl ödenir?",
+    "Teknik şartnamede hangi modüller var?",
+    "Eğitim videoları açılmıyor ne yapmalıyım?",
+    "Üyelik için gerekli belgeler nelerdir?",
+    "LMS player hangi verileri kaydediyor?",
+    "Kayıt işlemleri ne zaman başlıyor?",
+    "Merhaba, iyi günler",
+    "Teşekkür ederim, çok yardımcı oldunuz",
+]
+
+
+def _digest(text: str) -> int:
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+
+
+class QuotaExceeded(Exception):
+    """
+    What the fake endpoint raises over its quota (HTTP 429, like Gemini).
+    """
+
+    code = 429
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic stand-in for ChatGoogleGenerativeAI. Replies are chosen by
+    recognizing the prompt; every call sleeps `latency` seconds. With
+    `rpm_quota`, calls beyond that many in the trailing minute fail with 429.
+    """
+
+    latency: float = 0.0
+    relevant_ratio: float = 0.7
+    rpm_quota: int = 0
+    _calls: deque = PrivateAttr(default_factory=deque)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    rejected: int = 0
+
+    def _admit(self):
+        if not self.rpm_quota:
+            return
+        now = time.monotonic()
+        with self._lock:
+            while self._calls and self._calls[0] < now - 60:
+                self._calls.popleft()
+            if len(self._calls) >= self.rpm_quota:
+                self.rejected += 1
+                raise QuotaExceeded("429 RESOURCE_EXHAUSTED (fake quota)")
+            self._calls.append(now)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-benchmark"
+
+    def reply(self, prompt: str) -> str:
+        if "arama sorgularına" in prompt:
+            return json.dumps({
+                "route": "CHITCHAT" if "Merhaba" in prompt or "Teşekkür" in prompt else "RAG",
+                "question": "Sertifika nasıl alınır?",
+                "sub_questions": ["Sertifika nasıl alınır?", "Sertifika başvuru süreci"],
+            })
+        if "sınıflandıran" in prompt:
+            return "RAG"
+        if "alt sorulara" in prompt:
+            return json.dumps({"sub_questions": [
+                "Sertifika nasıl alınır?", "Sertifika başvuru süreci", "Sertifika için gerekli belgeler nelerdir?",
+            ]})
+        if '"grades"' in prompt:
+            grades = []
+            for block in prompt.split("\n\n"):
+                block = block.strip()
+                if block.startswith("[") and "]" in block:
+                    doc_id = block[1:block.index("]")]
+                    grades.append({"id": doc_id, "score": self._verdict(block)})
+            return json.dumps({"grades": grades})
+        if "değerlendiricisisin" in prompt:
+            return json.dumps({"score": self._verdict(prompt)})
+        if "asistanısın" in prompt:
+            return "Merhaba! Size nasıl yardımcı olabilirim?"
+        return "Sertifikanızı öğrenci panelindeki Belgelerim bölümünden indirebilirsiniz."
+
+    def _verdict(self, text: str) -> str:
+        return "yes" if (_digest(text) % 1000) / 1000 < self.relevant_ratio else "no"
+
+    def _result(self, messages) -> ChatResult:
+        prompt = messages[-1].content
+        text = self.reply(prompt)
+        message = AIMessage(
+            content=text,
+            usage_metadata={
+                "input_tokens": len(prompt) // 4,
+                "output_tokens": len(text) // 4,
+                "total_tokens": (len(prompt) + len(text)) // 4,
+            },
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        self._admit()
+        time.sleep(self.latency)
+        return self._result(messages)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        self._admit()
+        await asyncio.sleep(self.latency)
+        return self._result(messages)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        self._admit()
+        words = self.reply(messages[-1].content).split(" ")
+        for word in words:
+            await asyncio.sleep(self.latency / len(words))
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+
+class HashEmbeddings(Embeddings):
+    """
+    Deterministic unit vectors derived from a hash of the text; every call
+    sleeps `latency` seconds regardless of batch size.
+    """
+
+    def __init__(self, size: int = 768, latency: float = 0.0):
+        self.size = size
+        self.latency = latency
+        self.model = f"hash-{size}"
+
+    def _vector(self, text: str) -> List[float]:
+        rng = np.random.default_rng(_digest(text))
+        vector = rng.standard_normal(self.size).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(self.latency)
+        return self._vector(text)
+
+
+def percentiles(values) -> dict:
+    if not values:
+        return {"count": 0}
+    values = np.asarray(values, dtype=np.float64)
+    return {
+        "count": int(len(values)),
+        "mean": round(float(values.mean()), 5),
+        "p50": round(float(np.percentile(values, 50)), 5),
+        "p95": round(float(np.percentile(values, 95)), 5),
+        "p99": round(float(np.percentile(values, 99)), 5),
+        "max": round(float(values.max()), 5),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _unique(question: str, i: int) -> str:
+    # Distinct questions, so the answer and decomposition caches do not hide the work.
+    return f"{question} ({i})"
+
+
+def _import_seconds(module: str, importtime: bool = False):
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", code]
+    completed = subprocess.run(command, capture_output=True, text=True, check=True)
+    return float(completed.stdout.strip().splitlines()[-1]), completed.stderr
+
+
+def _slowest_imports(importtime_log: str, limit: int = 5) -> dict:
+    # Direct imports of the measured module, by cumulative microseconds.
+    direct = {}
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if name.startswith("   ") and not name.startswith("    "):
+            direct[name.strip()] = int(cumulative)
+    slowest = sorted(direct.items(), key=lambda item: item[1], reverse=True)[:limit]
+    return {name: round(micros / 1e6, 4) for name, micros in slowest}
+
+
+def bench_imports(runs: int) -> dict:
+    """
+    Import each module in fresh interpreters; report the median time and the
+    slowest direct imports.
+    """
+    results = {}
+    for module in IMPORT_MODULES:
+        seconds = [_import_seconds(module)[0] for _ in range(runs)]
+        _, importtime_log = _import_seconds(module, importtime=True)
+        results[module] = {
+            "seconds": round(float(np.median(seconds)), 4),
+            "slowest_imports": _slowest_imports(importtime_log),
+        }
+    return results
+
+
+def bench_ingestion(rag, workdir: str) -> dict:
+    """
+    Index each bundled PDF folder into a fresh store and report throughput.
+    """
+    import ingestion
+
+    results = {}
+    for data_dir in DATA_DIRS:
+        if not os.path.isdir(data_dir):
+            continue
+        persist_dir = os.path.join(workdir, "index-" + os.path.basename(os.path.normpath(data_dir)))
+        files = ingestion.list_pdfs(data_dir)
+        size = sum(os.path.getsize(path) for path in files)
+        start = time.perf_counter()
+        store = rag.open_vectorstore(persist_dir)
+        files_indexed, chunks_added, _ = ingestion.sync_index(store, data_dir, persist_dir)
+        seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        ingestion.sync_index(store, data_dir, persist_dir)
+        resync_seconds = time.perf_counter() - start
+
+        results[data_dir] = {
+            "files": files_indexed,
+            "chunks": chunks_added,
+            "megabytes": round(size / 1e6, 3),
+            "seconds": round(seconds, 4),
+            "chunks_per_second": round(chunks_added / seconds, 2) if seconds else None,
+            "megabytes_per_second": round(size / 1e6 / seconds, 3) if seconds else None,
+            "unchanged_resync_seconds": round(resync_seconds, 4),
+        }
+    return results
+
+
+async def bench_graph(rag, graph, runs: int) -> dict:
+    """
+    Run the graph sequentially and aggregate per-node latencies from traces.
+    """
+    from telemetry import start_trace
+
+    nodes = {}
+    totals = []
+    llm_calls = []
+    for i in range(runs):
+        trace = start_trace()
+        await graph.ainvoke({"question": _unique(QUESTIONS[i % len(QUESTIONS)], i), "chat_history": []})
+        summary = trace.summary()
+        totals.append(summary["total_seconds"])
+        llm_calls.append(summary["llm_calls"])
+        for node in summary["nodes"]:
+            nodes.setdefault(node["node"], []).append(node["seconds"])
+    return {
+        "runs": runs,
+        "total": percentiles(totals),
+        "llm_calls_per_run": round(sum(llm_calls) / max(len(llm_calls), 1), 2),
+        "nodes": {name: percentiles(values) for name, values in nodes.items()},
+    }
+
+
+async def bench_ask(requests: int, concurrency: int) -> dict:
+    """
+    Fire /ask requests at the FastAPI app in-process with bounded concurrency.
+    """
+    import httpx
+    import server
+
+    latencies = []
+    failures = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+
+        async def one(i):
+            nonlocal failures
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post(
+                    "/ask", json={"question": _unique(QUESTIONS[i % len(QUESTIONS)], i)}
+                )
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    failures += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        seconds = time.perf_counter() - start
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "failures": failures,
+        "seconds": round(seconds, 4),
+        "requests_per_second": round(requests / seconds, 2) if seconds else None,
+        "latency": percentiles(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline performance benchmark with fake LLM and embeddings.")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="seconds per fake LLM call")
+    parser.add_argument("--llm-rpm-quota", type=int, default=0,
+                        help="fake endpoint fails with 429 beyond this many calls per minute (0 = no quota)")
+    parser.add_argument("--embedding-latency", type=float, default=0.01, help="seconds per fake embedding call")
+    parser.add_argument("--embedding-size", type=int, default=768)
+    parser.add_argument("--graph-runs", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--topology", default=None, help="two_step or planner (default: GRAPH_TOPOLOGY)")
+    parser.add_argument("--import-runs", type=int, default=3, help="fresh interpreters per import measurement")
+    parser.add_argument("--skip-ingestion", action="store_true")
+    parser.add_argument("--output", default="benchmark_results.json")
+    args = parser.parse_args()
+
+    # Measured first, in subprocesses, before this process imports anything.
+    print("--- Benchmark: imports ---")
+    imports = bench_imports(args.import_runs)
+
+    workdir = tempfile.mkdtemp(prefix="rag-bench-")
+    # The fakes must be in place before any node runs; caches start empty.
+    os.environ.setdefault("EMBEDDING_CACHE_PATH", os.path.join(workdir, "embedding_cache.sqlite"))
+
+    import agentic_rag as rag
+    from embedding_cache import CachedEmbeddings
+    from llm_gateway import LLMGateway, LLM_RPM, LLM_TPM
+
+    # The fake replaces Gemini behind the gateway, so its limits and retries apply.
+    fake_llm = FakeChatModel(latency=args.llm_latency, rpm_quota=args.llm_rpm_quota)
+    rag.llm = LLMGateway(inner=fake_llm, callbacks=rag.llm.callbacks)
+    rag.embeddings = CachedEmbeddings(
+        HashEmbeddings(args.embedding_size, args.embedding_latency),
+        path=os.path.join(workdir, "embedding_cache.sqlite"),
+    )
+    topology = args.topology or rag.GRAPH_TOPOLOGY
+    graph = rag.build_graph(topology)
+
+    results = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            **{k: v for k, v in vars(args).items() if k != "output"},
+            "topology": topology,
+            "vectorstore_backend": rag.VECTORSTORE_BACKEND,
+            "grading_mode": rag.GRADING_MODE,
+            "llm_rpm": LLM_RPM,
+            "llm_tpm": LLM_TPM,
+            "python": sys.version.split()[0],
+        },
+        "imports": imports,
+    }
+
+    if not args.skip_ingestion:
+        print("--- Benchmark: ingestion ---")
+        results["ingestion"] = bench_ingestion(rag, workdir)
+
+    print("--- Benchmark: graph ---")
+    rag.setup_vectorstore(DATA_DIRS, os.path.join(workdir, "index-serving"))
+    if rag.vectorstore is None:
+        print("No documents indexed; cannot benchmark the graph.")
+        return
+    results["graph"] = asyncio.run(bench_graph(rag, graph, args.graph_runs))
+
+    print("--- Benchmark: /ask ---")
+    import server
+    server.rag = rag
+    server.rag_app = graph
+    results["ask"] = asyncio.run(bench_ask(args.requests, args.concurrency))
+    results["llm_rejected_by_quota"] = fake_llm.rejected
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,25 @@
 import os
+import sys
 import shutil
-from agentic_rag import setup_vectorstore
+from agentic_rag import setup_vectorstore, VECTORSTORE_DIR
+from ingestion import indexed_chunk_count
+from partitions import DATA_DIRS
 
-def build_db():
+def build_db(rebuild: bool = False):
     print("--- Building Vector Database ---")
-    
-    # Optional: Clear existing DB to force rebuild
-    if os.path.exists("./chroma_db"):
-        print("Removing existing chroma_db...")
-        shutil.rmtree("./chroma_db")
-        
-    setup_vectorstore(data_dir="./database", persist_dir="./chroma_db")
+
+    # By default the build is incremental: only new or changed PDFs are embedded.
+    # Pass --rebuild to clear the existing DB and start from scratch.
+    if rebuild and os.path.exists(VECTORSTORE_DIR):
+        print(f"Removing existing {VECTORSTORE_DIR}...")
+        shutil.rmtree(VECTORSTORE_DIR)
+
+    setup_vectorstore(data_dirs=DATA_DIRS, persist_dir=VECTORSTORE_DIR)
+    # Fail loudly (e.g. in the Docker build) instead of shipping an empty index.
+    if not indexed_chunk_count(VECTORSTORE_DIR):
+        print("--- Build Failed: no chunks indexed ---")
+        sys.exit(1)
     print("--- Build Complete ---")
 
 if __name__ == "__main__":
-    build_db()
+    build_db(rebuild="--rebuild" in sys.argv[1:])
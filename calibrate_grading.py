@@ -0,0 +1,66 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+from grade_filter import GRADE_LOG_PATH, GRADE_THRESHOLDS_PATH, fit_thresholds
+
+# --- Grading Calibration ---
+# Fits the accept/reject thresholds of the grading pre-filter (grade_filter.py)
+# to LLM verdicts recorded with GRADE_LOG_PATH set. Record with the pre-filter
+# off (no thresholds file), so the log covers the whole score range:
+#
+#   GRADE_LOG_PATH=grade_log.jsonl uvicorn server:app ...
+#   python calibrate_grading.py --log grade_log.jsonl --target 0.95
+
+
+def load_samples(path: str, backend: str):
+    samples = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("backend") != backend:
+                continue
+            if isinstance(record.get("score"), (int, float)) and isinstance(record.get("verdict"), bool):
+                samples.append((float(record["score"]), record["verdict"]))
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit grading pre-filter thresholds to recorded LLM verdicts.")
+    parser.add_argument("--log", default=GRADE_LOG_PATH, help="JSON-lines verdict log (GRADE_LOG_PATH)")
+    parser.add_argument("--backend", default=os.environ.get("VECTORSTORE_BACKEND", "chroma"))
+    parser.add_argument("--target", type=float, default=0.95,
+                        help="minimum share of auto-decided chunks the LLM agrees with, on each side")
+    parser.add_argument("--min-samples", type=int, default=20)
+    parser.add_argument("--output", default=GRADE_THRESHOLDS_PATH)
+    parser.add_argument("--dry-run", action="store_true", help="print the fit without writing it")
+    args = parser.parse_args()
+
+    if not args.log or not os.path.exists(args.log):
+        print("No verdict log found; run the server with GRADE_LOG_PATH set first.")
+        sys.exit(1)
+    samples = load_samples(args.log, args.backend)
+    print(f"{len(samples)} recorded verdicts for backend {args.backend}")
+    if not samples:
+        sys.exit(1)
+
+    fitted = fit_thresholds(samples, target=args.target, min_samples=args.min_samples)
+    fitted.update(backend=args.backend, fitted_at=time.strftime("%Y-%m-%dT%H:%M:%S"))
+    print(json.dumps(fitted, indent=2))
+    print(f"{fitted['coverage']:.0%} of the recorded chunks would skip the LLM grader.")
+    if fitted["accept"] is None and fitted["reject"] is None:
+        print("No threshold reaches the target; the pre-filter stays off.")
+    if args.dry_run:
+        return
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(fitted, f, indent=2)
+    print(f"Thresholds written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+import os
+import threading
+from typing import List
+
+from telemetry import record_documents
+
+# --- Context Packer ---
+# Turns the graded chunks into the {context} of the generate prompt. Chunks of
+# the same page are merged and their split overlap (chunk_overlap=200) is
+# written only once; the resulting passages are added in relevance order
+# until CONTEXT_TOKEN_BUDGET tokens are used. Tokens are counted with the
+# same tiktoken encoding the splitter uses.
+
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "3000"))
+TIKTOKEN_ENCODING = "gpt2"  # default of RecursiveCharacterTextSplitter.from_tiktoken_encoder
+# Shortest text shared by two chunks that counts as split overlap
+MIN_OVERLAP_CHARS = 50
+
+
+_UNSET = object()
+_encoding_value = _UNSET
+_encoding_lock = threading.Lock()
+
+
+def _encoding():
+    """
+    The tiktoken encoding, loaded once. Tokens are counted from the thread
+    pool and on the event loop (LLM gateway), so concurrent first calls wait
+    for one load instead of each loading it.
+    """
+    global _encoding_value
+    if _encoding_value is _UNSET:
+        with _encoding_lock:
+            if _encoding_value is _UNSET:
+                try:
+                    import tiktoken
+                    _encoding_value = tiktoken.get_encoding(TIKTOKEN_ENCODING)
+                except Exception as e:
+                    print(f"tiktoken unavailable ({e}), estimating tokens from characters.")
+                    _encoding_value = None
+    return _encoding_value
+
+
+def preload_encoding():
+    """
+    Load the encoding now (server warm-up) rather than in the first request.
+    """
+    _encoding()
+
+
+def count_tokens(text: str) -> int:
+    encoding = _encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    encoding = _encoding()
+    if encoding is None:
+        return text[:max_tokens * 4]
+    return encoding.decode(encoding.encode(text)[:max_tokens])
+
+
+def _overlap(left: str, right: str) -> int:
+    """
+    Length of the longest suffix of `left` that is a prefix of `right`
+    (at least MIN_OVERLAP_CHARS), or 0.
+    """
+    probe = right[:MIN_OVERLAP_CHARS]
+    if len(probe) < MIN_OVERLAP_CHARS:
+        return 0
+    start = left.find(probe)
+    while start != -1:
+        if right.startswith(left[start:]):
+            return len(left) - start
+        start = left.find(probe, start + 1)
+    return 0
+
+
+class _Passage:
+    __slots__ = ("source", "page", "text")
+
+    def __init__(self, source, page, text):
+        self.source = source
+        self.page = page
+        self.text = text
+
+    def absorb(self, text: str) -> bool:
+        """
+        Merge a chunk of the same page into the passage if they overlap or one
+        contains the other. Returns False if the chunk is unrelated.
+        """
+        if text in self.text:
+            return True
+        if self.text in text:
+            self.text = text
+            return True
+        after = _overlap(self.text, text)
+        if after:
+            self.text += text[after:]
+            return True
+        before = _overlap(text, self.text)
+        if before:
+            self.text = text + self.text[before:]
+            return True
+        return False
+
+    def format(self, number: int, text: str) -> str:
+        header = f"[{number}] {os.path.basename(self.source or '')}"
+        if self.page is not None:
+            header += f", sayfa {int(self.page) + 1}"
+        return f"{header}\n{text.strip()}"
+
+
+def build_passages(documents) -> List[_Passage]:
+    """
+    Merge chunks of the same page, keeping the order of first appearance
+    (i.e. relevance order).
+    """
+    passages = []
+    for doc in documents:
+        source = doc.metadata.get("source")
+        page = doc.metadata.get("page")
+        for passage in passages:
+            if passage.source == source and passage.page == page and passage.absorb(doc.page_content):
+                break
+        else:
+            passages.append(_Passage(source, page, doc.page_content))
+
+    # A merged passage may now bridge two passages created before it.
+    merged = []
+    for passage in passages:
+        for target in merged:
+            if target.source == passage.source and target.page == passage.page and target.absorb(passage.text):
+                break
+        else:
+            merged.append(passage)
+    return merged
+
+
+def pack_context(documents, budget: int = CONTEXT_TOKEN_BUDGET) -> str:
+    """
+    Format the documents as numbered passages within `budget` tokens.
+    """
+    blocks = []
+    used = 0
+    for passage in build_passages(documents):
+        block = passage.format(len(blocks) + 1, passage.text)
+        tokens = count_tokens(block) + 2  # blank line separator
+        if used + tokens > budget:
+            if blocks:
+                # Try the remaining, possibly shorter passages.
+                continue
+            # Even the most relevant passage is too long: keep its beginning.
+            block = truncate_tokens(block, budget)
+            tokens = count_tokens(block)
+        blocks.append(block)
+        used += tokens
+    print(f"---CONTEXT: {len(blocks)} passages, ~{used} tokens---")
+    record_documents("packed", len(blocks))
+    return "\n\n".join(blocks)
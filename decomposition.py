@@ -0,0 +1,83 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+from answer_cache import normalize_question
+
+# --- Decomposition Shortcuts ---
+# decompose_query costs one LLM round trip before retrieval can start. Short,
+# self-contained questions without chat history skip it (hybrid retrieval
+# finds their chunks without paraphrases), and LLM results are memoized by
+# (normalized question, chat-history digest) for DECOMPOSITION_CACHE_TTL
+# seconds.
+
+DECOMPOSITION_CACHE_TTL = float(os.environ.get("DECOMPOSITION_CACHE_TTL", "3600"))
+DECOMPOSITION_CACHE_MAX_ENTRIES = int(os.environ.get("DECOMPOSITION_CACHE_MAX_ENTRIES", "1000"))
+# Questions up to this many words may skip decomposition (0 disables skipping).
+DECOMPOSITION_SKIP_MAX_WORDS = int(os.environ.get("DECOMPOSITION_SKIP_MAX_WORDS", "6"))
+
+# Words that point back at earlier turns ("bu ne demek", "olmadı", "peki ya o?")
+FOLLOW_UP_WORDS = {
+    "bu", "şu", "o", "bunu", "şunu", "onu", "bunun", "şunun", "onun", "buna", "şuna", "ona",
+    "bunlar", "şunlar", "onlar", "bunları", "onları", "burada", "orada", "burası", "orası",
+    "böyle", "öyle", "aynı", "peki", "ya", "olmadı", "hani", "yukarıdaki", "önceki",
+    "bahsettiğin", "bahsettiğiniz", "dediğin", "dediğiniz", "söylediğin", "söylediğiniz",
+    "diğeri", "diğer", "başka", "tekrar", "yine", "it", "that", "this",
+}
+
+
+def can_skip(question: str, chat_history: Optional[List[str]]) -> bool:
+    """
+    True if the question is short, there is no chat history and nothing in it
+    refers back to an earlier turn, so decomposition would add little.
+    """
+    if chat_history or DECOMPOSITION_SKIP_MAX_WORDS <= 0:
+        return False
+    tokens = normalize_question(question).split()
+    if not tokens or len(tokens) > DECOMPOSITION_SKIP_MAX_WORDS:
+        return False
+    return not any(token in FOLLOW_UP_WORDS for token in tokens)
+
+
+def history_digest(chat_history: Optional[List[str]]) -> str:
+    return hashlib.sha256("\x00".join(chat_history or []).encode("utf-8")).hexdigest()
+
+
+class DecompositionCache:
+    def __init__(
+        self,
+        ttl: float = DECOMPOSITION_CACHE_TTL,
+        max_entries: int = DECOMPOSITION_CACHE_MAX_ENTRIES,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires, sub_questions)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(question, chat_history):
+        return normalize_question(question), history_digest(chat_history)
+
+    def get(self, question: str, chat_history=None) -> Optional[List[str]]:
+        key = self._key(question, chat_history)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, sub_questions = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return list(sub_questions)
+
+    def put(self, question: str, chat_history, sub_questions: List[str]):
+        key = self._key(question, chat_history)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, tuple(sub_questions))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -0,0 +1,168 @@
+import os
+import time
+import sqlite3
+import hashlib
+import inspect
+import threading
+import unicodedata
+from array import array
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+from telemetry import record_embedding_call, record_embedding_cache
+
+# --- Embedding Cache ---
+# Embeddings are cached on disk keyed by (model, kind, normalized text hash), so
+# re-ingesting a PDF, repeating a question or re-running the visualization does
+# not call the embedding API again. "kind" separates query and document vectors,
+# which Gemini computes with different task types.
+
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", "./embedding_cache.sqlite")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+
+
+def normalize_text(text: str) -> str:
+    """
+    Unicode-normalize and collapse whitespace so trivially different copies share a key.
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper backed by a local SQLite store with LRU eviction.
+    """
+
+    def __init__(
+        self,
+        base: Embeddings,
+        path: str = EMBEDDING_CACHE_PATH,
+        max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES,
+    ):
+        self.base = base
+        self.model = getattr(base, "model", None) or type(base).__name__
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )"""
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+        )
+        self._conn.commit()
+
+    def _key(self, kind: str, text: str) -> str:
+        raw = f"{self.model}\x00{kind}\x00{text}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys: List[str]) -> dict:
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+                self._conn.commit()
+        return found
+
+    def _store(self, items: dict):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, array("f", vector).tobytes(), now) for key, vector in items.items()],
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        if count <= self.max_entries:
+            return
+        # Evict down to 90% of the cap so eviction does not run on every insert.
+        excess = count - int(self.max_entries * 0.9)
+        self._conn.execute(
+            """DELETE FROM embeddings WHERE key IN (
+                SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?
+            )""",
+            (excess,),
+        )
+
+    def _embed_cached(self, kind: str, texts: List[str], compute) -> List[List[float]]:
+        normalized = [normalize_text(t) for t in texts]
+        keys = [self._key(kind, t) for t in normalized]
+        cached = self._lookup(list(dict.fromkeys(keys)))
+
+        missing = {}
+        for key, text in zip(keys, normalized):
+            if key not in cached and key not in missing:
+                missing[key] = text
+
+        hits = len(keys) - sum(1 for key in keys if key in missing)
+        self.hits += hits
+        self.misses += len(missing)
+        record_embedding_cache(hits, len(missing))
+
+        if missing:
+            start = time.perf_counter()
+            vectors = compute(list(missing.values()))
+            record_embedding_call(kind, time.perf_counter() - start, len(missing))
+            # Round-trip through float32 so fresh and cached vectors are identical.
+            computed = {
+                key: array("f", vector).tolist()
+                for key, vector in zip(missing.keys(), vectors)
+            }
+            self._store(computed)
+            cached.update(computed)
+
+        return [cached[key] for key in keys]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed_cached("document", texts, self.base.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed_cached(
+            "query", [text], lambda texts: [self.base.embed_query(texts[0])]
+        )[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed several queries, sending all cache misses in a single upstream call.
+        """
+        return self._embed_cached("query", texts, self._embed_query_batch)
+
+    def _embed_query_batch(self, texts: List[str]) -> List[List[float]]:
+        # Gemini embeds queries with the RETRIEVAL_QUERY task type; its batch
+        # endpoint accepts the task type, so N queries cost one round trip.
+        if "task_type" in inspect.signature(self.base.embed_documents).parameters:
+            return self.base.embed_documents(texts, task_type="RETRIEVAL_QUERY")
+        return [self.base.embed_query(text) for text in texts]
+
+    def stats(self) -> dict:
+        with self._lock:
+            (entries,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import threading
+from typing import Optional, Tuple
+
+import numpy as np
+
+from answer_cache import normalize_question
+from telemetry import record_route_decision
+
+# --- Fast Router ---
+# Local classifier in front of the route_query LLM call. Stage 1 is a Turkish
+# lexicon match (microseconds); stage 2 compares the question embedding with
+# the centroids of labelled example messages. Only when neither stage is
+# confident does route_query ask the LLM. Every decision can be appended to
+# ROUTER_LOG_PATH (JSON lines) to tune the thresholds.
+
+ROUTER_CENTROID_MARGIN = float(os.environ.get("ROUTER_CENTROID_MARGIN", "0.08"))
+ROUTER_USE_CENTROIDS = os.environ.get("ROUTER_USE_CENTROIDS", "1") == "1"
+ROUTER_LOG_PATH = os.environ.get("ROUTER_LOG_PATH")
+
+# Whole-message small talk: a message made only of these words is CHITCHAT.
+CHITCHAT_WORDS = {
+    "merhaba", "merhabalar", "selam", "selamlar", "slm", "mrb", "hey", "hi", "hello",
+    "günaydın", "iyi", "günler", "akşamlar", "geceler", "çalışmalar", "kolay", "gelsin",
+    "teşekkürler", "teşekkür", "ederim", "ederiz", "tşk", "tşkler", "sağol", "sağolun",
+    "sağ", "olun", "ol", "eyvallah", "rica", "tamam", "tamamdır", "peki", "ok", "okey",
+    "anladım", "hoşça", "kal", "kalın", "görüşürüz", "nasılsın", "nasılsınız", "naber",
+    "thanks", "bye", "evet", "hayır", "çok", "size", "sana", "de", "da", "bir", "şey",
+}
+
+# Technical vocabulary (token prefixes, so inflected forms match too).
+TECHNICAL_STEMS = (
+    "sados", "sınav", "sertifika", "ödeme", "öde", "giriş", "şifre", "parola", "kayıt",
+    "üye", "eğitim", "ders", "kurs", "belge", "başvur", "şartname", "ihale", "modül",
+    "öğrenci", "öğretmen", "ücret", "fatura", "hesab", "hesap", "sistem", "portal",
+    "lms", "cdn", "e-posta", "eposta", "mail", "uygulama", "yükle", "indir", "video",
+    "sözleşme", "teknik", "diploma", "transkript", "kullanıcı", "erişim", "hata",
+)
+
+CHITCHAT_EXAMPLES = [
+    "merhaba", "selam nasılsın", "günaydın", "iyi günler", "teşekkür ederim",
+    "çok sağ olun yardımcı oldunuz", "tamam anladım", "hoşça kalın",
+    "bu ne biçim hizmet", "sizden hiç memnun değilim", "kimsin sen", "naber",
+]
+RAG_EXAMPLES = [
+    "nasıl üye olurum", "sertifikamı nereden indirebilirim", "sınav ne zaman",
+    "ödeme nasıl yapılır", "sisteme giriş yapamıyorum", "şifremi unuttum",
+    "eğitim videoları açılmıyor", "kayıt için gerekli belgeler nelerdir",
+    "teknik şartnamede hangi modüller var", "ders programını nerede görebilirim",
+    "ücret iadesi nasıl alınır", "hesabım neden kilitlendi",
+]
+
+
+class FastRouter:
+    def __init__(
+        self,
+        margin: float = ROUTER_CENTROID_MARGIN,
+        use_centroids: bool = ROUTER_USE_CENTROIDS,
+        log_path: Optional[str] = ROUTER_LOG_PATH,
+    ):
+        self.margin = margin
+        self.use_centroids = use_centroids
+        self.log_path = log_path
+        self._centroids = {}  # embeddings model -> (rag centroid, chitchat centroid)
+        self._lock = threading.Lock()
+
+    def route_lexicon(self, question: str) -> Tuple[Optional[str], float]:
+        """
+        Keyword stage. Returns (route or None, elapsed seconds).
+        """
+        start = time.perf_counter()
+        tokens = normalize_question(question).split()
+        route = None
+        if any(token.startswith(TECHNICAL_STEMS) for token in tokens):
+            route = "rag"
+        elif tokens and len(tokens) <= 8 and all(token in CHITCHAT_WORDS for token in tokens):
+            route = "chitchat"
+        return route, time.perf_counter() - start
+
+    def _centroids_for(self, embeddings):
+        model = getattr(embeddings, "model", None) or type(embeddings).__name__
+        with self._lock:
+            centroids = self._centroids.get(model)
+        if centroids is None:
+            # Cached on disk by CachedEmbeddings after the first run.
+            vectors = embeddings.embed_queries(RAG_EXAMPLES + CHITCHAT_EXAMPLES)
+            matrix = _unit_rows(np.asarray(vectors, dtype=np.float32))
+            rag = matrix[:len(RAG_EXAMPLES)].mean(axis=0)
+            chitchat = matrix[len(RAG_EXAMPLES):].mean(axis=0)
+            centroids = (rag / np.linalg.norm(rag), chitchat / np.linalg.norm(chitchat))
+            with self._lock:
+                self._centroids[model] = centroids
+        return centroids
+
+    def route_centroid(self, question: str, embeddings) -> Tuple[Optional[str], float]:
+        """
+        Nearest-centroid stage. Returns (route or None, similarity margin rag - chitchat).
+        Blocking: may embed the question.
+        """
+        rag, chitchat = self._centroids_for(embeddings)
+        vector = np.asarray(embeddings.embed_query(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if not norm:
+            return None, 0.0
+        vector /= norm
+        score = float(vector @ rag - vector @ chitchat)
+        if score >= self.margin:
+            return "rag", score
+        if score <= -self.margin:
+            return "chitchat", score
+        return None, score
+
+    def route_local(self, question: str) -> Optional[str]:
+        """
+        Lexicon stage with logging; cheap enough to run on the event loop.
+        """
+        route, elapsed = self.route_lexicon(question)
+        if route is not None:
+            self.log(question, "lexicon", route, elapsed=elapsed)
+        return route
+
+    def route_embedding(self, question: str, embeddings) -> Tuple[Optional[str], Optional[float]]:
+        """
+        Centroid stage with logging. Returns (route or None, margin or None).
+        """
+        if not self.use_centroids or not hasattr(embeddings, "embed_queries"):
+            return None, None
+        try:
+            route, score = self.route_centroid(question, embeddings)
+        except Exception as e:
+            print(f"Fast router centroid stage failed: {e}")
+            return None, None
+        if route is not None:
+            self.log(question, "centroid", route, score=score)
+        return route, score
+
+    def route(self, question: str, embeddings) -> Tuple[Optional[str], Optional[float]]:
+        """
+        Run both local stages. Returns (route or None, centroid margin if computed).
+        """
+        route = self.route_local(question)
+        if route is not None:
+            return route, None
+        return self.route_embedding(question, embeddings)
+
+    def log(self, question: str, stage: str, route: str, score: Optional[float] = None, elapsed: Optional[float] = None):
+        """
+        Record a routing decision; stage is "lexicon", "centroid", "llm" or "planner".
+        """
+        record_route_decision(stage, route)
+        detail = f", margin={score:.3f}" if score is not None else ""
+        print(f"---ROUTED BY {stage.upper()}: {route.upper()}{detail}---")
+        if not self.log_path:
+            return
+        record = {
+            "ts": time.time(),
+            "question": question,
+            "stage": stage,
+            "route": route,
+            "margin": score,
+            "elapsed_ms": round(elapsed * 1000, 4) if elapsed is not None else None,
+        }
+        with self._lock:
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def _unit_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
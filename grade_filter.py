@@ -0,0 +1,154 @@
+import os
+import json
+import time
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# --- Grading Pre-filter ---
+# retrieve carries each chunk's vector relevance score: its similarity to the
+# sub-question that found it, with higher meaning more similar. grade_documents
+# accepts chunks scoring at least the `accept` threshold and rejects chunks
+# below the `reject` threshold without asking the LLM. Only the band in
+# between goes to the grader, as do chunks found by BM25 alone, which have no
+# vector score.
+#
+# The scale of the scores depends on the vector store backend: numpy gives
+# cosine similarity, Chroma gives its relevance transform of the L2 distance.
+# The thresholds are therefore fitted by calibrate_grading.py against LLM
+# verdicts recorded in GRADE_LOG_PATH, and are read from GRADE_THRESHOLDS_PATH.
+# Without thresholds every chunk goes to the LLM.
+
+GRADE_THRESHOLDS_PATH = os.environ.get("GRADE_THRESHOLDS_PATH", "./grading_thresholds.json")
+# JSON-lines log of LLM verdicts with the chunk's score, for calibration
+GRADE_LOG_PATH = os.environ.get("GRADE_LOG_PATH")
+# Explicit thresholds override the calibration file
+GRADE_ACCEPT_SCORE = os.environ.get("GRADE_ACCEPT_SCORE")
+GRADE_REJECT_SCORE = os.environ.get("GRADE_REJECT_SCORE")
+
+
+def _optional_float(value) -> Optional[float]:
+    return float(value) if value not in (None, "") else None
+
+
+def decide(score: Optional[float], accept: Optional[float], reject: Optional[float]) -> Optional[bool]:
+    """
+    True (relevant) or False (irrelevant) if the score settles it, else None.
+    """
+    if score is None:
+        return None
+    if accept is not None and score >= accept:
+        return True
+    if reject is not None and score < reject:
+        return False
+    return None
+
+
+class ScoreFilter:
+    def __init__(
+        self,
+        accept: Optional[float] = None,
+        reject: Optional[float] = None,
+        backend: Optional[str] = None,
+        log_path: Optional[str] = GRADE_LOG_PATH,
+    ):
+        self.accept = accept
+        self.reject = reject
+        self.backend = backend
+        self.log_path = log_path
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, backend: str, path: str = GRADE_THRESHOLDS_PATH) -> "ScoreFilter":
+        """
+        Thresholds from the environment, else from the calibration file if it
+        was fitted for this backend.
+        """
+        accept, reject = _optional_float(GRADE_ACCEPT_SCORE), _optional_float(GRADE_REJECT_SCORE)
+        if accept is None and reject is None and os.path.exists(path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    fitted = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Could not read grading thresholds {path}: {e}")
+                fitted = {}
+            if fitted.get("backend") == backend:
+                accept, reject = fitted.get("accept"), fitted.get("reject")
+            elif fitted:
+                print(f"Grading thresholds in {path} were fitted for {fitted.get('backend')}, not {backend}; ignoring them.")
+        if accept is not None or reject is not None:
+            print(f"Grading pre-filter: accept >= {accept}, reject < {reject}")
+        return cls(accept, reject, backend)
+
+    def prejudge(self, scores: Optional[Sequence[Optional[float]]], count: int) -> List[Optional[bool]]:
+        """
+        One verdict per chunk: True/False when the score decides it, None when
+        the LLM has to.
+        """
+        if not scores:
+            return [None] * count
+        return [decide(score, self.accept, self.reject) for score in scores]
+
+    def log(self, question: str, chunk_ids: List[str], scores: List[Optional[float]], verdicts: List[Optional[bool]]):
+        """
+        Append the LLM verdicts of scored chunks to the calibration log.
+        """
+        if not self.log_path:
+            return
+        now = time.time()
+        lines = [
+            json.dumps({
+                "ts": now,
+                "question": question,
+                "chunk_id": chunk_id,
+                "score": score,
+                "verdict": verdict,
+                "backend": self.backend,
+            }, ensure_ascii=False) + "\n"
+            for chunk_id, score, verdict in zip(chunk_ids, scores, verdicts)
+            if score is not None and verdict is not None
+        ]
+        if not lines:
+            return
+        with self._lock:
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.writelines(lines)
+
+
+def fit_thresholds(samples: List[Tuple[float, bool]], target: float = 0.95, min_samples: int = 20) -> Dict:
+    """
+    Fit thresholds to (score, LLM verdict) pairs. `accept` is the lowest score
+    at or above which at least `target` of the chunks were judged relevant;
+    `reject` is the highest score below which at least `target` were judged
+    irrelevant. Each side needs `min_samples` chunks, otherwise it stays None.
+    """
+    samples = sorted(samples)
+    n = len(samples)
+    accept = None
+    relevant = 0
+    for i in range(n - 1, -1, -1):
+        relevant += samples[i][1]
+        size = n - i
+        if size >= min_samples and relevant / size >= target and (i == 0 or samples[i - 1][0] < samples[i][0]):
+            accept = samples[i][0]
+
+    reject = None
+    irrelevant = 0
+    for i in range(n):
+        irrelevant += not samples[i][1]
+        size = i + 1
+        if size >= min_samples and irrelevant / size >= target and (i == n - 1 or samples[i + 1][0] > samples[i][0]):
+            # Threshold between this score and the next one up
+            reject = samples[i + 1][0] if i + 1 < n else samples[i][0] + 1e-9
+    if accept is not None and reject is not None and reject > accept:
+        reject = accept
+
+    decisions = [(decide(score, accept, reject), verdict) for score, verdict in samples]
+    decided = [(decision, verdict) for decision, verdict in decisions if decision is not None]
+    return {
+        "accept": accept,
+        "reject": reject,
+        "samples": n,
+        "coverage": round(len(decided) / n, 4) if n else 0.0,
+        "agreement": round(sum(d == v for d, v in decided) / len(decided), 4) if decided else None,
+        "target": target,
+    }
@@ -0,0 +1,348 @@
+import os
+import json
+import hashlib
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple, Union
+
+from partitions import chunk_metadata, partitions_in
+
+# --- Index Manifest ---
+# The manifest records, for every ingested PDF, the hash of its bytes and the
+# IDs of the chunks it produced. A rebuild compares it against the files on
+# disk so only new or changed PDFs are parsed and embedded again.
+#
+# Ingestion is a streaming pipeline: pages are loaded lazily, split into
+# chunks, and embedded + upserted in batches of INGEST_BATCH_SIZE. After each
+# batch the checkpoint records which chunks of the in-progress file are
+# already stored, so an interrupted build resumes where it stopped.
+#
+# Several data directories share one index; each chunk is tagged with its
+# partition (source folder), document type and file (see partitions.py).
+
+MANIFEST_NAME = "manifest.json"
+CHECKPOINT_NAME = "checkpoint.json"
+# 2: chunks carry partition metadata
+MANIFEST_VERSION = 2
+# Chunks embedded and upserted per batch
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", "64"))
+# Processes used to parse and split PDFs (CPU-bound); defaults to all cores.
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", "0")) or os.cpu_count() or 1
+
+
+def file_sha256(path: str) -> str:
+    """
+    Hash the raw bytes of a file.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_json(path: str, data):
+    """
+    Atomically write a JSON file so an interrupted build never leaves it half-written.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def load_manifest(persist_dir: str) -> Dict:
+    """
+    Load the manifest from the persist directory, or return None if there is none.
+    """
+    path = os.path.join(persist_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Could not read manifest ({e}), rebuilding index.")
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def save_manifest(persist_dir: str, manifest: Dict):
+    _write_json(os.path.join(persist_dir, MANIFEST_NAME), manifest)
+
+
+def load_checkpoint(persist_dir: str) -> Dict:
+    """
+    Load the checkpoint: {path: {"sha256": ..., "done": [chunk ids already upserted]}}.
+    """
+    path = os.path.join(persist_dir, CHECKPOINT_NAME)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_checkpoint(persist_dir: str, checkpoint: Dict):
+    _write_json(os.path.join(persist_dir, CHECKPOINT_NAME), checkpoint)
+
+
+def manifest_version(persist_dir: str):
+    """
+    Cheap version stamp of the index: changes whenever the manifest is rewritten.
+    """
+    try:
+        return os.stat(os.path.join(persist_dir, MANIFEST_NAME)).st_mtime_ns
+    except OSError:
+        return None
+
+
+def new_manifest() -> Dict:
+    return {"version": MANIFEST_VERSION, "files": {}}
+
+
+def list_pdfs(data_dir: str) -> List[str]:
+    """
+    Return the normalized paths of all PDFs directly inside data_dir.
+    """
+    return sorted(
+        os.path.normpath(os.path.join(data_dir, f))
+        for f in os.listdir(data_dir)
+        if f.lower().endswith(".pdf")
+    )
+
+
+def chunk_id(source: str, page, content: str, occurrence: int) -> str:
+    """
+    Stable chunk ID derived from the chunk's file, page and text.
+    `occurrence` disambiguates identical text repeated on the same page.
+    """
+    key = f"{source}\x00{page}\x00{occurrence}\x00{content}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def iter_chunks(path: str) -> Iterator:
+    """
+    Lazily load a PDF page by page and yield its chunks, tagged with their IDs.
+    Only one page is held in memory at a time.
+    """
+    # Imported here: the PDF stack is only needed when something gets indexed.
+    from langchain_community.document_loaders import PyPDFLoader
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    loader = PyPDFLoader(path)
+    text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        chunk_size=1000, chunk_overlap=200
+    )
+
+    metadata = chunk_metadata(path)
+    seen = {}
+    for page in loader.lazy_load():
+        for chunk in text_splitter.split_documents([page]):
+            chunk.metadata["source"] = path
+            chunk.metadata.update(metadata)
+            page_number = chunk.metadata.get("page")
+            key = (page_number, chunk.page_content)
+            occurrence = seen.get(key, 0)
+            seen[key] = occurrence + 1
+            chunk.id = chunk_id(path, page_number, chunk.page_content, occurrence)
+            chunk.metadata["chunk_id"] = chunk.id
+            yield chunk
+
+
+def load_and_split(path: str) -> List:
+    """
+    Load a PDF and split it into chunks (process-pool entry point).
+    """
+    return list(iter_chunks(path))
+
+
+def _delete(vectorstore, ids: Iterable[str]):
+    ids = list(ids)
+    for i in range(0, len(ids), INGEST_BATCH_SIZE):
+        vectorstore.delete(ids=ids[i:i + INGEST_BATCH_SIZE])
+
+
+def _parsed_files(paths: List[str]) -> Iterator[Tuple[str, object]]:
+    """
+    Yield (path, chunks) for each file, where chunks is an iterable of chunks or
+    the exception that stopped parsing.
+
+    With several workers, files are parsed in a process pool; at most
+    2 x workers parsed files wait for the embedding stage at any time, so a slow
+    embedding stage holds back parsing instead of piling results up in memory.
+    """
+    workers = min(INGEST_WORKERS, len(paths))
+    if workers <= 1:
+        for path in paths:
+            yield path, iter_chunks(path)
+        return
+
+    # "spawn" keeps workers independent of the parent's threads and open clients.
+    context = multiprocessing.get_context("spawn")
+    window = 2 * workers
+    queue = iter(paths)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        pending = {}
+
+        def fill():
+            while len(pending) < window:
+                path = next(queue, None)
+                if path is None:
+                    return
+                pending[pool.submit(load_and_split, path)] = path
+
+        fill()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                try:
+                    yield path, future.result()
+                except Exception as e:
+                    yield path, e
+            fill()
+
+
+def _index_file(vectorstore, persist_dir, path, digest, chunks, old_ids, checkpoint):
+    """
+    Embed and upsert one file's new chunks in batches, checkpointing after each
+    batch. Returns (chunk ids of the file, number of chunks added).
+    """
+    state = checkpoint.get(path)
+    if not state or state["sha256"] != digest:
+        state = checkpoint[path] = {"sha256": digest, "done": []}
+    done = set(state["done"])
+
+    new_ids = []
+    batch = []
+    added = 0
+
+    def flush():
+        nonlocal added
+        vectorstore.add_documents(batch, ids=[c.id for c in batch])
+        state["done"].extend(c.id for c in batch)
+        save_checkpoint(persist_dir, checkpoint)
+        added += len(batch)
+        batch.clear()
+
+    for chunk in chunks:
+        new_ids.append(chunk.id)
+        if chunk.id in old_ids or chunk.id in done:
+            continue
+        batch.append(chunk)
+        if len(batch) >= INGEST_BATCH_SIZE:
+            flush()
+    if batch:
+        flush()
+
+    return new_ids, added
+
+
+def sync_index(vectorstore, data_dirs: Union[str, Sequence[str]], persist_dir: str) -> Tuple[int, int, int]:
+    """
+    Bring the vector store in line with the PDFs in data_dirs (one directory
+    or several).
+
+    Unchanged files are skipped without being parsed. Changed files are
+    parsed in parallel and re-split, and only chunks whose IDs are not already
+    indexed get embedded. Chunks of removed files are deleted. A file that
+    fails to parse is reported and left as it was.
+
+    Returns (files_indexed, chunks_added, chunks_deleted).
+    """
+    manifest = load_manifest(persist_dir)
+    if manifest is None:
+        # Without a manifest we cannot tell which stored chunks are stale.
+        if hasattr(vectorstore, "reset_collection"):
+            vectorstore.reset_collection()
+        manifest = new_manifest()
+        save_manifest(persist_dir, manifest)
+        save_checkpoint(persist_dir, {})
+
+    known = manifest["files"]
+    if isinstance(data_dirs, str):
+        data_dirs = [data_dirs]
+    on_disk = sorted(path for data_dir in data_dirs for path in list_pdfs(data_dir))
+    files_indexed = chunks_added = chunks_deleted = 0
+
+    digests = {}
+    for path in on_disk:
+        try:
+            digest = file_sha256(path)
+        except OSError as e:
+            print(f"Failed to read {path}: {e}")
+            continue
+        entry = known.get(path)
+        if not entry or entry["sha256"] != digest:
+            digests[path] = digest
+
+    # Chunks upserted by an interrupted build for a file that has since changed
+    # or disappeared are orphans; matching files resume from their checkpoint.
+    checkpoint = load_checkpoint(persist_dir)
+    for path, state in list(checkpoint.items()):
+        if digests.get(path) != state["sha256"]:
+            referenced = set(known.get(path, {}).get("chunks", []))
+            _delete(vectorstore, set(state["done"]) - referenced)
+            del checkpoint[path]
+            save_checkpoint(persist_dir, checkpoint)
+        else:
+            print(f"Resuming: {os.path.basename(path)} ({len(state['done'])} chunks already stored)")
+
+    failed = []
+    for path, chunks in _parsed_files(list(digests)):
+        entry = known.get(path)
+        old_ids = set(entry["chunks"]) if entry else set()
+        try:
+            if isinstance(chunks, Exception):
+                raise chunks
+            new_ids, added = _index_file(
+                vectorstore, persist_dir, path, digests[path], chunks, old_ids, checkpoint
+            )
+        except Exception as e:
+            print(f"Failed to load {os.path.basename(path)}: {e}")
+            failed.append(path)
+            continue
+        print(f"Indexed: {os.path.basename(path)} ({len(new_ids)} chunks, {added} new)")
+
+        stale = old_ids.difference(new_ids)
+        if stale:
+            _delete(vectorstore, stale)
+
+        known[path] = {"sha256": digests[path], "chunks": new_ids}
+        save_manifest(persist_dir, manifest)
+        del checkpoint[path]
+        save_checkpoint(persist_dir, checkpoint)
+
+        files_indexed += 1
+        chunks_added += added
+        chunks_deleted += len(stale)
+
+    for path in set(known).difference(on_disk):
+        print(f"Removing: {os.path.basename(path)}...")
+        stale = known.pop(path)["chunks"]
+        _delete(vectorstore, stale)
+        save_manifest(persist_dir, manifest)
+        chunks_deleted += len(stale)
+
+    if failed:
+        print(f"{len(failed)} file(s) failed to load: {', '.join(os.path.basename(p) for p in failed)}")
+
+    return files_indexed, chunks_added, chunks_deleted
+
+
+def indexed_chunk_count(persist_dir: str) -> int:
+    manifest = load_manifest(persist_dir)
+    if manifest is None:
+        return 0
+    return sum(len(entry["chunks"]) for entry in manifest["files"].values())
+
+
+def indexed_partitions(persist_dir: str) -> List[str]:
+    manifest = load_manifest(persist_dir)
+    if manifest is None:
+        return []
+    return partitions_in(manifest["files"])
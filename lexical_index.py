@@ -0,0 +1,228 @@
+import os
+import re
+import json
+import unicodedata
+from collections import Counter
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# --- Lexical Index ---
+# BM25 over the same chunks as the vector store, so exact identifiers (SADOS
+# module names, tender article numbers, product codes) are found even when
+# the dense retriever misses them. Postings are stored in CSR form: one
+# offsets array into flat doc-index and term-frequency arrays. Each chunk also
+# keeps its partition label, so a search can be restricted to partitions.
+
+LEXICAL_INDEX_NAME = "lexical_index.npz"
+# Bump when tokenization changes so persisted indexes get rebuilt.
+LEXICAL_INDEX_FORMAT = 2
+BM25_K1 = float(os.environ.get("BM25_K1", "1.5"))
+BM25_B = float(os.environ.get("BM25_B", "0.75"))
+
+# Turkish letters folded to ASCII after lower-casing
+_FOLD = str.maketrans({"ç": "c", "ğ": "g", "ı": "i", "ö": "o", "ş": "s", "ü": "u", "â": "a", "î": "i", "û": "u"})
+
+# Suffix after an apostrophe on proper nouns ("SADOS'un", "İstanbul'da")
+_APOSTROPHE_SUFFIX = re.compile(r"['’][a-z]+")
+
+# Identifiers such as "4.2.1", "SADOS-3" or "ABC/123" are kept whole.
+_TOKEN = re.compile(r"[a-z0-9]+(?:[./-][a-z0-9]+)*")
+
+# Common inflectional suffixes (already folded), longest first.
+_SUFFIXES = sorted({
+    "lari", "leri", "larin", "lerin", "larda", "lerde", "lardan", "lerden", "lar", "ler",
+    "nin", "nun", "in", "un", "dan", "den", "tan", "ten", "ndan", "nden",
+    "da", "de", "ta", "te", "nda", "nde", "ya", "ye", "yi", "yu", "ni", "nu",
+    "si", "su", "sini", "sunu", "i", "u", "a", "e",
+    "li", "lu", "siz", "suz", "lik", "luk", "dir", "dur", "tir", "tur", "mi", "mu",
+    "im", "um", "in", "un", "iniz", "unuz", "imiz", "umuz", "niz", "nuz", "miz", "muz",
+}, key=len, reverse=True)
+
+MIN_STEM = 4
+
+
+def fold(text: str) -> str:
+    """
+    Turkish-aware case folding (İ -> i, I -> ı) followed by diacritic folding.
+    """
+    text = unicodedata.normalize("NFC", text)
+    text = text.replace("İ", "i").replace("I", "ı").lower()
+    text = text.translate(_FOLD)
+    # Drop any remaining combining marks (e.g. from decomposed PDF text).
+    return "".join(c for c in unicodedata.normalize("NFD", text) if not unicodedata.combining(c))
+
+
+def stem(token: str) -> str:
+    """
+    Strip up to three inflectional suffixes from an alphabetic token.
+    """
+    if not token.isalpha():
+        return token
+    for _ in range(3):
+        for suffix in _SUFFIXES:
+            if token.endswith(suffix) and len(token) - len(suffix) >= MIN_STEM:
+                token = token[:-len(suffix)]
+                break
+        else:
+            break
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for token in _TOKEN.findall(_APOSTROPHE_SUFFIX.sub("", fold(text))):
+        tokens.append(stem(token))
+        if not token.isalnum():
+            # Also index the parts of an identifier ("sados-3" -> "sados", "3").
+            tokens.extend(stem(part) for part in re.split(r"[./-]", token) if part)
+    return tokens
+
+
+class LexicalIndex:
+    def __init__(self, chunk_ids, vocab, offsets, doc_ids, tfs, doc_lengths, version=None,
+                 partition_names=(), partition_codes=None):
+        self.chunk_ids = list(chunk_ids)
+        self.vocab = vocab
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_lengths = doc_lengths
+        self.version = version
+        self.partition_names = list(partition_names)
+        # Index into partition_names per chunk, -1 for chunks without a partition
+        self.partition_codes = (
+            partition_codes if partition_codes is not None else np.full(len(self.chunk_ids), -1, dtype=np.int32)
+        )
+        self.avg_length = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+        doc_freq = np.diff(offsets).astype(np.float32)
+        n = len(self.chunk_ids)
+        self.idf = np.log(1.0 + (n - doc_freq + 0.5) / (doc_freq + 0.5)).astype(np.float32)
+
+    @classmethod
+    def build(cls, chunks: Iterable[Tuple[str, str]], version=None,
+              partitions: Optional[Sequence[Optional[str]]] = None) -> "LexicalIndex":
+        """
+        Build from (chunk_id, text) pairs, with an optional partition label per chunk.
+        """
+        chunk_ids = []
+        doc_lengths = []
+        postings = {}
+        for doc_index, (cid, text) in enumerate(chunks):
+            tokens = tokenize(text)
+            chunk_ids.append(cid)
+            doc_lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                postings.setdefault(term, []).append((doc_index, tf))
+
+        terms = sorted(postings)
+        vocab = {term: i for i, term in enumerate(terms)}
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        for i, term in enumerate(terms):
+            offsets[i + 1] = offsets[i] + len(postings[term])
+        doc_ids = np.empty(offsets[-1], dtype=np.int32)
+        tfs = np.empty(offsets[-1], dtype=np.uint16)
+        for i, term in enumerate(terms):
+            entries = postings[term]
+            doc_ids[offsets[i]:offsets[i + 1]] = [d for d, _ in entries]
+            tfs[offsets[i]:offsets[i + 1]] = [min(tf, 65535) for _, tf in entries]
+
+        partition_names = sorted({p for p in partitions or () if p is not None})
+        codes = {name: i for i, name in enumerate(partition_names)}
+        partition_codes = np.asarray(
+            [codes.get(p, -1) for p in partitions] if partitions is not None else [-1] * len(chunk_ids),
+            dtype=np.int32,
+        )
+        return cls(chunk_ids, vocab, offsets, doc_ids, tfs,
+                   np.asarray(doc_lengths, dtype=np.int32), version, partition_names, partition_codes)
+
+    def save(self, path: str):
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            offsets=self.offsets,
+            doc_ids=self.doc_ids,
+            tfs=self.tfs,
+            doc_lengths=self.doc_lengths,
+            partition_codes=self.partition_codes,
+            meta=np.frombuffer(json.dumps({
+                "chunk_ids": self.chunk_ids,
+                "terms": sorted(self.vocab, key=self.vocab.get),
+                "version": self.version,
+                "partitions": self.partition_names,
+                "format": LEXICAL_INDEX_FORMAT,
+            }).encode("utf-8"), dtype=np.uint8),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "LexicalIndex":
+        with np.load(path) as data:
+            meta = json.loads(data["meta"].tobytes().decode("utf-8"))
+            if meta.get("format") != LEXICAL_INDEX_FORMAT:
+                raise ValueError("outdated format")
+            return cls(
+                meta["chunk_ids"],
+                {term: i for i, term in enumerate(meta["terms"])},
+                data["offsets"],
+                data["doc_ids"],
+                data["tfs"],
+                data["doc_lengths"],
+                meta.get("version"),
+                meta.get("partitions", []),
+                data["partition_codes"],
+            )
+
+    def search(self, query: str, k: int = 4, partitions: Optional[Sequence[str]] = None) -> List[Tuple[str, float]]:
+        """
+        Return up to k (chunk_id, bm25 score) pairs, best first, optionally
+        only from chunks of the given partitions.
+        """
+        if not self.chunk_ids:
+            return []
+        scores = np.zeros(len(self.chunk_ids), dtype=np.float32)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths / max(self.avg_length, 1e-9))
+        for term in set(tokenize(query)):
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.tfs[start:end].astype(np.float32)
+            scores[docs] += self.idf[term_id] * tf * (BM25_K1 + 1) / (tf + norm[docs])
+
+        if partitions:
+            codes = [i for i, name in enumerate(self.partition_names) if name in partitions]
+            scores[~np.isin(self.partition_codes, codes)] = 0
+
+        hits = np.flatnonzero(scores)
+        if not len(hits):
+            return []
+        top = hits[np.argsort(-scores[hits], kind="stable")[:k]]
+        return [(self.chunk_ids[i], float(scores[i])) for i in top]
+
+
+def load_or_build(persist_dir: str, vectorstore, version, partition_key: Optional[str] = None) -> LexicalIndex:
+    """
+    Load the persisted lexical index, rebuilding it from the vector store's
+    chunks when the index version (manifest stamp) has changed. Chunks are
+    labelled with their `partition_key` metadata.
+    """
+    path = os.path.join(persist_dir, LEXICAL_INDEX_NAME)
+    if os.path.exists(path):
+        try:
+            index = LexicalIndex.load(path)
+            if index.version == version:
+                return index
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Could not read lexical index ({e}), rebuilding.")
+
+    print("Building lexical index...")
+    stored = vectorstore.get(include=["documents", "metadatas"])
+    partitions = None
+    if partition_key:
+        partitions = [(metadata or {}).get(partition_key) for metadata in stored["metadatas"]]
+    index = LexicalIndex.build(zip(stored["ids"], stored["documents"]), version, partitions)
+    index.save(path)
+    print(f"Lexical index ready: {len(index.chunk_ids)} chunks, {len(index.vocab)} terms.")
+    return index
@@ -0,0 +1,239 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from itertools import count
+from typing import Optional
+
+from pydantic import Field
+from langchain_core.exceptions import ModelRateLimitError
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from context_packer import count_tokens
+from telemetry import LLM_QUEUE_DEPTH, record_llm_retry
+
+# --- LLM Gateway ---
+# All graph nodes call Gemini through one LLMGateway, which wraps a single chat
+# model and therefore a single pooled HTTP client. Before each call the gateway
+# reserves one request from the requests-per-minute bucket. It also reserves
+# the estimated tokens (the prompt plus LLM_COMPLETION_TOKENS) from the
+# tokens-per-minute bucket. Callers over the quota wait in line instead of
+# failing, and the number of waiting calls is exported as
+# rag_llm_queue_depth. Once a call finishes, the token reservation is corrected
+# to the usage the model reported.
+#
+# Timeouts and 429/5xx responses are retried with jittered exponential
+# backoff. A 429 also empties the request bucket, which slows every caller
+# down, not only the one that hit the limit. The buckets are per process, so
+# with several workers LLM_RPM/LLM_TPM must be split between them.
+
+# Defaults match the Gemini 2.0 Flash tier-1 quota; 0 disables a bucket.
+LLM_RPM = float(os.environ.get("LLM_RPM", "2000"))
+LLM_TPM = float(os.environ.get("LLM_TPM", "4000000"))
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "5"))
+LLM_BACKOFF_BASE = 0.5
+LLM_BACKOFF_MAX = 30.0
+# Seconds of quota a bucket can hand out in one burst
+LLM_BURST_SECONDS = 6.0
+# Completion tokens reserved up front, before the real usage is known
+LLM_COMPLETION_TOKENS = 256
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+# Inner calls run without callbacks: telemetry and LangGraph's token stream
+# observe the gateway, so every call is reported exactly once.
+_INNER_CONFIG = {"callbacks": []}
+
+
+class TokenBucket:
+    """
+    Rate limiter refilling `per_minute` units per minute. reserve() takes the
+    units right away, going into debt if needed, and returns how long the
+    caller has to wait until the debt is repaid. Callers are therefore served
+    in arrival order, both from threads and from the event loop.
+    """
+
+    def __init__(self, per_minute: float, burst_seconds: float = LLM_BURST_SECONDS):
+        self.rate = per_minute / 60
+        self.capacity = self.rate * burst_seconds
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            self._refill()
+            # A single call larger than a burst still goes through eventually.
+            self.level -= min(amount, self.capacity)
+            return max(0.0, -self.level / self.rate)
+
+    def adjust(self, amount: float):
+        """
+        Give back (positive) or charge (negative) units after the fact.
+        """
+        if self.rate <= 0:
+            return
+        with self._lock:
+            self._refill()
+            self.level = min(self.capacity, self.level + amount)
+
+    def drain(self):
+        if self.rate <= 0:
+            return
+        with self._lock:
+            self._refill()
+            self.level = min(self.level, 0.0)
+
+
+def status_code(error: BaseException) -> Optional[int]:
+    """
+    HTTP status of an LLM error. The Gemini client raises LangChain model
+    errors (e.g. GoogleRateLimitError) that carry no status themselves; the
+    HTTP error is on __cause__, so the chain is followed.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, ModelRateLimitError):
+            return 429
+        for value in (getattr(error, "code", None), getattr(error, "status_code", None),
+                      getattr(getattr(error, "response", None), "status_code", None)):
+            if isinstance(value, int):
+                return value
+        error = error.__cause__ or error.__context__
+    return None
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, TimeoutError):
+        return True
+    return bool(getattr(error, "is_retryable", False)) or status_code(error) in RETRYABLE_STATUS
+
+
+def _estimate_tokens(messages) -> int:
+    return sum(count_tokens(message.text) for message in messages) + LLM_COMPLETION_TOKENS
+
+
+def _used_tokens(message) -> Optional[int]:
+    usage = getattr(message, "usage_metadata", None)
+    return usage.get("total_tokens") if usage else None
+
+
+class LLMGateway(BaseChatModel):
+    """
+    Chat model wrapper adding rate limiting, retries and timeouts to `inner`.
+    """
+
+    inner: BaseChatModel
+    requests_bucket: TokenBucket = Field(default_factory=lambda: TokenBucket(LLM_RPM))
+    tokens_bucket: TokenBucket = Field(default_factory=lambda: TokenBucket(LLM_TPM))
+    timeout: float = LLM_TIMEOUT
+    max_retries: int = LLM_MAX_RETRIES
+
+    @property
+    def _llm_type(self) -> str:
+        return "llm-gateway"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"inner": self.inner._llm_type, **self.inner._identifying_params}
+
+    def _reserve(self, messages):
+        estimate = _estimate_tokens(messages)
+        wait = max(self.requests_bucket.reserve(1), self.tokens_bucket.reserve(estimate))
+        return estimate, wait
+
+    def _settle(self, estimate: int, used: Optional[int]):
+        if used is not None:
+            self.tokens_bucket.adjust(estimate - used)
+
+    def _backoff(self, error: BaseException, attempt: int) -> Optional[float]:
+        """
+        Seconds to wait before retrying, or None if the error is final.
+        """
+        if attempt >= self.max_retries or not is_retryable(error):
+            return None
+        status = status_code(error)
+        if status == 429:
+            self.requests_bucket.drain()
+        reason = str(status) if status else type(error).__name__
+        record_llm_retry(reason)
+        delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+        print(f"---LLM GATEWAY: {reason}, retry {attempt + 1}/{self.max_retries} in {delay:.2f}s---")
+        return delay
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        for attempt in count():
+            estimate, wait = self._reserve(messages)
+            if wait:
+                with LLM_QUEUE_DEPTH.track_inprogress():
+                    time.sleep(wait)
+            try:
+                # The per-call timeout of the sync path is the inner client's own.
+                message = self.inner.invoke(messages, config=_INNER_CONFIG, stop=stop, **kwargs)
+            except Exception as e:
+                delay = self._backoff(e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            self._settle(estimate, _used_tokens(message))
+            return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        for attempt in count():
+            estimate, wait = self._reserve(messages)
+            if wait:
+                with LLM_QUEUE_DEPTH.track_inprogress():
+                    await asyncio.sleep(wait)
+            try:
+                message = await asyncio.wait_for(
+                    self.inner.ainvoke(messages, config=_INNER_CONFIG, stop=stop, **kwargs), self.timeout
+                )
+            except Exception as e:
+                delay = self._backoff(e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self._settle(estimate, _used_tokens(message))
+            return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        for attempt in count():
+            estimate, wait = self._reserve(messages)
+            if wait:
+                with LLM_QUEUE_DEPTH.track_inprogress():
+                    await asyncio.sleep(wait)
+            used = 0
+            started = False
+            try:
+                async with asyncio.timeout(self.timeout):
+                    async for message in self.inner.astream(messages, config=_INNER_CONFIG, stop=stop, **kwargs):
+                        started = True
+                        # Chunks carry usage deltas, as in AIMessageChunk addition.
+                        used += _used_tokens(message) or 0
+                        chunk = ChatGenerationChunk(message=message)
+                        if run_manager:
+                            await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                        yield chunk
+            except Exception as e:
+                # Tokens already streamed to the client cannot be taken back.
+                delay = None if started else self._backoff(e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self._settle(estimate, used or None)
+            return
+
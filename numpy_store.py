@@ -0,0 +1,452 @@
+import os
+import json
+import glob
+import uuid
+import sqlite3
+import threading
+from typing import Any, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+# --- NumPy Vector Store ---
+# Brute-force cosine search over a contiguous float32 matrix that lives in a
+# memory-mapped file, so every process (e.g. several uvicorn workers) shares
+# the same pages through the OS page cache instead of loading its own copy.
+# Chunk IDs, texts and metadata are kept in a small SQLite table whose `row`
+# column is the chunk's row in the matrix.
+#
+# Vectors are only ever appended. Deleted chunks leave dead rows behind that
+# are masked out at search time; once they exceed COMPACT_RATIO of the file,
+# the live rows are copied into a new generation of the vector file.
+#
+# Searches take a metadata filter in Chroma's `where` syntax (equality or
+# `$in` per key). Only the matching rows are read and multiplied, so a
+# partition-filtered search costs in proportion to the partition's size.
+
+VECTORS_PATTERN = "vectors-{}.f32"
+CHUNKS_NAME = "chunks.sqlite"
+COMPACT_RATIO = 0.25
+
+
+def _unit_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class _Snapshot:
+    """
+    Immutable view used by searches: the mapped matrix and its live-row mask.
+    """
+
+    def __init__(self, matrix, live, count=None):
+        self.matrix = matrix
+        self.live = live
+        if count is None:
+            count = int(live.sum()) if live is not None else 0
+        self.count = count
+        self.masks = {}  # filter -> row mask, computed on first use
+
+
+class NumpyVectorStore(VectorStore):
+    def __init__(self, embedding_function: Embeddings, persist_directory: str):
+        self._embedding = embedding_function
+        self.persist_directory = persist_directory
+        os.makedirs(persist_directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(
+            os.path.join(persist_directory, CHUNKS_NAME), check_same_thread=False, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS chunks (
+                row INTEGER PRIMARY KEY,
+                id TEXT UNIQUE NOT NULL,
+                text TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.commit()
+        self._data_version = None
+        self._live = None  # live-row buffer; snapshots hold a prefix of it
+        self._refresh()
+        self._remove_stale_files()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    # --- Storage ---
+
+    def _meta(self, key, default=None):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def _set_meta(self, key, value):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value))
+        )
+
+    def _vectors_path(self, generation=None):
+        if generation is None:
+            generation = self._meta("generation", 0)
+        return os.path.join(self.persist_directory, VECTORS_PATTERN.format(generation))
+
+    def _remove_stale_files(self):
+        # Leftovers of a compaction that was interrupted or already superseded.
+        current = self._vectors_path()
+        for path in glob.glob(os.path.join(self.persist_directory, VECTORS_PATTERN.format("*"))):
+            if path != current:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _refresh(self):
+        """
+        Re-map the vector file and rebuild the live-row mask.
+        """
+        with self._lock:
+            (self._data_version,) = self._conn.execute("PRAGMA data_version").fetchone()
+            dim = self._meta("dim")
+            path = self._vectors_path()
+            if dim is None or not os.path.exists(path):
+                self._snapshot = _Snapshot(None, None)
+                self._live = None
+                return
+            rows = os.path.getsize(path) // (4 * dim)
+            live = np.zeros(rows, dtype=bool)
+            live_rows = [r for (r,) in self._conn.execute("SELECT row FROM chunks")]
+            if live_rows:
+                live_rows = np.asarray(live_rows, dtype=np.int64)
+                # Rows whose vectors never reached the file (interrupted write) stay dead.
+                live[live_rows[live_rows < rows]] = True
+            matrix = np.memmap(path, dtype=np.float32, mode="r", shape=(rows, dim)) if rows else None
+            self._snapshot = _Snapshot(matrix, live)
+            self._live = live
+
+    def _update(self, removed: Sequence[int], added: int):
+        """
+        Apply this process's own commit to the snapshot without re-reading every
+        row: `removed` rows are cleared in place and the last `added` rows of the
+        vector file become live. The buffer grows geometrically, so a bulk
+        ingestion in batches stays linear.
+        """
+        with self._lock:
+            dim = self._meta("dim")
+            path = self._vectors_path()
+            if self._live is None or dim is None or not os.path.exists(path):
+                self._refresh()
+                return
+            snapshot = self._snapshot
+            old = len(snapshot.live)
+            rows = os.path.getsize(path) // (4 * dim)
+            live = self._live
+            if rows > len(live):
+                # Rows appended here are past the end of older snapshots, so
+                # they can share the buffer until it has to grow.
+                live = np.zeros(max(rows, 2 * len(live)), dtype=bool)
+                live[:old] = self._live[:old]
+                self._live = live
+            count = snapshot.count
+            removed = np.asarray([row for row in removed if row < old], dtype=np.int64)
+            if len(removed):
+                count -= int(live[removed].sum())
+                live[removed] = False
+            live[old:rows] = False
+            live[rows - added:rows] = True
+            count += added
+            matrix = np.memmap(path, dtype=np.float32, mode="r", shape=(rows, dim)) if rows else None
+            self._snapshot = _Snapshot(matrix, live[:rows], count)
+
+    def _maybe_compact(self):
+        snapshot = self._snapshot
+        if snapshot.matrix is not None and len(snapshot.live) - snapshot.count > COMPACT_RATIO * len(snapshot.live):
+            self._compact()
+
+    def _maybe_refresh(self):
+        # Pick up commits made by other processes (e.g. another worker's ingestion).
+        with self._lock:
+            (version,) = self._conn.execute("PRAGMA data_version").fetchone()
+        if version != self._data_version:
+            self._refresh()
+
+    def _compact(self):
+        snapshot = self._snapshot
+        generation = self._meta("generation", 0) + 1
+        new_path = self._vectors_path(generation)
+        rows = [r for (r,) in self._conn.execute("SELECT row FROM chunks ORDER BY row")]
+        with open(new_path, "wb") as f:
+            for i in range(0, len(rows), 4096):
+                f.write(np.ascontiguousarray(snapshot.matrix[rows[i:i + 4096]]).tobytes())
+        # Rows only move down, so renumbering in ascending order never collides.
+        self._conn.executemany(
+            "UPDATE chunks SET row = ? WHERE row = ?",
+            [(new_row, old_row) for new_row, old_row in enumerate(rows)],
+        )
+        self._set_meta("generation", generation)
+        self._conn.commit()
+        self._refresh()
+        self._remove_stale_files()
+
+    # --- VectorStore API ---
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        *,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        vectors = _unit_rows(np.asarray(self._embedding.embed_documents(texts), dtype=np.float32))
+
+        with self._lock:
+            dim = self._meta("dim")
+            if dim is None:
+                dim = vectors.shape[1]
+                self._set_meta("dim", dim)
+                self._conn.commit()
+            elif dim != vectors.shape[1]:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match index dimension {dim}")
+            # Upsert: replaced chunks leave a dead row behind.
+            removed = self._delete_rows(ids)
+
+            path = self._vectors_path()
+            row_bytes = 4 * dim
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            start = size // row_bytes
+            # Vectors first: a crash before the commit below only leaves dead rows.
+            with open(path, "ab") as f:
+                if size != start * row_bytes:
+                    # A torn trailing row from an interrupted write would shift
+                    # every vector appended after it.
+                    f.truncate(start * row_bytes)
+                f.write(vectors.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            self._conn.executemany(
+                "INSERT INTO chunks (row, id, text, metadata) VALUES (?, ?, ?, ?)",
+                [
+                    (start + i, chunk_id, text, json.dumps(metadata or {}, ensure_ascii=False))
+                    for i, (chunk_id, text, metadata) in enumerate(zip(ids, texts, metadatas))
+                ],
+            )
+            self._conn.commit()
+            self._update(removed, len(texts))
+            self._maybe_compact()
+        return ids
+
+    def _delete_rows(self, ids: Sequence[str]) -> List[int]:
+        """
+        Delete the chunks with these ids and return the rows they occupied.
+        """
+        rows = []
+        for i in range(0, len(ids), 500):
+            batch = list(ids[i:i + 500])
+            placeholders = ",".join("?" * len(batch))
+            cursor = self._conn.execute(f"DELETE FROM chunks WHERE id IN ({placeholders}) RETURNING row", batch)
+            rows += [row for (row,) in cursor.fetchall()]
+        return rows
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if not ids:
+            return False
+        with self._lock:
+            removed = self._delete_rows(ids)
+            self._conn.commit()
+            self._update(removed, 0)
+            self._maybe_compact()
+        return bool(removed)
+
+    def reset_collection(self):
+        with self._lock:
+            generation = self._meta("generation", 0) + 1
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.execute("DELETE FROM meta WHERE key = 'dim'")
+            self._set_meta("generation", generation)
+            self._conn.commit()
+            self._refresh()
+            self._remove_stale_files()
+
+    def _documents(self, rows: Iterable[int]) -> dict:
+        rows = [int(r) for r in rows]
+        found = {}
+        with self._lock:
+            for i in range(0, len(rows), 500):
+                batch = rows[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                for row, chunk_id, text, metadata in self._conn.execute(
+                    f"SELECT row, id, text, metadata FROM chunks WHERE row IN ({placeholders})", batch
+                ):
+                    found[row] = Document(id=chunk_id, page_content=text, metadata=json.loads(metadata))
+        return found
+
+    def get_by_ids(self, ids: Sequence[str], /) -> List[Document]:
+        ids = list(ids)
+        found = {}
+        with self._lock:
+            for i in range(0, len(ids), 500):
+                batch = ids[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                for chunk_id, text, metadata in self._conn.execute(
+                    f"SELECT id, text, metadata FROM chunks WHERE id IN ({placeholders})", batch
+                ):
+                    found[chunk_id] = Document(id=chunk_id, page_content=text, metadata=json.loads(metadata))
+        return [found[chunk_id] for chunk_id in ids if chunk_id in found]
+
+    def get(self, ids: Optional[Sequence[str]] = None, include: Optional[List[str]] = None) -> dict:
+        """
+        Chroma-compatible bulk read: {"ids": [...], "documents": [...], "metadatas": [...]},
+        plus "embeddings" (rows of the mapped matrix, unit-normalized) if included.
+        """
+        include = include or ["documents", "metadatas"]
+        self._maybe_refresh()
+        matrix = self._snapshot.matrix
+        query = "SELECT row, id, text, metadata FROM chunks"
+        with self._lock:
+            if ids is None:
+                records = self._conn.execute(query + " ORDER BY row").fetchall()
+            else:
+                ids = list(ids)
+                found = {}
+                for i in range(0, len(ids), 500):
+                    batch = ids[i:i + 500]
+                    placeholders = ",".join("?" * len(batch))
+                    for record in self._conn.execute(f"{query} WHERE id IN ({placeholders})", batch):
+                        found[record[1]] = record
+                records = [found[chunk_id] for chunk_id in ids if chunk_id in found]
+        if "embeddings" in include:
+            # Rows written after the snapshot was taken are left out.
+            limit = matrix.shape[0] if matrix is not None else 0
+            records = [record for record in records if record[0] < limit]
+
+        result = {"ids": [record[1] for record in records]}
+        if "documents" in include:
+            result["documents"] = [record[2] for record in records]
+        if "metadatas" in include:
+            result["metadatas"] = [json.loads(record[3]) for record in records]
+        if "embeddings" in include:
+            rows = np.fromiter((record[0] for record in records), dtype=np.int64, count=len(records))
+            result["embeddings"] = np.asarray(matrix[rows]) if len(rows) else np.zeros((0, 0), dtype=np.float32)
+        return result
+
+    def _filter_mask(self, snapshot: _Snapshot, filter: dict):
+        """
+        Row mask of the chunks whose metadata matches `filter`: {key: value} or
+        {key: {"$in": [values]}}, several keys combined with AND.
+        """
+        cache_key = json.dumps(filter, sort_keys=True)
+        mask = snapshot.masks.get(cache_key)
+        if mask is not None:
+            return mask
+        clauses, params = [], []
+        for key, condition in filter.items():
+            if isinstance(condition, dict):
+                if set(condition) != {"$in"}:
+                    raise ValueError(f"Unsupported filter operator: {condition}")
+                values = list(condition["$in"])
+            else:
+                values = [condition]
+            clauses.append(f"json_extract(metadata, ?) IN ({','.join('?' * len(values))})")
+            params += [f'$."{key}"', *values]
+        with self._lock:
+            rows = [r for (r,) in self._conn.execute(
+                "SELECT row FROM chunks WHERE " + " AND ".join(clauses), params
+            )]
+        mask = np.zeros(len(snapshot.live), dtype=bool)
+        if rows:
+            rows = np.asarray(rows, dtype=np.int64)
+            mask[rows[rows < len(mask)]] = True
+        snapshot.masks[cache_key] = mask
+        return mask
+
+    def similarity_search_with_score_by_vectors(
+        self, embeddings: Sequence[Sequence[float]], k: int = 4, filter: Optional[dict] = None
+    ) -> List[List[Tuple[Document, float]]]:
+        """
+        Top-k search for several query vectors with a single matrix multiply,
+        optionally restricted to chunks matching a metadata filter.
+        Scores are cosine similarities.
+        """
+        self._maybe_refresh()
+        snapshot = self._snapshot
+        if not embeddings:
+            return []
+        if snapshot.matrix is None or not snapshot.count:
+            return [[] for _ in embeddings]
+
+        queries = _unit_rows(np.asarray(embeddings, dtype=np.float32))
+        if filter:
+            rows = np.flatnonzero(snapshot.live & self._filter_mask(snapshot, filter))
+            if not len(rows):
+                return [[] for _ in embeddings]
+            scores = np.asarray(queries @ snapshot.matrix[rows].T)
+            k = min(k, len(rows))
+        else:
+            rows = None
+            scores = np.asarray(queries @ snapshot.matrix.T)
+            scores[:, ~snapshot.live] = -np.inf
+            k = min(k, snapshot.count)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+
+        rankings = []
+        for i, candidates in enumerate(top):
+            order = candidates[np.argsort(-scores[i, candidates], kind="stable")]
+            # Columns are positions in `rows` when the search was filtered.
+            rankings.append([
+                (int(rows[column] if rows is not None else column), float(scores[i, column]))
+                for column in order
+            ])
+        documents = self._documents({row for ranking in rankings for row, _ in ranking})
+        return [
+            [(documents[row], score) for row, score in ranking if row in documents]
+            for ranking in rankings
+        ]
+
+    def similarity_search_by_vectors(
+        self, embeddings: Sequence[Sequence[float]], k: int = 4, filter: Optional[dict] = None
+    ) -> List[List[Document]]:
+        return [
+            [doc for doc, _ in results]
+            for results in self.similarity_search_with_score_by_vectors(embeddings, k, filter)
+        ]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return self.similarity_search_by_vectors([embedding], k, kwargs.get("filter"))[0]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vectors(
+            [self._embedding.embed_query(query)], k, kwargs.get("filter")
+        )[0]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def _select_relevance_score_fn(self):
+        # Scores already are cosine similarities.
+        return lambda score: score
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        *,
+        ids: Optional[List[str]] = None,
+        persist_directory: str = "./numpy_index",
+        **kwargs: Any,
+    ) -> "NumpyVectorStore":
+        store = cls(embedding, persist_directory)
+        store.add_texts(texts, metadatas, ids=ids)
+        return store
@@ -0,0 +1,201 @@
+import os
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from lexical_index import fold
+from telemetry import record_partition_route
+
+# --- Collection Partitions ---
+# The corpus is split by source folder. database/ holds the SADOS user manuals
+# and FAQ answers, depo-pdf-belgeler/ the tender specifications and contracts.
+# Both folders are ingested into the one index, and every chunk carries its
+# partition (source_folder), document type (doc_type) and file name (file) as
+# metadata.
+#
+# The route_partitions node picks the partitions a question needs. Stage 1
+# matches partition-specific vocabulary. Stage 2 compares the sub-question
+# embeddings with the centroids of each partition's example questions.
+# retrieve then restricts the vector search and BM25 to those partitions with
+# a metadata filter. A question that matches every partition, or none with
+# confidence, searches them all.
+
+DATA_DIRS = [d.strip() for d in os.environ.get("DATA_DIRS", "./database,./depo-pdf-belgeler").split(",") if d.strip()]
+PARTITION_KEY = "source_folder"
+PARTITION_ROUTING = os.environ.get("PARTITION_ROUTING", "1") == "1"
+# Partitions whose centroid similarity is within this margin of the best are searched too
+PARTITION_MARGIN = float(os.environ.get("PARTITION_MARGIN", "0.03"))
+
+# Document type from the (folded) file name; the first match wins.
+DOC_TYPES = [
+    ("contract", ("sozlesme",)),
+    ("faq", ("cevap", "soru")),
+    ("manual", ("kilavuz", "kilvauvu", "kullanim")),
+    ("specification", ("sartname",)),
+]
+
+# Routing profiles. Words shared by both corpora (şartname, teknik, eğitim,
+# ...) are left out of the stems on purpose. A partition without a profile is
+# always searched.
+PROFILES = {
+    "database": {
+        "stems": (
+            "sados", "sınav", "sertifika", "şifre", "parola", "giriş", "kayıt", "üye",
+            "öğrenci", "ödeme", "öde", "ücret", "ders", "kurs", "transkript", "diploma",
+            "hesab", "hesap", "kullanıcı", "mezun", "başvur", "indir", "video",
+        ),
+        "examples": [
+            "sertifikamı nereden indirebilirim", "sınav ne zaman", "ödeme nasıl yapılır",
+            "sisteme giriş yapamıyorum", "şifremi unuttum", "nasıl üye olurum",
+            "ders programını nerede görebilirim", "ücret iadesi nasıl alınır",
+            "SADOS'ta öğrenci kaydı nasıl yapılır", "eğitim videoları açılmıyor",
+        ],
+    },
+    "depo-pdf-belgeler": {
+        "stems": (
+            "ihale", "sözleşme", "yüklenici", "idare", "teklif", "hakediş", "cdn", "player",
+            "hürjet", "idef", "kasem", "istsem", "sunucu", "altyapı", "garanti", "ceza",
+        ),
+        "examples": [
+            "yüklenicinin yükümlülükleri nelerdir", "ihale kapsamında hangi hizmetler alınacak",
+            "sözleşmenin süresi ne kadar", "teslim süresi geçerse ceza uygulanır mı",
+            "CDN sunucu hizmetinin gereksinimleri nelerdir", "hakediş ödemeleri nasıl yapılır",
+            "teklif verecek firmalarda aranan şartlar", "garanti ve bakım süresi nedir",
+            "LMS player hangi standartları desteklemeli", "dijital içerik üretimi teknik şartları",
+        ],
+    },
+}
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def partition_of(path: str) -> str:
+    """
+    Partition of a source file: the name of the folder it is in.
+    """
+    return os.path.basename(os.path.dirname(os.path.normpath(path)))
+
+
+def doc_type_of(path: str) -> str:
+    name = fold(os.path.basename(path))
+    for doc_type, keywords in DOC_TYPES:
+        if any(keyword in name for keyword in keywords):
+            return doc_type
+    return "document"
+
+
+def chunk_metadata(path: str) -> Dict[str, str]:
+    return {
+        PARTITION_KEY: partition_of(path),
+        "doc_type": doc_type_of(path),
+        "file": os.path.basename(path),
+    }
+
+
+def partitions_in(paths: Iterable[str]) -> List[str]:
+    return sorted({partition_of(path) for path in paths})
+
+
+def where(partitions: Optional[Sequence[str]]) -> Optional[dict]:
+    """
+    Metadata filter for the given partitions in Chroma's `where` syntax, which
+    NumpyVectorStore understands too. None searches everything.
+    """
+    if not partitions:
+        return None
+    if len(partitions) == 1:
+        return {PARTITION_KEY: partitions[0]}
+    return {PARTITION_KEY: {"$in": list(partitions)}}
+
+
+class PartitionRouter:
+    def __init__(self, margin: float = PARTITION_MARGIN, enabled: bool = PARTITION_ROUTING, profiles: Dict = PROFILES):
+        self.margin = margin
+        self.enabled = enabled
+        self.profiles = {
+            name: {"stems": tuple(fold(stem) for stem in profile["stems"]), "examples": profile["examples"]}
+            for name, profile in profiles.items()
+        }
+        self._centroids = {}  # embeddings model -> {partition: centroid}
+        self._lock = threading.Lock()
+
+    def _decide(self, stage: str, chosen: Iterable[str], available: Sequence[str]) -> Optional[List[str]]:
+        # Partitions without a profile cannot be ruled out.
+        chosen = set(chosen) | {name for name in available if name not in self.profiles}
+        partitions = sorted(chosen) if chosen and len(chosen) < len(available) else None
+        record_partition_route(stage, ",".join(partitions) if partitions else "all")
+        print(f"---PARTITIONS BY {stage.upper()}: {', '.join(partitions) if partitions else 'ALL'}---")
+        return partitions
+
+    def route_local(self, texts: List[str], available: Sequence[str]) -> Tuple[bool, Optional[List[str]]]:
+        """
+        Lexicon stage. Returns (decided, partitions); partitions None means all.
+        """
+        if not self.enabled or len(available) < 2:
+            return True, None
+        words = _WORD.findall(fold(" ".join(texts)))
+        matched = [
+            name for name in available
+            if name in self.profiles and any(word.startswith(self.profiles[name]["stems"]) for word in words)
+        ]
+        if not matched:
+            return False, None
+        return True, self._decide("lexicon", matched, available)
+
+    def _centroids_for(self, embeddings):
+        model = getattr(embeddings, "model", None) or type(embeddings).__name__
+        with self._lock:
+            centroids = self._centroids.get(model)
+        if centroids is None:
+            # Cached on disk by CachedEmbeddings after the first run.
+            names = list(self.profiles)
+            examples = [example for name in names for example in self.profiles[name]["examples"]]
+            matrix = _unit_rows(np.asarray(embeddings.embed_queries(examples), dtype=np.float32))
+            centroids, start = {}, 0
+            for name in names:
+                count = len(self.profiles[name]["examples"])
+                centroid = matrix[start:start + count].mean(axis=0)
+                centroids[name] = centroid / np.linalg.norm(centroid)
+                start += count
+            with self._lock:
+                self._centroids[model] = centroids
+        return centroids
+
+    def route_embedding(self, texts: List[str], available: Sequence[str], embeddings) -> Optional[List[str]]:
+        """
+        Centroid stage; falls back to all partitions. Blocking: may embed the
+        sub-questions, which retrieve then finds in the embedding cache.
+        """
+        profiled = [name for name in available if name in self.profiles]
+        if len(profiled) < 2:
+            return self._decide("fallback", available, available)
+        try:
+            centroids = self._centroids_for(embeddings)
+            vectors = _unit_rows(np.asarray(embeddings.embed_queries(texts), dtype=np.float32))
+        except Exception as e:
+            print(f"Partition router centroid stage failed: {e}")
+            return self._decide("fallback", available, available)
+        query = vectors.mean(axis=0)
+        norm = np.linalg.norm(query)
+        if not norm:
+            return self._decide("fallback", available, available)
+        scores = {name: float(query @ centroids[name]) / norm for name in profiled}
+        best = max(scores.values())
+        return self._decide("centroid", [name for name in profiled if scores[name] >= best - self.margin], available)
+
+    def route(self, texts: List[str], available: Sequence[str], embeddings) -> Optional[List[str]]:
+        """
+        Partitions to search for the (sub-)questions in `texts`, or None for all.
+        """
+        decided, partitions = self.route_local(texts, available)
+        if decided:
+            return partitions
+        return self.route_embedding(texts, available, embeddings)
+
+
+def _unit_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
@@ -0,0 +1,86 @@
+import os
+from typing import Callable, List, Sequence, Tuple
+
+from lexical_index import tokenize
+
+# --- Rank Fusion ---
+# Combines ranked result lists from different retrievers (dense, BM25) and
+# different sub-questions into one ranking. Reciprocal rank fusion only looks
+# at ranks, so the very different score scales of cosine similarity and BM25
+# never need calibrating. Maximal marginal relevance then trades a little
+# relevance for diversity, so overlapping chunks of the same passage do not
+# fill the whole budget.
+
+RRF_K = int(os.environ.get("RRF_K", "60"))
+MMR_LAMBDA = float(os.environ.get("MMR_LAMBDA", "0.7"))
+
+
+def rrf_scores(rankings: List[List], key: Callable, k: int = RRF_K) -> List[Tuple[object, float]]:
+    """
+    Fuse ranked lists of items; an item scores sum(1 / (k + rank)) over the
+    lists it appears in. Returns unique (item, score) pairs, best first (ties
+    keep first-seen order).
+    """
+    scores = {}
+    items = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            item_key = key(item)
+            items.setdefault(item_key, item)
+            scores[item_key] = scores.get(item_key, 0.0) + 1.0 / (k + rank)
+    order = sorted(scores, key=lambda item_key: -scores[item_key])
+    return [(items[item_key], scores[item_key]) for item_key in order]
+
+
+def reciprocal_rank_fusion(rankings: List[List], key: Callable, k: int = RRF_K) -> List:
+    """
+    rrf_scores without the scores.
+    """
+    return [item for item, _ in rrf_scores(rankings, key, k)]
+
+
+def shingles(text: str) -> frozenset:
+    """
+    Word bigrams of the normalized text, used to detect overlapping chunks.
+    """
+    tokens = tokenize(text)
+    if len(tokens) < 2:
+        return frozenset(tokens)
+    return frozenset(zip(tokens, tokens[1:]))
+
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def maximal_marginal_relevance(
+    scored: Sequence[Tuple[object, float]],
+    features: Sequence[frozenset],
+    k: int,
+    lambda_mult: float = MMR_LAMBDA,
+) -> List:
+    """
+    Greedily pick k items maximizing
+    lambda * relevance - (1 - lambda) * max similarity to already picked items.
+    Relevance is the item's score scaled to [0, 1]; similarity is the Jaccard
+    overlap of `features`.
+    """
+    if not scored or k <= 0:
+        return []
+    top = max(score for _, score in scored) or 1.0
+    relevance = [score / top for _, score in scored]
+    redundancy = [0.0] * len(scored)
+    remaining = list(range(len(scored)))
+    selected = []
+    while remaining and len(selected) < k:
+        best = max(
+            remaining,
+            key=lambda i: lambda_mult * relevance[i] - (1 - lambda_mult) * redundancy[i],
+        )
+        remaining.remove(best)
+        selected.append(best)
+        for i in remaining:
+            redundancy[i] = max(redundancy[i], jaccard(features[i], features[best]))
+    return [scored[i][0] for i in selected]
@@ -1,60 +1,329 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
+from typing import List, Optional
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 import uvicorn
+import asyncio
+import json
 import os
 import sys
+import time
 
 # Add the current directory to sys.path to ensure we can import the module smoothly
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-# Import from agentic_rag
-# Note: agentic_rag.py must have setup_vectorstore and app defined/accessible
-from agentic_rag import setup_vectorstore, app as rag_app
+from answer_cache import AnswerCache
+from batch import answer_batch, BATCH_MAX_CONCURRENCY, BATCH_MAX_QUESTIONS
+from sessions import SessionStore, acompact
+from ingestion import manifest_version
+from telemetry import start_trace
 
 app = FastAPI(title="Agentic RAG API", version="1.0.0")
 
 class QuestionRequest(BaseModel):
     question: str
+    session_id: Optional[str] = None  # continue a conversation; omitted or unknown starts a new one
+    trace: bool = False  # include a per-request timing breakdown in the response
+
+class BatchRequest(BaseModel):
+    questions: List[str]
+    max_concurrency: Optional[int] = None  # defaults to BATCH_MAX_CONCURRENCY
 
 class AnswerResponse(BaseModel):
     answer: str
     success: bool
     message: str
+    session_id: Optional[str] = None
+    trace: Optional[dict] = None
+
+NO_ANSWER_TEXT = "I could not find an answer to your question in the provided documents."
+NO_ANSWER_MESSAGE = "No relevant documents found in the database."
+
+# --- Startup ---
+# Importing agentic_rag (LangChain, Chroma, the Gemini clients, the compiled
+# graph) and opening the index take seconds, so neither blocks startup: the
+# server listens right away and a background task imports the pipeline and
+# opens the persisted index. The Docker image builds that index at image build
+# time (build_vector_db.py), so a cold start does not parse or embed the
+# corpus. Without a prebuilt index (e.g. a fresh checkout) the whole corpus
+# is embedded first, which can take minutes; STARTUP_SYNC=1 also embeds new or
+# changed PDFs. /healthz answers as soon as the process is up, /readyz once
+# the index is loaded; until then the question endpoints answer 503.
+STARTUP_SYNC = os.environ.get("STARTUP_SYNC", "0") == "1"
+
+rag = None        # the agentic_rag module, set by the warm-up
+rag_app = None    # the compiled graph, set once the index is loaded
+startup = {"status": "starting", "detail": None, "seconds": None}
+_started = time.perf_counter()
+
+# Answers to recurring questions; dropped whenever the index manifest changes
+answer_cache = AnswerCache(version_fn=lambda: manifest_version(rag.VECTORSTORE_DIR) if rag else None)
+
+# Conversation memory per session_id (bounded, idle sessions are evicted)
+sessions = SessionStore()
+
+# Strong references to background tasks (warm-up, compactions) until they finish
+_background_tasks = set()
+
+# Nodes whose LLM output is the final answer and is streamed token by token
+ANSWER_NODES = ("generate", "handle_chitchat")
+
+def _load_pipeline():
+    global rag
+    import agentic_rag
+    from context_packer import preload_encoding
+    # Token counting runs on the event loop for every LLM call (gateway).
+    preload_encoding()
+    rag = agentic_rag
+    agentic_rag.setup_vectorstore(sync=STARTUP_SYNC)
+    return agentic_rag
+
+async def _warm_up():
+    global rag_app
+    try:
+        # In a worker thread, so /healthz and /readyz answer meanwhile.
+        module = await asyncio.to_thread(_load_pipeline)
+    except Exception as e:
+        print(f"Startup failed: {e}")
+        startup.update(status="failed", detail=str(e))
+        return
+    startup["seconds"] = round(time.perf_counter() - _started, 3)
+    if module.vectorstore is None:
+        startup.update(status="failed", detail=NO_ANSWER_MESSAGE)
+        return
+    rag_app = module.app
+    startup["status"] = "ready"
+    print(f"---STARTUP: ready after {startup['seconds']}s---")
 
 @app.on_event("startup")
 async def startup_event():
-    print("Initializing Vector Store...")
-    # This assumes the ./database folder exists and has PDFs.
-    # We call the setup function from agentic_rag.py
-    setup_vectorstore("./database")
-    print("Vector Store Initialized.")
+    print("Initializing Vector Store in the background...")
+    task = asyncio.create_task(_warm_up())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+def _require_ready():
+    if rag_app is None:
+        detail = startup["detail"] or "The document index is still loading."
+        raise HTTPException(status_code=503, detail=detail, headers={"Retry-After": "5"})
+
+@app.get("/healthz")
+async def healthz():
+    # Liveness: the process is up and serving requests.
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    # Readiness: the pipeline is imported and the index is loaded.
+    status_code = 200 if rag_app is not None else 503
+    return JSONResponse(startup, status_code=status_code)
+
+async def _answer(question: str, history):
+    """
+    Run the graph, going through the answer cache only when there is no chat
+    history (a follow-up question depends on the conversation).
+    """
+    async def run_graph():
+        result = await rag_app.ainvoke({"question": question, "chat_history": history})
+        return {"generation": result["generation"]} if "generation" in result else {}
+
+    if history:
+        return await run_graph()
+    # Cached and concurrent identical questions skip the graph
+    return await answer_cache.get_or_compute(
+        question,
+        run_graph,
+        embed=rag.aembed_question,
+        cacheable=lambda result: "generation" in result,
+    )
+
+async def _compact(session):
+    async with session.lock:
+        await acompact(session, rag.asummarize_history)
+
+def _remember(session, question: str, answer: str):
+    """
+    Record the exchange. Summarizing old turns happens in the background; the
+    session lock makes the next request of the session wait for it.
+    """
+    session.add_exchange(question, answer)
+    if session.needs_compaction():
+        task = asyncio.create_task(_compact(session))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
 
 @app.post("/ask", response_model=AnswerResponse)
 async def ask_question(request: QuestionRequest):
+    _require_ready()
     try:
-        inputs = {"question": request.question}
-        
-        # Invoke the LangGraph app
+        session = sessions.get_or_create(request.session_id)
+        trace = start_trace()
+
+        # Invoke the LangGraph app asynchronously so the event loop keeps serving
+        # other requests while this one waits on the LLM.
         # The graph returns the final state. We expect 'generation' key in it.
-        final_result = rag_app.invoke(inputs)
+        async with session.lock:
+            final_result = await _answer(request.question, session.history())
+            if "generation" in final_result:
+                _remember(session, request.question, final_result["generation"])
+        
+        trace_summary = trace.summary() if request.trace else None
         
         if "generation" in final_result:
             return AnswerResponse(
                 answer=final_result["generation"],
                 success=True,
-                message="Answer found in the documents."
+                message="Answer found in the documents.",
+                session_id=session.id,
+                trace=trace_summary
             )
         else:
             return AnswerResponse(
-                answer="I could not find an answer to your question in the provided documents.",
+                answer=NO_ANSWER_TEXT,
                 success=False,
-                message="No relevant documents found in the database."
+                message=NO_ANSWER_MESSAGE,
+                session_id=session.id,
+                trace=trace_summary
             )
             
     except Exception as e:
         print(f"Error processing request: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _batch_lines(questions: List[str], max_concurrency: int):
+    async for index, question, result in answer_batch(
+        questions, max_concurrency=max_concurrency, answer_cache=answer_cache, graph=rag_app
+    ):
+        if "error" in result:
+            line = {"index": index, "question": question, "success": False, "error": result["error"]}
+        elif "generation" in result:
+            line = {"index": index, "question": question, "answer": result["generation"], "success": True}
+        else:
+            line = {"index": index, "question": question, "answer": NO_ANSWER_TEXT, "success": False,
+                    "message": NO_ANSWER_MESSAGE}
+        yield json.dumps(line, ensure_ascii=False) + "\n"
+
+@app.post("/ask/batch")
+async def ask_batch(request: BatchRequest):
+    """
+    Answer many questions at once; one JSON line per question, in completion order.
+    """
+    if len(request.questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_QUESTIONS} questions per batch.")
+    _require_ready()
+    max_concurrency = max(1, min(request.max_concurrency or BATCH_MAX_CONCURRENCY, BATCH_MAX_CONCURRENCY))
+    return StreamingResponse(
+        _batch_lines(request.questions, max_concurrency),
+        media_type="application/x-ndjson",
+    )
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    if not sessions.delete(session_id):
+        raise HTTPException(status_code=404, detail="Session not found.")
+    return {"deleted": session_id}
+
+@app.get("/metrics")
+async def metrics():
+    # Prometheus scrape endpoint: per-node, LLM and embedding latency histograms
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _route_of(node):
+    # The route is not a node of its own; it is implied by the first node that runs.
+    return {"decompose_query": "rag", "handle_chitchat": "chitchat"}.get(node)
+
+def _chunk_text(message) -> str:
+    content = message.content
+    if isinstance(content, str):
+        return content
+    return "".join(
+        part.get("text", "") if isinstance(part, dict) else str(part)
+        for part in content
+    )
+
+async def _stream_answer(question: str, session):
+    """
+    Run the graph and yield server-sent events: node progress first, then the
+    answer tokens from generate/handle_chitchat as the LLM produces them.
+    """
+    async with session.lock:
+        async for event in _stream_session_answer(question, session):
+            yield event
+
+async def _stream_session_answer(question: str, session):
+    route = None
+    generation = None
+    history = session.history()
+    inputs = {"question": question, "chat_history": history}
+    done = {"success": True, "message": "Answer found in the documents.", "session_id": session.id}
+    try:
+        vector = None
+        if not history:
+            cached, vector = await answer_cache.lookup(question, embed=rag.aembed_question)
+            if cached is not None:
+                yield _sse("progress", {"stage": "cached"})
+                _remember(session, question, cached["generation"])
+                yield _sse("done", {"answer": cached["generation"], **done})
+                return
+
+        async for mode, chunk in rag_app.astream(inputs, stream_mode=["updates", "messages"]):
+            if mode == "messages":
+                message, metadata = chunk
+                node = metadata.get("langgraph_node")
+                if route is None and _route_of(node):
+                    route = _route_of(node)
+                    yield _sse("progress", {"stage": "routed", "route": route})
+                if node in ANSWER_NODES:
+                    text = _chunk_text(message)
+                    if text:
+                        yield _sse("token", {"text": text})
+                continue
+
+            for node, update in chunk.items():
+                update = update or {}
+                if route is None and _route_of(node):
+                    route = _route_of(node)
+                    yield _sse("progress", {"stage": "routed", "route": route})
+                if node == "plan_query" and route is None:
+                    route = update.get("route")
+                    yield _sse("progress", {"stage": "routed", "route": route})
+                if node in ("decompose_query", "plan_query") and "sub_questions" in update:
+                    yield _sse("progress", {"stage": "decomposed", "sub_questions": update.get("sub_questions", [])})
+                elif node == "route_partitions":
+                    yield _sse("progress", {"stage": "partitioned", "partitions": update.get("partitions")})
+                elif node == "retrieve":
+                    yield _sse("progress", {"stage": "retrieved", "count": len(update.get("documents", []))})
+                elif node == "grade_documents":
+                    yield _sse("progress", {"stage": "graded", "count": len(update.get("documents", []))})
+                elif node in ANSWER_NODES:
+                    generation = update.get("generation")
+
+        if generation is not None:
+            if not history:
+                answer_cache.put(question, vector, {"generation": generation})
+            yield _sse("done", {"answer": generation, **done})
+            _remember(session, question, generation)
+        else:
+            yield _sse("done", {"answer": NO_ANSWER_TEXT, "success": False, "message": NO_ANSWER_MESSAGE, "session_id": session.id})
+
+    except Exception as e:
+        print(f"Error processing request: {e}")
+        yield _sse("error", {"detail": str(e)})
+
+@app.post("/ask/stream")
+async def ask_question_stream(request: QuestionRequest):
+    _require_ready()
+    session = sessions.get_or_create(request.session_id)
+    return StreamingResponse(
+        _stream_answer(request.question, session),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8000))
     uvicorn.run(app, host="0.0.0.0", port=port)
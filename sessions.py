@@ -0,0 +1,157 @@
+import os
+import time
+import uuid
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, List, Optional
+
+from context_packer import count_tokens, truncate_tokens
+
+# --- Chat Sessions ---
+# Server-side conversation memory for the API. Sessions live in process
+# memory, are evicted after SESSION_IDLE_TTL seconds without use or, past
+# SESSION_MAX_SESSIONS, least recently used first. Each session keeps its
+# recent turns verbatim; when they exceed SESSION_HISTORY_TOKEN_BUDGET tokens
+# the oldest turns are folded into a running summary, so the history sent to
+# decompose_query and handle_chitchat stays bounded.
+
+SESSION_MAX_SESSIONS = int(os.environ.get("SESSION_MAX_SESSIONS", "10000"))
+SESSION_IDLE_TTL = float(os.environ.get("SESSION_IDLE_TTL", "1800"))
+SESSION_HISTORY_TOKEN_BUDGET = int(os.environ.get("SESSION_HISTORY_TOKEN_BUDGET", "800"))
+# Hard caps per session, applied even if summarization fails
+SESSION_MAX_TURNS = int(os.environ.get("SESSION_MAX_TURNS", "20"))
+SESSION_MAX_MESSAGE_CHARS = 2000
+
+SUMMARY_PREFIX = "Önceki konuşmanın özeti: "
+
+
+class Session:
+    def __init__(self, session_id: str):
+        self.id = session_id
+        self.summary = ""
+        self.turns: List[str] = []
+        self.last_used = time.monotonic()
+        # Serializes requests of the same session so history stays consistent.
+        self.lock = asyncio.Lock()
+
+    def history(self) -> List[str]:
+        """
+        Chat history for the graph: the summary (if any) followed by recent turns.
+        """
+        if self.summary:
+            return [SUMMARY_PREFIX + self.summary] + self.turns
+        return list(self.turns)
+
+    def add_exchange(self, question: str, answer: str):
+        self.turns.append(f"Kullanıcı: {question[:SESSION_MAX_MESSAGE_CHARS]}")
+        self.turns.append(f"Asistan: {answer[:SESSION_MAX_MESSAGE_CHARS]}")
+
+    def history_tokens(self) -> int:
+        return sum(count_tokens(turn) for turn in self.history())
+
+    def needs_compaction(self, budget: int = SESSION_HISTORY_TOKEN_BUDGET) -> bool:
+        return len(self.turns) > SESSION_MAX_TURNS or self.history_tokens() > budget
+
+    def oldest_turns(self, budget: int = SESSION_HISTORY_TOKEN_BUDGET) -> int:
+        """
+        Number of oldest turns to fold into the summary so the remaining turns
+        use at most half the budget (always whole exchanges, keeping the last one).
+        """
+        keep = 0
+        keep_tokens = 0
+        for turn in reversed(self.turns):
+            tokens = count_tokens(turn)
+            if keep >= 2 and (keep_tokens + tokens > budget // 2 or keep >= SESSION_MAX_TURNS // 2):
+                break
+            keep_tokens += tokens
+            keep += 1
+        keep -= keep % 2
+        return len(self.turns) - max(keep, min(2, len(self.turns)))
+
+    def apply_summary(self, summary: Optional[str], count: int, budget: int = SESSION_HISTORY_TOKEN_BUDGET):
+        """
+        Replace the `count` oldest turns with `summary`. Without a summary
+        (summarization failed) the turns are simply dropped.
+        """
+        if summary:
+            self.summary = truncate_tokens(summary.strip(), budget // 2)
+        self.turns = self.turns[count:]
+
+
+def compact(session: Session, summarize: Callable[[str, List[str]], str]):
+    """
+    Synchronously fold old turns into the summary if the history is over budget.
+    """
+    if not session.needs_compaction():
+        return
+    count = session.oldest_turns()
+    if not count:
+        return
+    try:
+        summary = summarize(session.summary, session.turns[:count])
+    except Exception as e:
+        print(f"History summarization failed: {e}")
+        summary = None
+    session.apply_summary(summary, count)
+
+
+async def acompact(session: Session, summarize: Callable[[str, List[str]], Awaitable[str]]):
+    """
+    Async version of compact.
+    """
+    if not session.needs_compaction():
+        return
+    count = session.oldest_turns()
+    if not count:
+        return
+    try:
+        summary = await summarize(session.summary, session.turns[:count])
+    except Exception as e:
+        print(f"History summarization failed: {e}")
+        summary = None
+    session.apply_summary(summary, count)
+
+
+class SessionStore:
+    def __init__(
+        self,
+        max_sessions: int = SESSION_MAX_SESSIONS,
+        idle_ttl: float = SESSION_IDLE_TTL,
+    ):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _evict(self, now):
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if len(self._sessions) > self.max_sessions or session.last_used < now - self.idle_ttl:
+                self._sessions.popitem(last=False)
+            else:
+                break
+
+    def get_or_create(self, session_id: Optional[str] = None) -> Session:
+        """
+        Return the live session with this ID, or a new session with a fresh ID
+        when none or an unknown/expired one is given.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            session = self._sessions.get(session_id) if session_id else None
+            if session is None:
+                session = Session(uuid.uuid4().hex)
+                self._sessions[session.id] = session
+            self._sessions.move_to_end(session.id)
+            session.last_used = now
+            self._evict(now)
+        return session
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
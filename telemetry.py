@@ -0,0 +1,298 @@
+import time
+import inspect
+import functools
+import contextvars
+from typing import Dict, List, Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+from langchain_core.callbacks import BaseCallbackHandler
+
+# --- Metrics ---
+# Process-wide Prometheus metrics, exposed by server.py on /metrics.
+
+NODE_LATENCY = Histogram(
+    "rag_node_latency_seconds",
+    "Wall time of each graph node.",
+    ["node"],
+)
+LLM_LATENCY = Histogram(
+    "rag_llm_call_latency_seconds",
+    "Wall time of each LLM call, by the node that made it.",
+    ["node"],
+)
+LLM_TOKENS = Histogram(
+    "rag_llm_call_tokens",
+    "Prompt and completion tokens per LLM call.",
+    ["node", "kind"],
+    buckets=(16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768),
+)
+EMBEDDING_LATENCY = Histogram(
+    "rag_embedding_call_latency_seconds",
+    "Wall time of each upstream embedding call.",
+    ["kind"],
+)
+EMBEDDING_CACHE_LOOKUPS = Counter(
+    "rag_embedding_cache_lookups_total",
+    "Embedding cache lookups by result.",
+    ["result"],
+)
+ANSWER_CACHE_LOOKUPS = Counter(
+    "rag_answer_cache_lookups_total",
+    "Answer cache lookups by result (exact, semantic, coalesced, miss).",
+    ["result"],
+)
+ROUTE_DECISIONS = Counter(
+    "rag_route_decisions_total",
+    "Routing decisions by deciding stage (lexicon, centroid, llm, planner) and route.",
+    ["stage", "route"],
+)
+PARTITION_ROUTES = Counter(
+    "rag_partition_routes_total",
+    "Partition routing decisions by stage (lexicon, centroid, fallback) and searched partitions.",
+    ["stage", "partitions"],
+)
+DECOMPOSITIONS = Counter(
+    "rag_decompositions_total",
+    "How sub-questions were produced (skipped, cached, llm, planner, failed).",
+    ["outcome"],
+)
+GRADE_DECISIONS = Counter(
+    "rag_grade_decisions_total",
+    "Chunk relevance decisions by source (score pre-filter or llm) and verdict.",
+    ["source", "verdict"],
+)
+LLM_QUEUE_DEPTH = Gauge(
+    "rag_llm_queue_depth",
+    "LLM calls waiting for rate-limit capacity in the gateway.",
+)
+LLM_RETRIES = Counter(
+    "rag_llm_retries_total",
+    "LLM calls retried by the gateway, by reason (HTTP status or timeout).",
+    ["reason"],
+)
+DOCUMENT_COUNT = Histogram(
+    "rag_documents",
+    "Documents per request after each pipeline stage.",
+    ["stage"],
+    buckets=(0, 1, 2, 4, 8, 12, 16, 24, 32, 64),
+)
+
+# --- Per-request Trace ---
+
+_current_trace = contextvars.ContextVar("rag_trace", default=None)
+_current_node = contextvars.ContextVar("rag_node", default=None)
+
+
+class Trace:
+    """
+    Breakdown of a single graph run: node timings, LLM and embedding calls and
+    document counts. Tasks inherit the trace through the context, and so do
+    worker threads when the work is submitted with the caller's context
+    (agentic_rag.run_blocking, asyncio.to_thread), so it collects everything
+    one request does.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.nodes: List[Dict] = []
+        self.llm_calls: List[Dict] = []
+        self.embedding_calls: List[Dict] = []
+        self.documents: Dict[str, int] = {}
+        self.answer_cache: Optional[str] = None
+
+    def summary(self) -> Dict:
+        return {
+            "total_seconds": round(time.perf_counter() - self.started, 4),
+            "nodes": self.nodes,
+            "llm_calls": len(self.llm_calls),
+            "llm_seconds": round(sum(c["seconds"] for c in self.llm_calls), 4),
+            "prompt_tokens": sum(c["prompt_tokens"] for c in self.llm_calls),
+            "completion_tokens": sum(c["completion_tokens"] for c in self.llm_calls),
+            "embedding_calls": len(self.embedding_calls),
+            "embedding_seconds": round(sum(c["seconds"] for c in self.embedding_calls), 4),
+            "documents": self.documents,
+            "answer_cache": self.answer_cache,
+        }
+
+    def format(self) -> str:
+        summary = self.summary()
+        lines = ["--- Trace ---"]
+        for node in summary["nodes"]:
+            calls = [c for c in self.llm_calls if c["node"] == node["node"]]
+            lines.append(
+                f"{node['node']:<18} {node['seconds']:>8.3f}s  "
+                f"llm_calls={len(calls)} "
+                f"tokens={sum(c['prompt_tokens'] for c in calls)}/{sum(c['completion_tokens'] for c in calls)}"
+            )
+        lines.append(
+            f"{'total':<18} {summary['total_seconds']:>8.3f}s  "
+            f"llm_calls={summary['llm_calls']} "
+            f"tokens={summary['prompt_tokens']}/{summary['completion_tokens']} "
+            f"embedding_calls={summary['embedding_calls']}"
+        )
+        if summary["answer_cache"]:
+            lines.append(f"answer cache: {summary['answer_cache']}")
+        if summary["documents"]:
+            counts = ", ".join(f"{k}={v}" for k, v in summary["documents"].items())
+            lines.append(f"documents: {counts}")
+        return "\n".join(lines)
+
+
+def start_trace() -> Trace:
+    """
+    Start collecting a trace for the current request/context.
+    """
+    trace = Trace()
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def _record_node(node: str, seconds: float):
+    NODE_LATENCY.labels(node=node).observe(seconds)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.nodes.append({"node": node, "seconds": round(seconds, 4)})
+
+
+def traced_node(name: str):
+    """
+    Decorator timing a sync or async graph node and attributing the LLM calls
+    it makes to it.
+    """
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                token = _current_node.set(name)
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    _record_node(name, time.perf_counter() - start)
+                    _current_node.reset(token)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            token = _current_node.set(name)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _record_node(name, time.perf_counter() - start)
+                _current_node.reset(token)
+        return wrapper
+    return decorator
+
+
+def record_documents(stage: str, count: int):
+    DOCUMENT_COUNT.labels(stage=stage).observe(count)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.documents[stage] = count
+
+
+def record_embedding_call(kind: str, seconds: float, texts: int):
+    EMBEDDING_LATENCY.labels(kind=kind).observe(seconds)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.embedding_calls.append({"kind": kind, "seconds": round(seconds, 4), "texts": texts})
+
+
+def record_embedding_cache(hits: int, misses: int):
+    if hits:
+        EMBEDDING_CACHE_LOOKUPS.labels(result="hit").inc(hits)
+    if misses:
+        EMBEDDING_CACHE_LOOKUPS.labels(result="miss").inc(misses)
+
+
+def record_answer_cache(result: str):
+    ANSWER_CACHE_LOOKUPS.labels(result=result).inc()
+    trace = _current_trace.get()
+    if trace is not None and trace.answer_cache is None:
+        trace.answer_cache = result
+
+
+def record_route_decision(stage: str, route: str):
+    ROUTE_DECISIONS.labels(stage=stage, route=route).inc()
+
+
+def record_partition_route(stage: str, partitions: str):
+    PARTITION_ROUTES.labels(stage=stage, partitions=partitions).inc()
+
+
+def record_decomposition(outcome: str):
+    DECOMPOSITIONS.labels(outcome=outcome).inc()
+
+
+def record_grade_decisions(source: str, verdicts):
+    for verdict in verdicts:
+        label = "malformed" if verdict is None else ("relevant" if verdict else "irrelevant")
+        GRADE_DECISIONS.labels(source=source, verdict=label).inc()
+
+
+def record_llm_retry(reason: str):
+    LLM_RETRIES.labels(reason=reason).inc()
+
+
+def _token_usage(response):
+    """
+    Extract (prompt_tokens, completion_tokens) from an LLMResult.
+    """
+    for generations in response.generations:
+        for generation in generations:
+            message = getattr(generation, "message", None)
+            usage = getattr(message, "usage_metadata", None)
+            if usage:
+                return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+
+
+class LLMTelemetryHandler(BaseCallbackHandler):
+    """
+    Callback handler recording latency and token usage of every LLM call.
+    """
+
+    # Run in the caller's context so the current trace and node are visible.
+    run_inline = True
+
+    def __init__(self):
+        self._starts = {}
+
+    def _start(self, run_id):
+        self._starts[run_id] = (time.perf_counter(), _current_node.get() or "unknown")
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        started = self._starts.pop(run_id, None)
+        if started is None:
+            return
+        start, node = started
+        seconds = time.perf_counter() - start
+        prompt_tokens, completion_tokens = _token_usage(response)
+
+        LLM_LATENCY.labels(node=node).observe(seconds)
+        LLM_TOKENS.labels(node=node, kind="prompt").observe(prompt_tokens)
+        LLM_TOKENS.labels(node=node, kind="completion").observe(completion_tokens)
+
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.llm_calls.append({
+                "node": node,
+                "seconds": round(seconds, 4),
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+            })
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._starts.pop(run_id, None)
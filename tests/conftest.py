@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Tests import the root-level modules directly; agentic_rag refuses to load
+# without an API key, which no test uses.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GOOGLE_API_KEY", "test")
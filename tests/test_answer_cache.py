@@ -0,0 +1,31 @@
+import asyncio
+
+from answer_cache import AnswerCache
+
+
+def test_waiters_recompute_when_the_leader_is_cancelled():
+    async def scenario():
+        cache = AnswerCache()
+        started = asyncio.Event()
+        calls = []
+
+        async def slow():
+            calls.append("leader")
+            started.set()
+            await asyncio.sleep(10)
+
+        async def fast():
+            calls.append("waiter")
+            return {"generation": "cevap"}
+
+        leader = asyncio.create_task(cache.get_or_compute("Sınav ne zaman?", slow))
+        await started.wait()
+        waiter = asyncio.create_task(cache.get_or_compute("sınav ne zaman", fast))
+        await asyncio.sleep(0)
+        leader.cancel()
+
+        assert await waiter == {"generation": "cevap"}
+        assert leader.cancelled()
+        assert calls == ["leader", "waiter"]
+
+    asyncio.run(scenario())
@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+
+from batch import QueryBatcher
+
+
+def test_flush_failure_reaches_the_waiters():
+    async def scenario():
+        batcher = QueryBatcher(window=0)
+
+        def broken_search(scope, queries):
+            raise RuntimeError("flush failed")
+
+        batcher._search = broken_search
+        with pytest.raises(RuntimeError, match="flush failed"):
+            await asyncio.wait_for(batcher.search(["sınav ne zaman"]), timeout=5)
+        assert not batcher._flush_tasks
+
+    asyncio.run(scenario())
+
+
+def test_flush_task_is_referenced_until_done():
+    async def scenario():
+        batcher = QueryBatcher(window=0)
+        release = asyncio.Event()
+
+        async def search(scope, queries):
+            await release.wait()
+            for query in queries:
+                batcher._results[(scope, query)].set_result([query])
+
+        batcher._search = search
+        waiter = asyncio.create_task(batcher.search(["sınav ne zaman"]))
+        await asyncio.sleep(0.01)
+        assert len(batcher._flush_tasks) == 1
+        release.set()
+        assert await waiter == [["sınav ne zaman"]]
+
+    asyncio.run(scenario())
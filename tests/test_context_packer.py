@@ -0,0 +1,27 @@
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import context_packer
+
+
+def test_encoding_is_loaded_once_under_concurrent_first_calls(monkeypatch):
+    loads = []
+    gate = threading.Barrier(8)
+
+    class FakeTiktoken:
+        @staticmethod
+        def get_encoding(name):
+            loads.append(name)
+            return None
+
+    monkeypatch.setitem(sys.modules, "tiktoken", FakeTiktoken)
+    monkeypatch.setattr(context_packer, "_encoding_value", context_packer._UNSET)
+
+    def first_call(_):
+        gate.wait()
+        return context_packer.count_tokens("merhaba dünya")
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        assert set(pool.map(first_call, range(8))) == {4}
+    assert loads == [context_packer.TIKTOKEN_ENCODING]
@@ -0,0 +1,52 @@
+from google.genai.errors import ClientError
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_google_genai.chat_models import GoogleRateLimitError
+
+import llm_gateway
+from llm_gateway import LLMGateway, TokenBucket, is_retryable, status_code
+
+
+def gemini_rate_limit_error():
+    # Raised the way langchain_google_genai does: the HTTP error is the cause.
+    try:
+        try:
+            raise ClientError(429, {"error": {"code": 429, "message": "Resource exhausted", "status": "RESOURCE_EXHAUSTED"}})
+        except ClientError as e:
+            raise GoogleRateLimitError("Error calling model 'gemini-2.0-flash' (RESOURCE_EXHAUSTED)") from e
+    except GoogleRateLimitError as e:
+        return e
+
+
+class RateLimitedOnce(BaseChatModel):
+    calls: int = 0
+
+    @property
+    def _llm_type(self):
+        return "rate-limited-once"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        if self.calls == 1:
+            raise gemini_rate_limit_error()
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="ok"))])
+
+
+def test_status_code_of_gemini_rate_limit_error():
+    error = gemini_rate_limit_error()
+    assert status_code(error) == 429
+    assert is_retryable(error)
+
+
+def test_gemini_rate_limit_drains_request_bucket_and_retries(monkeypatch):
+    monkeypatch.setattr(llm_gateway.random, "uniform", lambda low, high: 0.0)
+    drained = []
+    bucket = TokenBucket(600)
+    monkeypatch.setattr(bucket, "drain", lambda: drained.append(True))
+    inner = RateLimitedOnce()
+    gateway = LLMGateway(inner=inner, requests_bucket=bucket, tokens_bucket=TokenBucket(0))
+
+    assert gateway.invoke("merhaba").content == "ok"
+    assert inner.calls == 2
+    assert drained == [True]
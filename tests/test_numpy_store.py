@@ -0,0 +1,58 @@
+import os
+
+import numpy as np
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from numpy_store import NumpyVectorStore
+
+
+def make_store(tmp_path):
+    store = NumpyVectorStore(DeterministicFakeEmbedding(size=8), str(tmp_path))
+    store.add_texts(
+        ["sertifika indirme", "sınav tarihi", "yüklenici yükümlülükleri"],
+        [{"source_folder": "database"}, {"source_folder": "database"}, {"source_folder": "depo-pdf-belgeler"}],
+        ids=["a", "b", "c"],
+    )
+    return store
+
+
+def test_retriever_applies_metadata_filter(tmp_path):
+    store = make_store(tmp_path)
+    retriever = store.as_retriever(search_kwargs={"k": 3, "filter": {"source_folder": "depo-pdf-belgeler"}})
+    assert [doc.id for doc in retriever.invoke("yüklenici")] == ["c"]
+
+
+def test_append_after_torn_row_keeps_vectors_aligned(tmp_path):
+    store = make_store(tmp_path)
+    path = store._vectors_path()
+    # An interrupted write left half a row at the end of the file.
+    with open(path, "ab") as f:
+        f.write(b"\0" * 16)
+    store.add_texts(["ihale teklif şartları"], [{"source_folder": "depo-pdf-belgeler"}], ids=["d"])
+
+    assert os.path.getsize(path) == 4 * 4 * 8
+    expected = np.asarray(store.embeddings.embed_documents(["ihale teklif şartları"]), dtype=np.float32)
+    expected /= np.linalg.norm(expected)
+    stored = store.get(ids=["d"], include=["embeddings"])["embeddings"]
+    assert np.allclose(stored, expected)
+
+
+def test_incremental_snapshot_matches_full_refresh(tmp_path):
+    store = make_store(tmp_path)
+    store.add_texts(["sınav tarihi", "ödeme iadesi"], ids=["b", "e"])
+    store.delete(["a"])
+
+    live, count = store._snapshot.live.copy(), store._snapshot.count
+    store._refresh()
+    assert np.array_equal(live, store._snapshot.live)
+    assert count == store._snapshot.count == 3
+
+
+def test_repeated_upserts_are_compacted(tmp_path):
+    store = make_store(tmp_path)
+    for _ in range(10):
+        store.add_texts(["sertifika indirme", "sınav tarihi"], ids=["a", "b"])
+
+    assert len(store._snapshot.live) < 2 * 3
+    assert os.path.getsize(store._vectors_path()) == 4 * 8 * len(store._snapshot.live)
+    assert sorted(store.get()["ids"]) == ["a", "b", "c"]
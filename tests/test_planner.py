@@ -0,0 +1,37 @@
+import asyncio
+import json
+
+import pytest
+from langchain_core.language_models import FakeListChatModel
+
+import agentic_rag as rag
+from fast_router import FastRouter
+
+QUESTION = "Bu konuda bana yardımcı olur musun?"
+
+
+def logged_stages(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line)["stage"] for line in f]
+
+
+@pytest.fixture
+def router_log(tmp_path, monkeypatch):
+    path = tmp_path / "router.jsonl"
+    monkeypatch.setattr(rag, "fast_router", FastRouter(use_centroids=False, log_path=str(path)))
+    return path
+
+
+@pytest.mark.parametrize("async_node", [False, True])
+@pytest.mark.parametrize("responses, stage", [
+    (['{"route": "CHITCHAT", "question": "' + QUESTION + '", "sub_questions": []}'], "planner"),
+    (["geçersiz plan", "CHITCHAT"], "llm"),
+])
+def test_plan_query_logs_the_route_once(router_log, monkeypatch, responses, stage, async_node):
+    monkeypatch.setattr(rag, "llm", FakeListChatModel(responses=responses))
+    state = {"question": QUESTION, "chat_history": []}
+
+    result = asyncio.run(rag.aplan_query(state)) if async_node else rag.plan_query(state)
+
+    assert result["route"] == "chitchat"
+    assert logged_stages(router_log) == [stage]
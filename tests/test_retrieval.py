@@ -0,0 +1,38 @@
+import asyncio
+
+from langchain_core.documents import Document
+
+import agentic_rag as rag
+
+
+def test_select_documents_fuses_identical_text_from_different_files():
+    # The same PDF in database/ and depo-pdf-belgeler/ gives chunks with
+    # different IDs but identical text.
+    text = "Yüklenici, teslim süresine uymakla yükümlüdür."
+    first = Document(id="a", page_content=text, metadata={"source_folder": "database"})
+    copy = Document(id="b", page_content=text, metadata={"source_folder": "depo-pdf-belgeler"})
+    other = Document(id="c", page_content="Sertifika başvurusu portal üzerinden yapılır.")
+
+    documents, scores = rag.select_documents([[(first, 0.4), (other, 0.2)], [(copy, 0.7)]])
+
+    texts = [doc.page_content for doc in documents]
+    assert texts.count(text) == 1
+    assert len(documents) == 2
+    assert scores[texts.index(text)] == 0.7
+
+
+def test_trace_counts_async_embedding_calls(tmp_path, monkeypatch):
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+
+    from embedding_cache import CachedEmbeddings
+    from telemetry import start_trace
+
+    embeddings = CachedEmbeddings(DeterministicFakeEmbedding(size=8), path=str(tmp_path / "cache.sqlite"))
+    monkeypatch.setattr(rag, "embeddings", embeddings)
+
+    async def embed():
+        trace = start_trace()
+        await rag.aembed_question("Sertifikamı nereden indiririm?")
+        return trace.summary()
+
+    assert asyncio.run(embed())["embedding_calls"] == 1
@@ -1,109 +1,226 @@
 import os
+import sys
+import json
+import time
+import argparse
 import numpy as np
-import matplotlib.pyplot as plt
-from sklearn.decomposition import PCA
-from sklearn.manifold import TSNE
-from sklearn.cluster import KMeans
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from dotenv import load_dotenv
 
+# --- 2D Vector Map ---
+# Plots every chunk of the persisted index. Vectors are read from the vector
+# store, so nothing is embedded again. Randomized PCA reduces them to
+# VIS_PCA_DIM dimensions, and MiniBatchKMeans on the reduced vectors colors the
+# topics. Barnes-Hut t-SNE lays out a random sample of at most --sample
+# chunks. Every other chunk is placed at the mean position of its nearest
+# sampled neighbours in PCA space, so the cost stays flat as the corpus grows.
+# `--layout pca` skips t-SNE and plots the first two principal components.
+# Coordinates are saved to --coords together with the index version and the
+# settings, and later runs reuse them until either changes.
+
+VIS_PCA_DIM = 50
+VIS_NEIGHBORS = 5
+# Chunks fetched per Chroma read
+VIS_PAGE_SIZE = 5000
+VIS_COORDS_VERSION = 1
+
 # Renkler
 GREEN = "\033[92m"
 BLUE = "\033[94m"
 RESET = "\033[0m"
 
-def visualize_2d():
-    load_dotenv()
-    if "GOOGLE_API_KEY" not in os.environ:
-        print("API Key eksik!")
-        return
 
-    print(f"{BLUE}1. VERİLER OKUNUYOR...{RESET}")
-    pdf_files = [f for f in os.listdir("./database") if f.endswith(".pdf")]
-    if not pdf_files:
-        print("PDF dosyası bulunamadı.")
-        return
+def load_vectors(store, backend: str):
+    """
+    IDs, texts and the vector matrix of every indexed chunk.
+    """
+    include = ["embeddings", "documents"]
+    if backend == "numpy":
+        data = store.get(include=include)
+        return data["ids"], data["documents"], np.asarray(data["embeddings"], dtype=np.float32)
 
-    all_chunks = []
-    
-    # İlk 5 PDF'i alalım (Performans ve görsel netlik için)
-    for pdf_file in pdf_files[:5]:
-        path = os.path.join("./database", pdf_file)
-        print(f" - {pdf_file}")
-        try:
-            loader = PyPDFLoader(path)
-            docs = loader.load()
-            splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-            splits = splitter.split_documents(docs)
-            all_chunks.extend(splits)
-        except Exception as e:
-            print(f"Hata ({pdf_file}): {e}")
-
-    # Çok fazla nokta olmasın, grafik karışmasın (Max 150 nokta)
-    if len(all_chunks) > 150:
-        import random
-        random.shuffle(all_chunks)
-        all_chunks = all_chunks[:150]
-
-    print(f"Toplam {len(all_chunks)} veri noktası görselleştirilecek.")
-
-    print(f"{BLUE}2. VEKTÖRLER OLUŞTURULUYOR...{RESET}")
-    embeddings = GoogleGenerativeAIEmbeddings(model="models/gemini-embedding-001")
-    chunk_texts = [d.page_content for d in all_chunks]
-    vectors = embeddings.embed_documents(chunk_texts)
-    X = np.array(vectors)
-
-    print(f"{BLUE}3. BOYUT İNDİRGEME (3072D -> 2D) VE KÜMELEME...{RESET}")
-    
-    # Önce K-Means ile renkleri belirleyelim
-    n_clusters = 4
-    kmeans = KMeans(n_clusters=n_clusters, random_state=42)
-    labels = kmeans.fit_predict(X)
-
-    # t-SNE ile 2 Boyuta İndir (Daha iyi görsel ayrıştırma sağlar)
-    # Perplexity değerini veri sayısına göre ayarlayalım
-    perp = min(30, len(all_chunks) - 1)
-    tsne = TSNE(n_components=2, random_state=42, perplexity=perp, init='pca', learning_rate='auto')
-    X_2d = tsne.fit_transform(X)
-
-    print(f"{BLUE}4. GRAFİK ÇİZİLİYOR...{RESET}")
-    plt.figure(figsize=(10, 8))
-    
-    # Her kümeyi farklı renkte ve şekilde çiz
-    colors = ['#FF5733', '#33FF57', '#3357FF', '#F333FF', '#FFFF33']
+    ids, texts, pages = [], [], []
+    offset = 0
+    while True:
+        data = store.get(include=include, limit=VIS_PAGE_SIZE, offset=offset)
+        if not data["ids"]:
+            break
+        ids.extend(data["ids"])
+        texts.extend(data["documents"])
+        pages.append(np.asarray(data["embeddings"], dtype=np.float32))
+        offset += len(data["ids"])
+    matrix = np.vstack(pages) if pages else np.zeros((0, 0), dtype=np.float32)
+    return ids, texts, matrix
+
+
+def project(vectors, layout: str, clusters: int, sample: int, seed: int = 42):
+    """
+    2-D coordinates and a cluster label for every row of `vectors`.
+    """
+    from sklearn.cluster import MiniBatchKMeans
+    from sklearn.decomposition import PCA
+
+    n = len(vectors)
+    dims = min(VIS_PCA_DIM, n, vectors.shape[1])
+    reduced = PCA(n_components=dims, svd_solver="randomized", random_state=seed).fit_transform(vectors)
+    labels = MiniBatchKMeans(
+        n_clusters=min(clusters, n), batch_size=2048, n_init=3, random_state=seed
+    ).fit_predict(reduced)
+    if layout == "pca" or n < 4:
+        return reduced[:, :2].astype(np.float32), labels
+
+    from sklearn.manifold import TSNE
+    from sklearn.neighbors import NearestNeighbors
+
+    rng = np.random.default_rng(seed)
+    anchors = np.sort(rng.choice(n, size=min(sample, n), replace=False))
+    anchor_coords = TSNE(
+        n_components=2,
+        perplexity=min(30, len(anchors) - 1),
+        init="pca",
+        learning_rate="auto",
+        method="barnes_hut",
+        random_state=seed,
+    ).fit_transform(reduced[anchors])
+
+    coords = np.empty((n, 2), dtype=np.float32)
+    coords[anchors] = anchor_coords
+    rest = np.setdiff1d(np.arange(n), anchors)
+    if len(rest):
+        neighbors = NearestNeighbors(n_neighbors=min(VIS_NEIGHBORS, len(anchors))).fit(reduced[anchors])
+        _, nearest = neighbors.kneighbors(reduced[rest])
+        coords[rest] = anchor_coords[nearest].mean(axis=1)
+    return coords, labels
+
+
+def load_coords(path: str, settings: dict):
+    """
+    Saved (coords, labels, snippets) if they were computed with `settings`.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            if json.loads(str(data["settings"])) != settings:
+                return None
+            return data["coords"], data["labels"], [str(snippet) for snippet in data["snippets"]]
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Koordinat dosyası okunamadı ({path}): {e}")
+        return None
+
+
+def save_coords(path: str, settings: dict, ids, coords, labels, snippets):
+    tmp = path + ".tmp.npz"
+    np.savez(
+        tmp,
+        settings=np.array(json.dumps(settings, sort_keys=True)),
+        ids=np.array(ids),
+        coords=coords,
+        labels=labels.astype(np.int32),
+        snippets=np.array(snippets),
+    )
+    os.replace(tmp, path)
+
+
+def plot(coords, labels, snippets, layout: str, output_path: str, seed: int = 42):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    n = len(coords)
+    clusters = int(labels.max()) + 1 if n else 0
+    cmap = plt.get_cmap("tab10" if clusters <= 10 else "tab20")
     markers = ['o', 's', '^', 'D', 'v']
-    
-    for i in range(n_clusters):
-        # Bu kümeye ait noktaları seç
+    # Smaller, more transparent points as the corpus grows
+    size = float(np.clip(20000 / max(n, 1), 2, 80))
+    alpha = 0.7 if n < 2000 else 0.4
+
+    plt.figure(figsize=(10, 8))
+    for i in range(clusters):
         mask = labels == i
         plt.scatter(
-            X_2d[mask, 0], 
-            X_2d[mask, 1], 
-            c=colors[i % len(colors)], 
+            coords[mask, 0],
+            coords[mask, 1],
+            color=cmap(i % cmap.N),
             label=f'Konu Kümesi {i+1}',
-            alpha=0.7,
-            s=80,
-            edgecolors='k',
-            marker=markers[i % len(markers)]
+            alpha=alpha,
+            s=size,
+            edgecolors='k' if n < 2000 else 'none',
+            marker=markers[i % len(markers)],
+            rasterized=n >= 2000,
         )
 
-    plt.title('PDF Vektörlerinin 2D Uzayda Dağılımı (t-SNE)', fontsize=15)
-    plt.xlabel('Boyut 1 (t-SNE)', fontsize=12)
-    plt.ylabel('Boyut 2 (t-SNE)', fontsize=12)
-    plt.legend()
+    name = "t-SNE" if layout == "tsne" else "PCA"
+    plt.title(f'PDF Vektörlerinin 2D Uzayda Dağılımı ({name}, {n} parça)', fontsize=15)
+    plt.xlabel(f'Boyut 1 ({name})', fontsize=12)
+    plt.ylabel(f'Boyut 2 ({name})', fontsize=12)
+    plt.legend(markerscale=max(1.0, 40 / size))
     plt.grid(True, linestyle='--', alpha=0.3)
-    
+
     # Bazı noktalara örnek metin ekle (Annotate)
-    for i in range(5): # Rastgele 5 noktaya etiket
-        idx = np.random.randint(0, len(all_chunks))
-        txt = all_chunks[idx].page_content[:20] + "..."
-        plt.annotate(txt, (X_2d[idx, 0], X_2d[idx, 1]), fontsize=8, alpha=0.8)
+    rng = np.random.default_rng(seed)
+    for idx in rng.choice(n, size=min(5, n), replace=False):
+        plt.annotate(snippets[idx], (coords[idx, 0], coords[idx, 1]), fontsize=8, alpha=0.8)
 
-    output_path = "vector_plot_2d.png"
     plt.savefig(output_path, dpi=300, bbox_inches='tight')
-    print(f"\n{GREEN}2D Grafik kaydedildi: {output_path}{RESET}")
+    plt.close()
+
+
+def visualize_2d():
+    parser = argparse.ArgumentParser(description="Plot every indexed chunk in 2D.")
+    parser.add_argument("--layout", choices=["tsne", "pca"], default="tsne")
+    parser.add_argument("--clusters", type=int, default=6)
+    parser.add_argument("--sample", type=int, default=3000, help="chunks laid out by t-SNE; the rest are placed by neighbours")
+    parser.add_argument("--coords", default="vector_coords.npz", help="cached coordinates")
+    parser.add_argument("--refresh", action="store_true", help="recompute even if cached coordinates match")
+    parser.add_argument("--output", default="vector_plot_2d.png")
+    args = parser.parse_args()
+
+    load_dotenv()
+    if "GOOGLE_API_KEY" not in os.environ:
+        print("API Key eksik!")
+        return
+
+    # Only opens the persisted store; no embedding calls are made.
+    from agentic_rag import open_vectorstore, VECTORSTORE_BACKEND, VECTORSTORE_DIR
+    from ingestion import indexed_chunk_count, manifest_version
+
+    if not indexed_chunk_count(VECTORSTORE_DIR):
+        print(f"{VECTORSTORE_DIR} içinde indeks bulunamadı. Önce: python build_vector_db.py")
+        sys.exit(1)
+
+    settings = {
+        "format": VIS_COORDS_VERSION,
+        "backend": VECTORSTORE_BACKEND,
+        "index_version": manifest_version(VECTORSTORE_DIR),
+        "layout": args.layout,
+        "clusters": args.clusters,
+        "sample": args.sample,
+    }
+    cached = None if args.refresh else load_coords(args.coords, settings)
+
+    if cached is not None:
+        print(f"{BLUE}1. KAYITLI KOORDİNATLAR KULLANILIYOR ({args.coords})...{RESET}")
+        coords, labels, snippets = cached
+    else:
+        print(f"{BLUE}1. VEKTÖRLER İNDEKSTEN OKUNUYOR ({VECTORSTORE_DIR})...{RESET}")
+        start = time.perf_counter()
+        ids, texts, vectors = load_vectors(open_vectorstore(VECTORSTORE_DIR), VECTORSTORE_BACKEND)
+        print(f"Toplam {len(ids)} veri noktası, {vectors.shape[1] if len(ids) else 0} boyut ({time.perf_counter() - start:.2f}s)")
+        if len(ids) < 2:
+            print("Görselleştirmek için yeterli veri yok.")
+            return
+
+        print(f"{BLUE}2. BOYUT İNDİRGEME (PCA -> {args.layout.upper()}) VE KÜMELEME...{RESET}")
+        start = time.perf_counter()
+        coords, labels = project(vectors, args.layout, args.clusters, args.sample)
+        print(f"Projeksiyon tamamlandı ({time.perf_counter() - start:.2f}s)")
+        snippets = [" ".join(text.split())[:20] + "..." for text in texts]
+        save_coords(args.coords, settings, ids, coords, labels, snippets)
+        print(f"Koordinatlar kaydedildi: {args.coords}")
+
+    print(f"{BLUE}3. GRAFİK ÇİZİLİYOR...{RESET}")
+    plot(coords, labels, snippets, args.layout, args.output)
+    print(f"\n{GREEN}2D Grafik kaydedildi: {args.output}{RESET}")
     print("Not: Noktaların birbirine yakın olması, içeriklerinin benzer olduğunu gösterir.")
 
 if __name__ == "__main__":